@@ -0,0 +1,39 @@
+"""Build and query times of the what-can-I-cook bitsets at 10k and 100k recipes"""
+import time
+
+import numpy as np
+
+from common import setup_django
+
+setup_django()
+
+from recipe.cookable import CookableIndex  # noqa: E402
+
+INGREDIENTS = 2000
+PER_RECIPE = 8
+QUERIES = 200
+
+
+def bench(recipes):
+    rng = np.random.default_rng(0)
+    # a skewed catalog: some ingredients are in many recipes, most are rare
+    popularity = 1 / np.arange(1, INGREDIENTS + 1)
+    pair_ingredients = rng.choice(INGREDIENTS, size=recipes * PER_RECIPE, p=popularity / popularity.sum())
+    pair_recipes = np.repeat(np.arange(recipes), PER_RECIPE)
+
+    started = time.perf_counter()
+    index = CookableIndex.from_pairs(np.arange(recipes), pair_recipes, pair_ingredients)
+    build = time.perf_counter() - started
+
+    on_hand = [set(rng.choice(200, size=40).tolist()) for _ in range(QUERIES)]
+    started = time.perf_counter()
+    for ingredients in on_hand:
+        index.query(ingredients, max_missing=2, limit=50)
+    query = (time.perf_counter() - started) / QUERIES
+
+    print(f'{recipes:>7} recipes: build {build * 1000:8.1f} ms, '
+          f'query {query * 1000:6.2f} ms, index {index.nbytes / 1024 / 1024:6.1f} MiB')
+
+
+for size in (10000, 100000):
+    bench(size)
@@ -0,0 +1,41 @@
+"""Plan a week of a large catalog with recipe/planner.py, the variety found with more or less time"""
+import random
+
+from common import setup_django, measure
+
+setup_django()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+
+from main_app.models import Recipe  # noqa: E402
+from recipe import planner  # noqa: E402
+
+RECIPES = 20000
+TAGS = 200
+INGREDIENTS = 300
+
+
+def sample_recipe(i):
+    # recipes with more ingredients cost more, and popular ingredients are in many recipes
+    ingredient_ids = set(random.choices(range(1, INGREDIENTS + 1), weights=weights, k=random.randint(3, 12)))
+    return Recipe(
+        user=user, title=f'recipe {i}', time_minutes=random.randint(5, 120),
+        price=2 * len(ingredient_ids) + random.randint(0, 10),
+        tag_ids=sorted(random.sample(range(1, TAGS + 1), 3)), ingredient_ids=sorted(ingredient_ids),
+    )
+
+
+random.seed(1)
+weights = [1 / i for i in range(1, INGREDIENTS + 1)]
+user = get_user_model().objects.create_user('bench@example.com', 'benchpass123')
+Recipe.objects.bulk_create((sample_recipe(i) for i in range(RECIPES)), batch_size=5000)
+queryset = Recipe.objects.filter(user=user, time_minutes__lte=60)
+
+with measure('load the candidates', 1):
+    candidates = planner.Candidates.load(queryset)
+print(f'{len(candidates)} candidates')
+
+for milliseconds in (0, 50, 200, 1000):
+    with measure(f'plan 7 days in {milliseconds} ms', 1):
+        plan = planner.plan_meals(queryset, days=7, budget=140, seconds=milliseconds / 1000)
+    print(f"  variety {plan['variety']}, price {plan['total_price']}, {plan['swaps']} swaps, complete {plan['complete']}")
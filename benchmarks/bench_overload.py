@@ -0,0 +1,85 @@
+"""Goodput with and without the load shedding of DeadlineMiddleware as the clients outnumber the database"""
+import queue
+import threading
+import time
+
+from common import setup_django
+
+setup_django()
+
+from django.http import HttpResponse  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+
+from core.deadlines import DeadlineExceeded  # noqa: E402
+from core.middleware import DeadlineMiddleware  # noqa: E402
+
+CAPACITY = 4  # requests the "database" works on at the same time
+SERVICE = 0.01  # seconds of work of one request
+TIMEOUT = 0.05  # seconds the clients wait for an answer
+DURATION = 2
+CLIENTS = (4, 8, 16, 48, 96)
+
+
+def goodput(clients, shedding):
+    """Requests per second answered within the timeout of the clients"""
+    jobs = queue.Queue()
+
+    def work():
+        # the "database" works through its queue in order, CAPACITY requests at a time
+        for deadline, done in iter(jobs.get, None):
+            if deadline is None or not deadline.expired:
+                time.sleep(SERVICE)
+            done.set()
+
+    def database(request):
+        deadline, done = getattr(request, 'deadline', None), threading.Event()
+        jobs.put((deadline, done))
+        if not done.wait(deadline.remaining() if deadline else None):
+            raise DeadlineExceeded('The query ran out of time.')
+        return HttpResponse()
+
+    app = database
+    if shedding:
+        with override_settings(REQUEST_DEADLINES={
+            'TIMEOUT_MS': TIMEOUT * 1000, 'MAX_IN_FLIGHT': CAPACITY * 2, 'EXPENSIVE_SHARE': 1,
+        }):
+            middleware = DeadlineMiddleware(database)
+
+        def app(request):
+            try:
+                return middleware(request)
+            except DeadlineExceeded as exc:
+                return middleware.process_exception(request, exc)
+
+    good = []
+    stop = time.monotonic() + DURATION
+    factory = RequestFactory()
+
+    def client():
+        while time.monotonic() < stop:
+            started = time.monotonic()
+            res = app(factory.get('/api/recipe/recipes/'))
+            if res.status_code == 200 and time.monotonic() - started <= TIMEOUT:
+                good.append(1)
+            elif res.status_code == 503:
+                time.sleep(SERVICE)  # Retry-After, scaled down
+
+    workers = [threading.Thread(target=work) for _ in range(CAPACITY)]
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in workers + threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for _ in workers:
+        jobs.put(None)
+    for thread in workers:
+        thread.join()
+    return len(good) / DURATION
+
+
+print(f'capacity {CAPACITY / SERVICE:.0f} requests/s, clients time out after {TIMEOUT * 1000:.0f} ms')
+for clients in CLIENTS:
+    print(
+        f'{clients:>4} clients: {goodput(clients, shedding=True):8.0f} good/s shedding'
+        f' {goodput(clients, shedding=False):8.0f} good/s without'
+    )
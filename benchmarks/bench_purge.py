@@ -0,0 +1,30 @@
+"""Compare the batched purge with User.delete() on a generated account"""
+from common import setup_django, measure, make_catalog
+
+setup_django()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+
+from main_app.purge import purge_user  # noqa: E402
+
+RECIPES = 20000
+TAGS = 200
+INGREDIENTS = 500
+
+
+def make_account(email):
+    """Create a user with RECIPES recipes, each with 3 tags and 8 ingredients"""
+    user = get_user_model().objects.create_user(email, 'benchpass123')
+    make_catalog(user, RECIPES, TAGS, INGREDIENTS)
+    return user
+
+
+rows = RECIPES * (1 + 3 + 8) + TAGS + INGREDIENTS
+
+user = make_account('collector@example.com')
+with measure('User.delete() (collector)', rows):
+    user.delete()
+
+user = make_account('purge@example.com')
+with measure('purge_user(batch_size=1000)', rows):
+    purge_user(user, batch_size=1000)
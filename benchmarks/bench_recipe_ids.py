@@ -0,0 +1,41 @@
+"""Compare listing and filtering recipes through the prefetched relations with the id arrays"""
+from common import setup_django, measure, make_catalog
+
+setup_django()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from rest_framework import serializers  # noqa: E402
+
+from main_app.models import Recipe  # noqa: E402
+from main_app.signals import refresh_relation_ids  # noqa: E402
+from recipe.serializers import RecipeSerializer  # noqa: E402
+
+RECIPES = 10000
+TAGS = 200
+INGREDIENTS = 500
+
+
+class PrefetchRecipeSerializer(RecipeSerializer):
+    """The recipe list as it was before the id arrays, reading the prefetched relations"""
+    ingredients = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    tags = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+
+
+user = get_user_model().objects.create_user('bench@example.com', 'benchpass123')
+tags, _, recipes = make_catalog(user, RECIPES, TAGS, INGREDIENTS)
+with measure('fill the id arrays', RECIPES):
+    refresh_relation_ids([r.pk for r in recipes])
+
+recipes = Recipe.objects.filter(user=user).order_by('id')
+for run in range(2):  # the first round warms up the caches of SQLite
+    with measure('list, prefetched relations', RECIPES):
+        PrefetchRecipeSerializer(recipes.prefetch_related('tags', 'ingredients'), many=True).data
+    with measure('list, id arrays', RECIPES):
+        RecipeSerializer(recipes, many=True).data
+
+wanted = [tag.pk for tag in tags[:5]]
+for run in range(2):
+    with measure('filter by tags, join + distinct'):
+        list(recipes.filter(tags__in=wanted).distinct().values_list('pk', flat=True))
+    with measure('filter by tags, id arrays'):
+        list(recipes.filter(tag_ids__overlaps=wanted).values_list('pk', flat=True))
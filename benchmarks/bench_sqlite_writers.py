@@ -0,0 +1,86 @@
+"""
+Processes reading and writing one SQLite file at the same time, with Django's backend
+and with main_app.backends.sqlite3 (WAL, BEGIN IMMEDIATE, retries).
+
+every process lists the tags of its user and, for WRITE_SHARE of the operations,
+creates one in an atomic block that reads first, like perform_create with its
+validation. the operations that failed with "database is locked" are counted apart.
+"""
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROCESSES = 8
+SECONDS = 5
+WRITE_SHARE = 0.2
+ENGINES = ('django.db.backends.sqlite3', 'main_app.backends.sqlite3')
+
+
+def setup(engine, path):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    from django.conf import settings
+    settings.DATABASES['default'].update(ENGINE=engine, NAME=path)
+    import django
+    django.setup()
+
+
+def work(engine, path, worker, results):
+    setup(engine, path)
+    from django.db import OperationalError, transaction
+    from main_app.models import Tag
+
+    done = locked = 0
+    user_id = worker + 1
+    random.seed(worker)
+    stop = time.monotonic() + SECONDS
+    while time.monotonic() < stop:
+        try:
+            if random.random() < WRITE_SHARE:
+                with transaction.atomic():
+                    count = Tag.objects.filter(user_id=user_id).count()
+                    Tag.objects.create(user_id=user_id, name=f'tag {count}')
+            else:
+                list(Tag.objects.filter(user_id=user_id).values_list('name')[:50])
+            done += 1
+        except OperationalError:
+            locked += 1
+    results.put((done, locked))
+
+
+def run(engine, path):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=work, args=(engine, path, worker, results)) for worker in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    done, locked = sum(total[0] for total in totals), sum(total[1] for total in totals)
+    print(f'{engine:<40} {done / SECONDS:10.0f} ops/s {locked:8d} locked')
+
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    try:
+        template = os.path.join(directory, 'template.sqlite3')
+        setup('django.db.backends.sqlite3', template)
+        from django.contrib.auth import get_user_model
+        from django.core.management import call_command
+        call_command('migrate', verbosity=0)
+        for worker in range(PROCESSES):
+            get_user_model().objects.create_user(f'bench{worker}@example.com', 'benchpass123')
+
+        print(f'{PROCESSES} processes, {WRITE_SHARE:.0%} writes, {SECONDS}s each')
+        for engine in ENGINES:
+            path = os.path.join(directory, engine.replace('.', '_') + '.sqlite3')
+            shutil.copy(template, path)
+            run(engine, path)
+    finally:
+        shutil.rmtree(directory)
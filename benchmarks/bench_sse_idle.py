@@ -0,0 +1,71 @@
+"""Memory per idle event stream, and the fan-out time of one event to all of them"""
+import asyncio
+import time
+import tracemalloc
+
+from common import setup_django
+
+setup_django()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from recipe import events  # noqa: E402
+
+SUBSCRIBERS = (1000, 10000)
+
+
+class IdleClient:
+    def __init__(self):
+        self.closed = asyncio.Event()
+        self.events = 0
+        self.got_event = None
+
+    async def receive(self):
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if b'event:' in message.get('body', b''):
+            self.events += 1
+            self.got_event.set()
+
+
+async def bench(count, token):
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': '/api/recipe/events/', 'query_string': b'',
+        'headers': [(b'authorization', f'Token {token.key}'.encode())],
+    }
+    clients = [IdleClient() for _ in range(count)]
+    for client in clients:
+        client.got_event = asyncio.Event()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    streams = [asyncio.ensure_future(events.catalog_events_app(scope, c.receive, c.send)) for c in clients]
+    while len(events.broker.subscribers.get(token.user_id, ())) < count:
+        await asyncio.sleep(0.01)
+    connect = time.perf_counter() - started
+    per_stream = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    events.broker.dispatch(token.user_id, {'type': 'recipe', 'action': 'updated', 'id': 1})
+    await asyncio.gather(*(c.got_event.wait() for c in clients))
+    fan_out = time.perf_counter() - started
+
+    for client in clients:
+        client.closed.set()
+    await asyncio.gather(*streams)
+
+    print(f'{count:>6} streams: connect {connect:6.2f} s, {per_stream / 1024:5.1f} KiB per idle stream, '
+          f'fan-out {fan_out * 1000:7.1f} ms')
+
+
+user = get_user_model().objects.create_user('bench@example.com', 'benchpassword')
+token = Token.objects.create(user=user)
+with override_settings(CATALOG_EVENTS={'BACKEND': 'local', 'HEARTBEAT_SECONDS': 3600}):
+    for size in SUBSCRIBERS:
+        asyncio.run(bench(size, token))
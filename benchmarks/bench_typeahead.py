@@ -0,0 +1,61 @@
+"""Compare the ?prefix= typeahead index with prefix lookups in the database, on a large catalog"""
+import random
+import string
+import time
+
+from common import setup_django, measure
+
+setup_django()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db.models.functions import Lower  # noqa: E402
+
+from main_app.models import Ingredient, Recipe  # noqa: E402
+from recipe import typeahead  # noqa: E402
+
+INGREDIENTS = 100000
+RECIPES = 20000
+QUERIES = 1000
+
+random.seed(1)
+user = get_user_model().objects.create_user('bench@example.com', 'benchpass123')
+ingredients = Ingredient.objects.bulk_create(
+    (Ingredient(user=user, name=''.join(random.choices(string.ascii_lowercase, k=random.randint(4, 12))))
+     for _ in range(INGREDIENTS)),
+    batch_size=5000
+)
+recipes = Recipe.objects.bulk_create(
+    (Recipe(user=user, title=f'recipe {i}', time_minutes=10, price=5) for i in range(RECIPES)),
+    batch_size=5000
+)
+Recipe.ingredients.through.objects.bulk_create(
+    (Recipe.ingredients.through(recipe_id=r.pk, ingredient_id=random.choice(ingredients).pk)
+     for r in recipes for _ in range(5)),
+    batch_size=5000, ignore_conflicts=True
+)
+prefixes = [''.join(random.choices(string.ascii_lowercase, k=random.randint(1, 3))) for _ in range(QUERIES)]
+
+with measure('build the index', INGREDIENTS):
+    index = typeahead.NameIndex.build(Ingredient, user.pk)
+print(f'index size {index.nbytes / 1024 / 1024:.1f} MiB (estimated)')
+
+
+def report(label, lookup):
+    timings = []
+    for prefix in prefixes:
+        started = time.perf_counter()
+        lookup(prefix)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print(f'{label:<40} p50 {timings[len(timings) // 2] * 1000:7.2f} ms  p99 {timings[int(len(timings) * .99)] * 1000:7.2f} ms')
+
+
+def database(prefix, lookup):
+    return list(
+        Ingredient.objects.filter(user=user, **{lookup: prefix}).order_by(Lower('name')).values_list('id', 'name')[:10]
+    )
+
+
+report('icontains, database', lambda prefix: database(prefix, 'name__icontains'))
+report('istartswith, database', lambda prefix: database(prefix, 'name__istartswith'))
+report('typeahead index, ranked', lambda prefix: index.search(prefix, 10))
@@ -0,0 +1,44 @@
+"""Write recipe views one UPDATE per view, and buffered with the batched CASE flush of recipe/view_counts.py"""
+import random
+
+from common import setup_django, measure
+
+setup_django()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import transaction  # noqa: E402
+from django.db.models import F  # noqa: E402
+
+from main_app.models import Recipe  # noqa: E402
+from recipe.view_counts import view_counter  # noqa: E402
+
+RECIPES = 10000
+VIEWS = 20000
+
+random.seed(1)
+user = get_user_model().objects.create_user('bench@example.com', 'benchpass123')
+recipes = Recipe.objects.bulk_create(
+    (Recipe(user=user, title=f'recipe {i}', time_minutes=10, price=5) for i in range(RECIPES)),
+    batch_size=5000
+)
+for recipe in recipes:
+    recipe._state.db = 'default'
+# popular recipes get most of the views
+viewed = random.choices(recipes, weights=[1 / (i + 1) for i in range(RECIPES)], k=VIEWS)
+
+with measure('UPDATE per view', VIEWS):
+    for recipe in viewed:
+        # autocommit, like a view counted in its own request
+        with transaction.atomic():
+            Recipe.objects.filter(pk=recipe.pk).update(view_count=F('view_count') + 1)
+
+with measure('buffer the views', VIEWS):
+    for recipe in viewed:
+        view_counter.add(recipe)
+print(f'{len(view_counter.pending)} recipes with pending views')
+
+with measure('flush', VIEWS):
+    view_counter.flush()
+
+total = sum(Recipe.objects.values_list('view_count', flat=True))
+assert total == 2 * VIEWS, total
@@ -0,0 +1,64 @@
+"""Shared setup for the benchmark scripts: run them from the project root, e.g.
+
+    python benchmarks/bench_purge.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup_django(settings_module='core.settings'):
+    """Configure Django and create a throw-away test database"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+@contextmanager
+def measure(label, rows=None):
+    """Print elapsed time, throughput and peak Python memory of the block"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    line = f'{label:<40} {elapsed * 1000:10.1f} ms'
+    if rows:
+        line += f' {rows / elapsed:12.0f} rows/s'
+    print(line + f' {peak / 1024:10.0f} KiB peak')
+
+
+def make_catalog(user, recipes, tags=200, ingredients=500, tags_per_recipe=3, ingredients_per_recipe=8):
+    """Give the user a generated catalog, returns (tags, ingredients, recipes)"""
+    from main_app.models import Tag, Ingredient, Recipe
+
+    tag_objs = Tag.objects.bulk_create(Tag(user=user, name=f'tag {i}') for i in range(tags))
+    ingredient_objs = Ingredient.objects.bulk_create(
+        Ingredient(user=user, name=f'ingredient {i}') for i in range(ingredients)
+    )
+    recipe_objs = Recipe.objects.bulk_create(
+        (Recipe(user=user, title=f'recipe {i}', time_minutes=10, price=5) for i in range(recipes)),
+        batch_size=1000
+    )
+    Recipe.tags.through.objects.bulk_create(
+        (Recipe.tags.through(recipe_id=r.pk, tag_id=tag_objs[(i + j) % tags].pk)
+         for i, r in enumerate(recipe_objs) for j in range(tags_per_recipe)),
+        batch_size=5000
+    )
+    Recipe.ingredients.through.objects.bulk_create(
+        (Recipe.ingredients.through(recipe_id=r.pk, ingredient_id=ingredient_objs[(i * 7 + j) % ingredients].pk)
+         for i, r in enumerate(recipe_objs) for j in range(ingredients_per_recipe)),
+        batch_size=5000
+    )
+    return tag_objs, ingredient_objs, recipe_objs
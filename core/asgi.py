@@ -13,4 +13,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after the app registry is ready, it uses the models
+from recipe.events import catalog_events_app  # noqa: E402
+
+CATALOG_EVENTS_PATH = '/api/recipe/events/'
+
+
+async def application(scope, receive, send):
+    # the event stream holds its connection open, so it is served by its own
+    # async app instead of going through the (sync) Django views
+    if scope['type'] == 'http' and scope['path'] == CATALOG_EVENTS_PATH:
+        return await catalog_events_app(scope, receive, send)
+    return await django_application(scope, receive, send)
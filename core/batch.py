@@ -0,0 +1,201 @@
+"""
+Batch endpoint: several API calls in one round trip.
+
+    POST /api/batch/
+    {"requests": [
+        {"method": "GET", "path": "/api/user/me/"},
+        {"method": "POST", "path": "/api/recipe/tags/", "body": {"name": "Vegan"}},
+        {"method": "GET", "path": "/api/recipe/tags/?assigned_only=1"}
+    ]}
+
+returns {"responses": [{"status": ..., "headers": {...}, "body": ...}, ...]} in the
+order of the requests. the sub-requests are resolved with the URL conf and handed
+straight to their views:
+
+- the batch is authenticated once, every sub-request runs as that user
+  (DRF's forced authentication), without its own token lookup.
+- identical GETs of one batch are only run once (the per-batch cache). a write
+  empties the cache, so the reads after it see its changes.
+- GETs next to each other run in parallel, writes run one by one in order
+  and wait for the reads before them.
+- the middleware does not run for the sub-requests, only for the batch itself.
+  the execute_wrappers it put on the connections of the batch (the query deadline,
+  the slow query log) are put on the connections of the read threads as well,
+  so the parallel reads keep the deadline of the batch and are timed with it.
+
+the sub-requests are not one transaction, a failing one does not undo the ones before it.
+"""
+import io
+import json
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.urls import Resolver404, resolve, reverse
+
+from rest_framework import serializers, status
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+DEFAULTS = {
+    'MAX_REQUESTS': 20,
+    # the cost of a batch is the sum of the costs of its sub-requests
+    'MAX_COST': 40,
+    'METHOD_COSTS': {'GET': 1, 'POST': 3, 'PUT': 3, 'PATCH': 3, 'DELETE': 3},
+    # paths that cost more than their method, matched by prefix
+    'PATH_COSTS': {'/api/recipe/recipes/bulk/': 10},
+    # threads running the reads of one batch in parallel, 1 runs everything in order
+    'MAX_WORKERS': 4,
+}
+
+# the body and its length belong to the batch, not to the sub-requests
+SKIPPED_META = ('wsgi.input', 'CONTENT_LENGTH', 'CONTENT_TYPE', 'QUERY_STRING', 'PATH_INFO', 'REQUEST_METHOD')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'API_BATCH', {})}
+
+
+def request_cost(method, path, config):
+    for prefix, cost in config['PATH_COSTS'].items():
+        if path.startswith(prefix):
+            return cost
+    return config['METHOD_COSTS'][method]
+
+
+class SubRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=list(DEFAULTS['METHOD_COSTS']))
+    path = serializers.CharField(max_length=2000)
+    body = serializers.JSONField(required=False)
+
+    def validate_path(self, value):
+        prefix = getattr(settings, 'API_PATH_PREFIX', '/api/')
+        if not value.startswith(prefix):
+            raise serializers.ValidationError(f'Only paths under {prefix} can be batched.')
+        if urlsplit(value).path == reverse('batch'):
+            raise serializers.ValidationError('Batches can not be nested.')
+        return value
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = SubRequestSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, value):
+        config = get_config()
+        if len(value) > config['MAX_REQUESTS']:
+            raise serializers.ValidationError(f'A batch holds at most {config["MAX_REQUESTS"]} requests.')
+        cost = sum(request_cost(item['method'], item['path'], config) for item in value)
+        if cost > config['MAX_COST']:
+            raise serializers.ValidationError(f'The batch costs {cost}, at most {config["MAX_COST"]} is allowed.')
+        return value
+
+
+class Batch:
+    """The sub-requests of one batch"""
+
+    def __init__(self, request, config):
+        self.request = request
+        self.config = config
+        self.cache = {}
+        # the wrappers of the request thread's connections, for the connections of the read threads
+        self.execute_wrappers = {
+            connection.alias: list(connection.execute_wrappers) for connection in connections.all()
+        }
+
+    def build_request(self, method, path, body):
+        """Return a request for a sub-request, authenticated as the user of the batch"""
+        url = urlsplit(path)
+        payload = b'' if body is None else json.dumps(body).encode()
+        environ = {key: value for key, value in self.request.META.items() if key not in SKIPPED_META}
+        environ.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(payload)),
+            'wsgi.input': io.BytesIO(payload),
+        })
+        sub_request = WSGIRequest(environ)
+        sub_request._force_auth_user = self.request.user
+        sub_request._force_auth_token = self.request.auth
+        return sub_request
+
+    def dispatch(self, method, path, body=None):
+        """Run one sub-request through its view and return its entry of the response"""
+        sub_request = self.build_request(method, path, body)
+        try:
+            match = resolve(sub_request.path_info)
+        except Resolver404:
+            return {'status': status.HTTP_404_NOT_FOUND, 'headers': {}, 'body': {'detail': 'Not found.'}}
+        sub_request.resolver_match = match
+
+        response = match.func(sub_request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        if hasattr(response, 'data'):
+            body = response.data
+        elif response.get('Content-Type', '').startswith('application/json'):
+            body = json.loads(response.content or 'null')
+        else:
+            body = response.content.decode(response.charset, errors='replace')
+        headers = {key: value for key, value in response.items() if key not in ('Content-Type', 'Content-Length')}
+        return {'status': response.status_code, 'headers': headers, 'body': body}
+
+    def read(self, path):
+        """A GET, answered from the cache when the batch already made it"""
+        if path not in self.cache:
+            self.cache[path] = self.dispatch('GET', path)
+        return self.cache[path]
+
+    def read_in_thread(self, path):
+        try:
+            with ExitStack() as stack:
+                for alias, wrappers in self.execute_wrappers.items():
+                    for wrapper in wrappers:
+                        stack.enter_context(connections[alias].execute_wrapper(wrapper))
+                return self.read(path)
+        finally:
+            # the connections of a worker thread are not closed by the request cycle
+            connections.close_all()
+
+    def run(self, items):
+        results = [None] * len(items)
+        reads = []  # (position, path) of the GETs waiting for the next write
+        for position, item in enumerate(items):
+            if item['method'] == 'GET':
+                reads.append((position, item['path']))
+                continue
+            self.run_reads(reads, results)
+            reads = []
+            self.cache.clear()
+            results[position] = self.dispatch(item['method'], item['path'], item.get('body'))
+        self.run_reads(reads, results)
+        return results
+
+    def run_reads(self, reads, results):
+        # the duplicates of a path are filled from the cache after the first one ran
+        paths = list(dict.fromkeys(path for _, path in reads if path not in self.cache))
+        workers = min(self.config['MAX_WORKERS'], len(paths))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for path, result in zip(paths, executor.map(self.read_in_thread, paths)):
+                    self.cache[path] = result
+        for position, path in reads:
+            results[position] = self.read(path)
+
+
+class BatchView(APIView):
+    """Run several API requests in one round trip"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        batch = Batch(request, get_config())
+        return Response({'responses': batch.run(serializer.validated_data['requests'])})
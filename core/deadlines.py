@@ -0,0 +1,173 @@
+"""
+Request deadlines and load shedding.
+
+DeadlineMiddleware (core/middleware.py) gives every request a deadline: the
+REQUEST_DEADLINES['TIMEOUT_MS'] of the settings, or less when the client sends the
+time it is willing to wait in the X-Request-Timeout header (milliseconds). the
+deadline is passed down to the database as a timeout of every query (QueryDeadline),
+so a slow database fails the request with 503 instead of holding the worker after
+the client gave up.
+
+when more than MAX_IN_FLIGHT requests are running in the process, or a request
+waited longer than MAX_QUEUE_MS in front of it (the X-Request-Start header of the
+proxy), new requests are answered with 503 and Retry-After right away. the cheap
+requests (CHEAP_PATHS: the token, /me/) may use all of MAX_IN_FLIGHT, the rest
+only EXPENSIVE_SHARE of it, so logging in keeps working while the listings are shed.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError
+from django.http import JsonResponse
+
+DEFAULTS = {
+    # a client can ask for less time in the HEADER, never for more
+    'TIMEOUT_MS': 10000,
+    'HEADER': 'X-Request-Timeout',
+    # None turns the shedding off
+    'MAX_IN_FLIGHT': 64,
+    'EXPENSIVE_SHARE': 0.75,
+    'CHEAP_PATHS': ('/api/user/token/', '/api/user/me/'),
+    # set by the proxy in front of the workers, e.g. nginx: proxy_set_header X-Request-Start "t=${msec}";
+    'QUEUE_HEADER': 'X-Request-Start',
+    'MAX_QUEUE_MS': 1000,
+    'RETRY_AFTER': 1,
+    # PostgreSQL: the statement_timeout of a connection is set again for a query only once
+    # it is this much longer than the time left, so most queries need no extra round trip
+    'STATEMENT_TIMEOUT_SLACK_MS': 100,
+}
+# opcodes SQLite runs between two looks at the clock
+SQLITE_PROGRESS_STEPS = 1000
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_DEADLINES', {})}
+
+
+def header_key(name):
+    return name and 'HTTP_' + name.upper().replace('-', '_')
+
+
+class DeadlineExceeded(OperationalError):
+    """A query that would run, or ran, past the deadline of its request"""
+
+
+class Deadline:
+
+    def __init__(self, timeout):
+        self.at = time.monotonic() + timeout
+
+    def remaining(self):
+        return self.at - time.monotonic()
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.at
+
+
+def queued_seconds(value, now=None):
+    """
+    Seconds a request waited since the proxy got it, from X-Request-Start:
+    t=<seconds>, <milliseconds> or <microseconds> since the epoch. None when it does not parse.
+    """
+    try:
+        started = float(value.strip().removeprefix('t='))
+    except (AttributeError, ValueError):
+        return None
+    # tell the units apart by their size, seconds since the epoch are around 1e9
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max((now or time.time()) - started, 0)
+
+
+class QueryDeadline:
+    """
+    execute_wrapper limiting every query to the time left of the request.
+    SQLite checks the clock while the query runs, PostgreSQL gets a statement_timeout,
+    the other databases only refuse to start a query after the deadline.
+
+    the statement_timeout is a SET of its own, so it is only sent with the first query
+    of a connection and whenever the timeout set before is over the time left by more
+    than slack_ms. a query may run up to slack_ms past the deadline in between.
+    """
+
+    def __init__(self, deadline, slack_ms=DEFAULTS['STATEMENT_TIMEOUT_SLACK_MS']):
+        self.deadline = deadline
+        self.slack_ms = slack_ms
+        # PostgreSQL connection -> the statement_timeout set on it, reset after the request
+        self.timed = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        remaining = self.deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded('The request ran out of time before the query.')
+        connection = context['connection']
+        if connection.vendor == 'sqlite':
+            # a progress handler returning true interrupts the query
+            connection.connection.set_progress_handler(lambda: self.deadline.expired, SQLITE_PROGRESS_STEPS)
+        elif connection.vendor == 'postgresql':
+            remaining_ms = max(int(remaining * 1000), 1)
+            if self.timed.get(connection, float('inf')) - remaining_ms > self.slack_ms:
+                context['cursor'].cursor.execute('SET statement_timeout = %s', [remaining_ms])
+                self.timed[connection] = remaining_ms
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as exc:
+            if self.deadline.expired:
+                raise DeadlineExceeded('The query ran out of time.') from exc
+            raise
+        finally:
+            if connection.vendor == 'sqlite' and connection.connection is not None:
+                connection.connection.set_progress_handler(None, 0)
+
+    def reset(self):
+        """Give the connections the statement_timeout of their next request back"""
+        for connection in self.timed:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET statement_timeout = DEFAULT')
+            except DatabaseError:
+                # a broken connection is closed at the end of the request anyway, and the
+                # connections of the read threads of a batch are closed when their thread is done
+                pass
+        self.timed.clear()
+
+
+class LoadShedder:
+    """Counts the requests running in the process and turns new ones away above the limits"""
+
+    def __init__(self, config):
+        self.max_in_flight = config['MAX_IN_FLIGHT']
+        self.expensive_limit = max(int(self.max_in_flight * config['EXPENSIVE_SHARE']), 1) \
+            if self.max_in_flight else None
+        self.max_queue = config['MAX_QUEUE_MS'] / 1000 if config['MAX_QUEUE_MS'] is not None else None
+        self.cheap_paths = tuple(config['CHEAP_PATHS'])
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def is_cheap(self, request):
+        return request.path_info in self.cheap_paths
+
+    def admit(self, request, queued):
+        """Count the request in and return True, or return False if it is to be shed"""
+        cheap = self.is_cheap(request)
+        if not cheap and self.max_queue is not None and queued is not None and queued > self.max_queue:
+            return False
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= (self.max_in_flight if cheap else self.expensive_limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def unavailable(detail, retry_after):
+    response = JsonResponse({'detail': detail}, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
@@ -0,0 +1,192 @@
+import random
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.middleware import clickjacking, csrf
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+
+class ApiExemptMixin:
+    """
+    Skip the middleware for requests to the token-authenticated API.
+    sessions, CSRF, messages and the rest of the browser machinery are only needed by the admin,
+    so API requests go straight to the next middleware.
+    """
+
+    def __call__(self, request):
+        if request.path_info.startswith(getattr(settings, 'API_PATH_PREFIX', '/api/')):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class SessionMiddleware(ApiExemptMixin, sessions_middleware.SessionMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(ApiExemptMixin, csrf.CsrfViewMiddleware):
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        # process_view is called by the handler directly, not through __call__
+        if request.path_info.startswith(getattr(settings, 'API_PATH_PREFIX', '/api/')):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class AuthenticationMiddleware(ApiExemptMixin, auth_middleware.AuthenticationMiddleware):
+    # API views authenticate with DRF, the session based request.user is never used there
+    pass
+
+
+class MessageMiddleware(ApiExemptMixin, messages_middleware.MessageMiddleware):
+    pass
+
+
+class XFrameOptionsMiddleware(ApiExemptMixin, clickjacking.XFrameOptionsMiddleware):
+    pass
+
+
+class ProfilingMiddleware:
+    """
+    Profile single requests on demand or sampled, see core/profiling.py.
+    a request that is not profiled costs one header lookup, plus one random number
+    with sampling on. with neither a header nor a sample rate configured the
+    middleware takes itself out of the chain.
+    sits after AuthenticationMiddleware, so staff can also profile admin pages with their session.
+    """
+
+    def __init__(self, get_response):
+        from . import profiling
+
+        config = profiling.get_config()
+        if not config['HEADER'] and not config['SAMPLE_RATE']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.capture = profiling.capture
+        self.header = config['HEADER'] and 'HTTP_' + config['HEADER'].upper().replace('-', '_')
+        self.sample_rate = config['SAMPLE_RATE']
+
+    def __call__(self, request):
+        if self.header and self.header in request.META:
+            user = self.staff_user(request)
+            if user is not None:
+                return self.capture(request, self.get_response, user=user)
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.capture(request, self.get_response, sampled=True)
+        return self.get_response(request)
+
+    def staff_user(self, request):
+        """Return the staff user behind the session or the API token of the request, if any"""
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return user
+        try:
+            authenticated = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        if authenticated is not None and authenticated[0].is_staff:
+            return authenticated[0]
+        return None
+
+
+class SlowQueryMiddleware:
+    """
+    Time the queries of every request and report the slow ones and the N+1 suspects,
+    see core/querylog.py. sits near the top, so the session and user lookups are timed too.
+    with SLOW_QUERIES['THRESHOLD_MS'] set to None the middleware takes itself out of the chain.
+    """
+
+    def __init__(self, get_response):
+        from . import querylog
+
+        self.config = querylog.get_config()
+        if self.config['THRESHOLD_MS'] is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.querylog = querylog
+
+    def __call__(self, request):
+        queries = request._query_log = self.querylog.RequestQueries(self.config['THRESHOLD_MS'])
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+
+        reports = queries.reports(self.config['N_PLUS_ONE_THRESHOLD'])
+        if reports:
+            self.querylog.recorder.submit(reports, self.config)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        queries = getattr(request, '_query_log', None)
+        if queries is not None:
+            queries.view = self.querylog.view_name(view_func, request)
+
+
+class DeadlineMiddleware:
+    """
+    Give every request a deadline, which also limits its queries, and shed requests
+    under overload, see core/deadlines.py. sits first, a request that is turned
+    away should cost as little as possible. with neither a timeout nor MAX_IN_FLIGHT
+    configured the middleware takes itself out of the chain.
+    """
+
+    def __init__(self, get_response):
+        from . import deadlines
+
+        config = deadlines.get_config()
+        if config['TIMEOUT_MS'] is None and config['MAX_IN_FLIGHT'] is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.deadlines = deadlines
+        self.config = config
+        self.header = deadlines.header_key(config['HEADER'])
+        self.queue_header = deadlines.header_key(config['QUEUE_HEADER'])
+        self.shedder = deadlines.LoadShedder(config)
+
+    def __call__(self, request):
+        queued = None
+        if self.queue_header and self.queue_header in request.META:
+            queued = self.deadlines.queued_seconds(request.META[self.queue_header])
+        if not self.shedder.admit(request, queued):
+            return self.deadlines.unavailable('The server is overloaded, try again later.', self.config['RETRY_AFTER'])
+
+        try:
+            timeout = self.timeout(request)
+            if timeout is None:
+                return self.get_response(request)
+            # the time spent waiting in front of the worker counts against the deadline
+            request.deadline = self.deadlines.Deadline(timeout - (queued or 0))
+            queries = self.deadlines.QueryDeadline(request.deadline, self.config['STATEMENT_TIMEOUT_SLACK_MS'])
+            try:
+                with ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(queries))
+                    return self.get_response(request)
+            finally:
+                queries.reset()
+        finally:
+            self.shedder.release()
+
+    def timeout(self, request):
+        """Seconds the request may take, None for no deadline"""
+        timeout = self.config['TIMEOUT_MS']
+        requested = request.META.get(self.header) if self.header else None
+        try:
+            requested = max(int(requested), 1)
+        except (TypeError, ValueError):
+            requested = None  # no header, or not a number of milliseconds: ignored
+        if requested is not None:
+            # a client may shorten its deadline, not lengthen it
+            timeout = requested if timeout is None else min(requested, timeout)
+        return timeout / 1000 if timeout is not None else None
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, self.deadlines.DeadlineExceeded):
+            return self.deadlines.unavailable('The request ran out of time.', self.config['RETRY_AFTER'])
+        return None
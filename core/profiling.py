@@ -0,0 +1,159 @@
+"""
+Profiling of single requests.
+
+ProfilingMiddleware (core/middleware.py) profiles a request when a staff user sends the
+PROFILING['HEADER'] header, or when the request is picked at PROFILING['SAMPLE_RATE'].
+a capture records
+
+- a cProfile of the request, downloadable as a .prof file (pstats, snakeviz, ...),
+- every SQL query with its duration, on all database aliases,
+- the peak of the memory allocated while the request ran, and the lines that
+  allocated what was still alive at its end (tracemalloc).
+
+the captures are written to PROFILING['DIRECTORY'], which keeps the newest
+PROFILING['MAX_CAPTURES'] of them, and listed in the admin as ProfileCapture.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from main_app.models import ProfileCapture
+
+DEFAULTS = {
+    'HEADER': 'X-Profile',
+    'SAMPLE_RATE': 0.0,
+    'DIRECTORY': os.path.join(settings.BASE_DIR, 'profiles'),
+    'MAX_CAPTURES': 100,
+    # functions and allocation sites listed in the summary of a capture
+    'TOP': 30,
+}
+
+# cProfile and tracemalloc are global to the process, so only one request at
+# a time is profiled. requests that come in meanwhile run without a capture.
+_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+class QueryLog:
+    """execute_wrapper that times every query"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            # the parameters are left out, they can hold anything the user sent
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'many': many,
+                'ms': round((time.perf_counter() - start) * 1000, 3),
+            })
+
+
+def capture(request, get_response, user=None, sampled=False):
+    """Handle the request with the profilers running and store the capture, returns the response"""
+    if not _lock.acquire(blocking=False):
+        return get_response(request)
+    try:
+        return _capture(request, get_response, user, sampled)
+    finally:
+        _lock.release()
+
+
+def _capture(request, get_response, user, sampled):
+    config = get_config()
+    query_log = QueryLog()
+    profiler = cProfile.Profile()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    memory_before = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_log))
+            profiler.enable()
+            try:
+                response = get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - start
+        memory_peak = tracemalloc.get_traced_memory()[1] - memory_before
+        snapshot = tracemalloc.take_snapshot() if started_tracing else None
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+
+    record = ProfileCapture.objects.create(
+        method=request.method,
+        path=request.get_full_path()[:500],
+        status_code=response.status_code,
+        duration_ms=duration * 1000,
+        query_count=len(query_log.queries),
+        query_ms=sum(query['ms'] for query in query_log.queries),
+        memory_peak=memory_peak,
+        user=user,
+        sampled=sampled,
+    )
+    write_capture(record, profiler, query_log.queries, snapshot, config)
+    response['X-Profile-Id'] = str(record.pk)
+    return response
+
+
+def write_capture(record, profiler, queries, snapshot, config):
+    """Write the .prof and .json files of a capture and drop the captures that no longer fit"""
+    directory = config['DIRECTORY']
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(record.file_path('prof', directory))
+
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(config['TOP'])
+    summary = {
+        'id': record.pk,
+        'created_at': record.created_at.isoformat(),
+        'request': f'{record.method} {record.path}',
+        'status_code': record.status_code,
+        'duration_ms': record.duration_ms,
+        'memory_peak': record.memory_peak,
+        # None when tracemalloc was already started by someone else, e.g. PYTHONTRACEMALLOC
+        'top_allocations': None if snapshot is None else [
+            str(stat) for stat in snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ]).statistics('lineno')[:config['TOP']]
+        ],
+        'queries': queries,
+        'profile': stream.getvalue(),
+    }
+    with open(record.file_path('json', directory), 'w') as file:
+        json.dump(summary, file, indent=1)
+
+    rotate(config)
+
+
+def rotate(config):
+    """Delete the captures beyond the newest MAX_CAPTURES, rows and files"""
+    stale = list(
+        ProfileCapture.objects.order_by('-pk').values_list('pk', flat=True)[config['MAX_CAPTURES']:]
+    )
+    for pk in stale:
+        ProfileCapture(pk=pk).delete_files(config['DIRECTORY'])
+    ProfileCapture.objects.filter(pk__in=stale).delete()
@@ -0,0 +1,231 @@
+"""
+Slow query log.
+
+SlowQueryMiddleware (core/middleware.py) times every query of a request with an
+execute_wrapper on all database aliases. when the response is done
+
+- queries over SLOW_QUERIES['THRESHOLD_MS'] are reported with the view that ran them,
+  their normalized SQL, the shape of their parameters and an EXPLAIN of the query
+  (EXPLAIN ANALYZE on PostgreSQL, SELECTs only),
+- SQL that ran at least SLOW_QUERIES['N_PLUS_ONE_THRESHOLD'] times in the request is
+  reported as an N+1 suspect.
+
+the reports go to the 'core.querylog' logger (a rotating file, see LOGGING in the
+settings) and are summed up per fingerprint and view in QueryFingerprint, which the
+admin lists. the EXPLAINs and the writes run in a background thread, the request only
+pays for timing its queries.
+"""
+import hashlib
+import json
+import logging
+import queue
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from main_app.models import QueryFingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'THRESHOLD_MS': 100,
+    'N_PLUS_ONE_THRESHOLD': 10,
+    'EXPLAIN': True,
+    # run the EXPLAINs and the fingerprint updates in a background thread
+    'BACKGROUND': True,
+    # reports waiting for the background thread, more are dropped
+    'QUEUE_SIZE': 1000,
+}
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'(?<![\w."])\d+(?:\.\d+)?\b')
+PLACEHOLDER = re.compile(r'%s|%\(\w+\)s|\?')
+VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+REPEATED_VALUE_LISTS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+WHITESPACE = re.compile(r'\s+')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SLOW_QUERIES', {})}
+
+
+def normalize(sql):
+    """
+    Return the SQL with every value replaced by ?, so queries that only differ in their
+    values (or in the length of their IN lists and VALUES) normalize the same.
+    """
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = PLACEHOLDER.sub('?', sql)
+    sql = VALUE_LIST.sub('(...)', sql)
+    sql = REPEATED_VALUE_LISTS.sub('(...), ...', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()
+
+
+def params_shape(params, many):
+    """Describe the parameters by their types, e.g. 'int, str x 3', without their values"""
+    if many:
+        # the parameters of executemany can be a generator, which must not be consumed here
+        return 'executemany'
+    if params is None:
+        return ''
+    if isinstance(params, dict):
+        return ', '.join(f'{name}: {type(value).__name__}' for name, value in params.items())[:200]
+
+    runs = []
+    for value in params:
+        name = type(value).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return ', '.join(name if count == 1 else f'{name} x {count}' for name, count in runs)[:200]
+
+
+def view_name(view_func, request):
+    """Name the view the way it reads in the code, e.g. RecipeViewSet.list"""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return f'{view_func.__module__}.{getattr(view_func, "__qualname__", view_func.__class__.__name__)}'
+    method = request.method.lower()
+    actions = getattr(view_func, 'actions', None)  # the method -> action map of viewsets
+    if actions:
+        return f'{cls.__name__}.{actions.get(method, method)}'
+    return f'{cls.__name__}.{method}'
+
+
+class RequestQueries:
+    """execute_wrapper that counts the SQL of one request and keeps the slow queries"""
+
+    def __init__(self, threshold_ms):
+        self.threshold = threshold_ms / 1000
+        self.counts = Counter()
+        self.slow = []
+        self.view = None
+        # the parallel reads of a batch (core/batch.py) run their queries in other threads
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.counts[sql] += 1
+                if duration >= self.threshold:
+                    self.slow.append((context['connection'].alias, sql, params, many, duration))
+
+    def reports(self, n_plus_one_threshold):
+        """Return the slow queries and the N+1 suspects of the request as report dicts"""
+        view = self.view or 'unknown'
+        reports = []
+        for alias, sql, params, many, duration in self.slow:
+            reports.append({
+                'kind': 'slow', 'view': view, 'alias': alias, 'sql': sql,
+                'params_shape': params_shape(params, many), 'ms': round(duration * 1000, 3),
+                # only kept to run the EXPLAIN, never logged or stored
+                'params': None if many else params,
+            })
+        for sql, count in self.counts.items():
+            if count >= n_plus_one_threshold:
+                reports.append({'kind': 'n+1', 'view': view, 'sql': sql, 'repeats': count})
+        return reports
+
+
+def explain(alias, sql, params):
+    """Return the plan of a SELECT, or '' for every other statement"""
+    if not sql.lstrip().upper().startswith('SELECT') or params is None:
+        return ''
+    connection = connections[alias]
+    # ANALYZE runs the query, which is harmless for a SELECT that already ran once
+    options = {'analyze': True} if connection.vendor == 'postgresql' else {}
+    prefix = connection.ops.explain_query_prefix(**options)
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        cursor.execute(f'{prefix} {sql}', params)
+        # the plan is in the last column, on every backend that supports EXPLAIN
+        return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+
+def record(report, config):
+    """Log a report and add it to its fingerprint"""
+    normalized = normalize(report['sql'])
+    key = fingerprint(normalized)
+    plan = ''
+    if report['kind'] == 'slow' and config['EXPLAIN']:
+        try:
+            plan = explain(report['alias'], report['sql'], report['params'])
+        except Exception as exc:
+            plan = f'EXPLAIN failed: {exc}'
+
+    entry = {key_: value for key_, value in report.items() if key_ not in ('params', 'sql')}
+    entry.update(fingerprint=key, sql=normalized, explain=plan)
+    logger.warning(json.dumps(entry))
+
+    QueryFingerprint.objects.get_or_create(
+        fingerprint=key, view=report['view'], defaults={'sql': normalized}
+    )
+    if report['kind'] == 'slow':
+        changes = {
+            'slow_count': F('slow_count') + 1,
+            'total_ms': F('total_ms') + report['ms'],
+            'max_ms': Greatest('max_ms', report['ms']),
+            'params_shape': report['params_shape'],
+        }
+        if plan:
+            changes['explain'] = plan
+    else:
+        changes = {
+            'n_plus_one_count': F('n_plus_one_count') + 1,
+            'max_repeats': Greatest('max_repeats', report['repeats']),
+        }
+    QueryFingerprint.objects.filter(fingerprint=key, view=report['view']).update(
+        last_seen=timezone.now(), **changes
+    )
+
+
+class Recorder:
+    """Background thread recording the reports of all requests one after another"""
+
+    def __init__(self):
+        self._queue = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, reports, config):
+        if not config['BACKGROUND']:
+            for report in reports:
+                record(report, config)
+            return
+
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue(config['QUEUE_SIZE'])
+                threading.Thread(target=self.run, args=(config,), daemon=True).start()
+        for report in reports:
+            try:
+                self._queue.put_nowait(report)
+            except queue.Full:
+                self.dropped += 1
+
+    def run(self, config):
+        while True:
+            report = self._queue.get()
+            try:
+                record(report, config)
+            except Exception:
+                logger.exception('Could not record a slow query report')
+
+
+recorder = Recorder()
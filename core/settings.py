@@ -33,11 +33,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.DeadlineMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.SlowQueryMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -65,13 +68,76 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# SQLite in WAL mode, with BEGIN IMMEDIATE and retries for concurrent writers
+# (main_app/backends/sqlite3). SQLITE_PRODUCTION=0 uses Django's backend as it is.
+SQLITE_ENGINE = (
+    'main_app.backends.sqlite3' if os.environ.get('SQLITE_PRODUCTION', '1') != '0'
+    else 'django.db.backends.sqlite3'
+)
+# pragmas and retries of the SQLite backend, see DEFAULTS in main_app/backends/sqlite3/base.py
+SQLITE = {
+    'BUSY_TIMEOUT_MS': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': SQLITE_ENGINE,
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
 
+# User shards
+# the catalogs of the users are spread over these database aliases (see main_app/sharding.py),
+# e.g. DATABASE_SHARDS=shard_1,shard_2. empty keeps everything in 'default'.
+# the order matters, hash_shard picks the shard of a new user by its position in the list.
+# a new shard needs `python manage.py migrate --database <alias>` before it is listed here.
+# the tests run with core.settings_test, which adds shard_1 and shard_2 for the sharding tests.
+DATABASE_SHARDS = list(dict.fromkeys(alias for alias in os.environ.get('DATABASE_SHARDS', '').split(',') if alias))
+for alias in DATABASE_SHARDS:
+    DATABASES[alias] = {
+        'ENGINE': SQLITE_ENGINE,
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+        'TEST': {'NAME': BASE_DIR / f'test_{alias}.sqlite3'},
+    }
+DATABASE_ROUTERS = ['main_app.sharding.UserShardRouter']
+
+# Caches
+# the request throttles count in the default cache, and the recipe indexes keep their
+# generations there. with more than one worker process set CACHE_REDIS_URL, so they are
+# shared by all of them. without it every process counts and invalidates in its own memory.
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Request throttles (core/throttling.py)
+# requests per client in a sliding window: login and signup per IP address (login
+# also per email), writes and image uploads per user. None turns a throttle off.
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_CLASSES': ['core.throttling.WriteThrottle'],
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '20/min',
+        'login_account': '10/min',
+        'signup': '20/hour',
+        'writes': '600/min',
+        'uploads': '120/hour',
+    },
+}
+# with NUM_PROXIES set DRF takes the client address from X-Forwarded-For
+THROTTLING = {
+    'CACHE': 'default',
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -120,3 +186,95 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'staticfiles'),
 ]
+
+# In-memory recipe indexes
+# each index is built per user on first use, and the least recently used ones
+# are dropped when the indexes of all users together go over the budget.
+
+RECIPE_SIMILARITY_MAX_BYTES = 64 * 1024 * 1024
+# rebuild the similarity matrix in a background thread after a recipe changed
+RECIPE_SIMILARITY_BACKGROUND = True
+RECIPE_COOKABLE_MAX_BYTES = 64 * 1024 * 1024
+RECIPE_TYPEAHEAD_MAX_BYTES = 32 * 1024 * 1024
+# the similarity, cookable and typeahead indexes are kept per process. the processes
+# tell each other about changes with a generation per user in this cache, so with more
+# than one worker it has to be shared (CACHE_REDIS_URL). the indexes are also rebuilt
+# after RECIPE_INDEX_MAX_AGE_SECONDS, None keeps them until they change.
+RECIPE_INDEX_CACHE = 'default'
+RECIPE_INDEX_MAX_AGE_SECONDS = 3600
+
+# Delta sync
+# the next sync token starts this many seconds in the past, so writes that were
+# in flight during a sync are sent again on the next one
+RECIPE_SYNC_OVERLAP_SECONDS = 5
+# objects and deleted ids per page of a sync
+RECIPE_SYNC_PAGE_SIZE = 1000
+# the prune_tombstones command deletes the tombstones older than this,
+# a sync token older than this gets everything of the user again
+RECIPE_SYNC_MAX_AGE_DAYS = 30
+
+# Meal plans (/api/recipe/plan/)
+# the planner returns the best plan it found within this time
+RECIPE_PLAN_TIME_BUDGET_MS = 200
+RECIPE_PLAN_MAX_DAYS = 31
+
+# Catalog event stream (/api/recipe/events/, served by core/asgi.py)
+# the 'local' backend only reaches the streams of this process, with more than one
+# worker use 'redis' so every worker sees the events of all of them
+CATALOG_EVENTS = {
+    'BACKEND': os.environ.get('CATALOG_EVENTS_BACKEND', 'local'),
+    'REDIS_URL': os.environ.get('CATALOG_EVENTS_REDIS_URL', 'redis://localhost:6379/0'),
+    'QUEUE_SIZE': 100,
+    'HEARTBEAT_SECONDS': 15,
+}
+
+# Resumable recipe image uploads
+RECIPE_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+RECIPE_UPLOAD_MAX_CHUNK_BYTES = 8 * 1024 * 1024
+# sessions that did not receive a chunk for this long are expired
+RECIPE_UPLOAD_SESSION_HOURS = 24
+
+# Request profiling (core/profiling.py)
+# staff profile a request by sending the header with their session or API token,
+# a sample rate above 0 also profiles that share of all requests
+PROFILING = {
+    'HEADER': 'X-Profile',
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', '0')),
+    'DIRECTORY': os.path.join(BASE_DIR, 'profiles'),
+    # the oldest capture is dropped when a new one would go over this
+    'MAX_CAPTURES': 100,
+}
+
+# Slow query log (core/querylog.py)
+# queries over the threshold and SQL repeated within one request are written to
+# slow_queries.log and summed up per fingerprint in the admin. None turns it off.
+SLOW_QUERIES = {
+    'THRESHOLD_MS': 100,
+    'N_PLUS_ONE_THRESHOLD': 10,
+    'EXPLAIN': True,
+}
+
+# Request deadlines and load shedding (core/deadlines.py)
+# every request, and each of its queries, has TIMEOUT_MS to finish. with more than
+# MAX_IN_FLIGHT requests running in the process new ones get a 503, the listings first.
+REQUEST_DEADLINES = {
+    'TIMEOUT_MS': int(os.environ.get('REQUEST_TIMEOUT_MS', 10000)),
+    'MAX_IN_FLIGHT': int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', 64)),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.path.join(BASE_DIR, 'slow_queries.log'),
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,  # the file is only created with the first report
+        },
+    },
+    'loggers': {
+        'core.querylog': {'handlers': ['slow_queries'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -0,0 +1,38 @@
+"""
+Settings profile for processes that only serve the API.
+
+    DJANGO_SETTINGS_MODULE=core.settings_api
+
+the browser middleware (sessions, CSRF, messages, clickjacking) is skipped for /api/
+requests, and with DJANGO_ADMIN_ENABLED=0 the admin and the apps it needs are not
+loaded at all.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, MIDDLEWARE, TEMPLATES
+
+API_PATH_PREFIX = '/api/'
+ADMIN_ENABLED = os.environ.get('DJANGO_ADMIN_ENABLED', '1') == '1'
+
+PREFIX_AWARE_MIDDLEWARE = {
+    'django.contrib.sessions.middleware.SessionMiddleware': 'core.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware': 'core.middleware.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware': 'core.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware': 'core.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware': 'core.middleware.XFrameOptionsMiddleware',
+}
+
+if ADMIN_ENABLED:
+    MIDDLEWARE = [PREFIX_AWARE_MIDDLEWARE.get(path, path) for path in MIDDLEWARE]
+else:
+    # without the admin nothing uses sessions or messages
+    INSTALLED_APPS = [
+        app for app in INSTALLED_APPS
+        if app not in ('django.contrib.admin', 'django.contrib.sessions', 'django.contrib.messages')
+    ]
+    MIDDLEWARE = [path for path in MIDDLEWARE if path not in PREFIX_AWARE_MIDDLEWARE]
+    TEMPLATES = [dict(TEMPLATES[0], OPTIONS={'context_processors': [
+        'django.template.context_processors.debug',
+        'django.template.context_processors.request',
+    ]})]
@@ -0,0 +1,21 @@
+"""
+Settings profile of the test suite, `manage.py test` uses it unless DJANGO_SETTINGS_MODULE is set.
+other runners set it themselves, e.g. with pytest-django:
+
+    DJANGO_SETTINGS_MODULE=core.settings_test
+
+the sharding tests need the shard_1 and shard_2 aliases, they override DATABASE_SHARDS themselves,
+so the rest of the suite keeps everything in 'default' as long as DATABASE_SHARDS is not set.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES, SQLITE_ENGINE
+
+TEST_SHARDS = ['shard_1', 'shard_2']
+
+DATABASES = {**DATABASES}
+for alias in TEST_SHARDS:
+    DATABASES.setdefault(alias, {
+        'ENGINE': SQLITE_ENGINE,
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+        'TEST': {'NAME': BASE_DIR / f'test_{alias}.sqlite3'},
+    })
@@ -0,0 +1,156 @@
+import threading
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import deadlines
+from main_app.models import Tag, Ingredient, Recipe
+from recipe.views import TagViewSet
+
+BATCH_URL = reverse('batch')
+ME_URL = reverse('user:me')
+TAGS_URL = reverse('recipe:tag-list')
+INGREDIENTS_URL = reverse('recipe:ingredient-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def home_screen():
+    """The requests of the home screen of the app"""
+    return [{'method': 'GET', 'path': path} for path in (ME_URL, TAGS_URL, INGREDIENTS_URL, RECIPES_URL)]
+
+
+class PublicBatchApiTests(TestCase):
+    """Test the batch API without authentication"""
+
+    def test_login_required(self):
+        """Test that a batch needs an authenticated user"""
+        res = APIClient().post(BATCH_URL, {'requests': home_screen()}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(API_BATCH={'MAX_WORKERS': 1})
+class PrivateBatchApiTests(TestCase):
+    """Test the batch API for an authenticated user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpass123', name='Sample')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        Tag.objects.create(user=self.user, name='Vegan')
+        Ingredient.objects.create(user=self.user, name='Salt')
+        Recipe.objects.create(user=self.user, title='Soup', time_minutes=10, price=5)
+
+    def test_home_screen_in_one_request(self):
+        """Test that the sub-requests are answered in order"""
+        res = self.client.post(BATCH_URL, {'requests': home_screen()}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        me, tags, ingredients, recipes = res.data['responses']
+        self.assertEqual([me['status'], tags['status'], ingredients['status'], recipes['status']], [200] * 4)
+        self.assertEqual(me['body']['email'], 'sample@gmail.com')
+        self.assertEqual([tag['name'] for tag in tags['body']], ['Vegan'])
+        self.assertEqual([ingredient['name'] for ingredient in ingredients['body']], ['Salt'])
+        self.assertEqual(recipes['body'][0]['title'], 'Soup')
+
+    def test_authenticates_once(self):
+        """Test that the token is only looked up for the batch itself"""
+        with patch.object(
+            TokenAuthentication, 'authenticate_credentials', autospec=True,
+            side_effect=TokenAuthentication.authenticate_credentials
+        ) as authenticate:
+            self.client.post(BATCH_URL, {'requests': home_screen()}, format='json')
+
+        self.assertEqual(authenticate.call_count, 1)
+
+    def test_identical_reads_run_once(self):
+        """Test that the per-batch cache answers repeated GETs"""
+        requests = [{'method': 'GET', 'path': TAGS_URL}] * 3
+        with patch.object(TagViewSet, 'list', autospec=True, side_effect=TagViewSet.list) as view:
+            res = self.client.post(BATCH_URL, {'requests': requests}, format='json')
+
+        self.assertEqual(view.call_count, 1)
+        self.assertEqual(len(res.data['responses']), 3)
+
+    def test_reads_after_write_see_it(self):
+        """Test that a write empties the cache and runs before the reads after it"""
+        requests = [
+            {'method': 'GET', 'path': TAGS_URL},
+            {'method': 'POST', 'path': TAGS_URL, 'body': {'name': 'Dessert'}},
+            {'method': 'GET', 'path': TAGS_URL},
+        ]
+        res = self.client.post(BATCH_URL, {'requests': requests}, format='json')
+
+        before, created, after = res.data['responses']
+        self.assertEqual(len(before['body']), 1)
+        self.assertEqual(created['status'], status.HTTP_201_CREATED)
+        self.assertEqual(len(after['body']), 2)
+
+    def test_errors_stay_in_their_sub_response(self):
+        """Test that invalid and unknown sub-requests only fail themselves"""
+        requests = [
+            {'method': 'POST', 'path': TAGS_URL, 'body': {'name': ''}},
+            {'method': 'GET', 'path': '/api/unknown/'},
+            {'method': 'GET', 'path': TAGS_URL},
+        ]
+        res = self.client.post(BATCH_URL, {'requests': requests}, format='json')
+
+        statuses = [response['status'] for response in res.data['responses']]
+        self.assertEqual(statuses, [400, 404, 200])
+
+    def test_limits(self):
+        """Test that batches over the size or cost limit are rejected"""
+        too_many = [{'method': 'GET', 'path': TAGS_URL}] * 21
+        too_costly = [{'method': 'POST', 'path': TAGS_URL, 'body': {'name': 'x'}}] * 14
+
+        for requests in (too_many, too_costly):
+            res = self.client.post(BATCH_URL, {'requests': requests}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tag.objects.count(), 1)
+
+    def test_paths_outside_api_rejected(self):
+        """Test that only API paths can be batched, and batches do not nest"""
+        for path in ('/admin/', BATCH_URL):
+            res = self.client.post(BATCH_URL, {'requests': [{'method': 'GET', 'path': path}]}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(API_BATCH={'MAX_WORKERS': 4})
+class ParallelBatchApiTests(TransactionTestCase):
+    """Test the reads of a batch running in parallel threads"""
+
+    def test_parallel_reads(self):
+        """Test that the threads answer every read"""
+        user = get_user_model().objects.create_user('sample@gmail.com', 'testpass123')
+        Tag.objects.create(user=user, name='Vegan')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        res = client.post(BATCH_URL, {'requests': home_screen()}, format='json')
+
+        self.assertEqual([response['status'] for response in res.data['responses']], [200] * 4)
+        self.assertEqual(res.data['responses'][1]['body'][0]['name'], 'Vegan')
+
+    def test_parallel_reads_keep_deadline(self):
+        """Test that the queries of the read threads run under the deadline of the batch"""
+        user = get_user_model().objects.create_user('sample@gmail.com', 'testpass123')
+        client = APIClient()
+        client.force_authenticate(user)
+        threads = set()
+        wrapper = deadlines.QueryDeadline.__call__
+
+        def record(query_deadline, *args):
+            threads.add(threading.get_ident())
+            return wrapper(query_deadline, *args)
+
+        with patch.object(deadlines.QueryDeadline, '__call__', record):
+            res = client.post(BATCH_URL, {'requests': home_screen()}, format='json')
+
+        self.assertEqual([response['status'] for response in res.data['responses']], [200] * 4)
+        self.assertTrue(threads - {threading.get_ident()})
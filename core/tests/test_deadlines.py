@@ -0,0 +1,163 @@
+import threading
+import time
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.deadlines import Deadline, DeadlineExceeded, QueryDeadline, queued_seconds
+from core.middleware import DeadlineMiddleware
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TOKEN_URL = reverse('user:token')
+
+
+class DeadlineMiddlewareTests(SimpleTestCase):
+    """Test the deadlines and the load shedding of DeadlineMiddleware"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.release = threading.Event()
+
+    def app(self, request):
+        if request.path == '/slow/':
+            self.release.wait(5)
+        return HttpResponse()
+
+    def start_slow(self, middleware, count):
+        """Hold count requests in the middleware until self.release is set"""
+        threads = [
+            threading.Thread(target=middleware, args=(self.factory.get('/slow/'),)) for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        while middleware.shedder.in_flight < count:
+            time.sleep(0.001)
+        return threads
+
+    @override_settings(REQUEST_DEADLINES={'MAX_IN_FLIGHT': 4, 'EXPENSIVE_SHARE': 0.5})
+    def test_expensive_requests_shed_first(self):
+        """Test that over the limit listings get 503 with Retry-After while cheap requests still run"""
+        middleware = DeadlineMiddleware(self.app)
+        threads = self.start_slow(middleware, 2)
+        try:
+            res = middleware(self.factory.get(RECIPES_URL))
+            self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(res['Retry-After'], '1')
+
+            res = middleware(self.factory.post(TOKEN_URL))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+        finally:
+            self.release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(middleware.shedder.in_flight, 0)
+        self.assertEqual(middleware(self.factory.get(RECIPES_URL)).status_code, status.HTTP_200_OK)
+
+    def test_queued_too_long(self):
+        """Test that a request that waited too long in front of the worker is shed"""
+        middleware = DeadlineMiddleware(self.app)
+        started = f't={time.time() - 5:.3f}'
+
+        res = middleware(self.factory.get(RECIPES_URL, HTTP_X_REQUEST_START=started))
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        res = middleware(self.factory.get(TOKEN_URL, HTTP_X_REQUEST_START=started))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_queued_seconds(self):
+        """Test that the proxy start time is read in seconds, milliseconds or microseconds"""
+        for value in ('t=1700000000.0', '1700000000000', 't=1700000000000000'):
+            self.assertAlmostEqual(queued_seconds(value, now=1700000000.5), 0.5)
+        self.assertIsNone(queued_seconds('soon'))
+
+    def test_deadline_from_header(self):
+        """Test that clients can ask for a shorter deadline, not for a longer one, and bad values are ignored"""
+        deadlines = []
+        middleware = DeadlineMiddleware(lambda request: deadlines.append(request.deadline) or HttpResponse())
+
+        middleware(self.factory.get(RECIPES_URL, HTTP_X_REQUEST_TIMEOUT='50'))
+        middleware(self.factory.get(RECIPES_URL, HTTP_X_REQUEST_TIMEOUT='30000'))
+        middleware(self.factory.get(RECIPES_URL, HTTP_X_REQUEST_TIMEOUT='soon'))
+        middleware(self.factory.get(RECIPES_URL))
+
+        short, capped, ignored, default = (deadline.remaining() for deadline in deadlines)
+        self.assertLessEqual(short, 0.05)
+        self.assertLessEqual(capped, 10)
+        self.assertGreater(capped, 9)
+        self.assertAlmostEqual(ignored, 10, delta=1)
+        self.assertAlmostEqual(default, 10, delta=1)
+
+
+class QueryDeadlineTests(TestCase):
+    """Test the deadline passed down to the queries"""
+
+    def test_long_query_interrupted(self):
+        """Test that a SQLite query is stopped when the deadline passes"""
+        started = time.monotonic()
+        with connection.execute_wrapper(QueryDeadline(Deadline(0.05))):
+            with self.assertRaises(DeadlineExceeded), connection.cursor() as cursor:
+                cursor.execute(
+                    'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) '
+                    'SELECT count(*) FROM (SELECT x FROM c LIMIT 1000000000)'
+                )
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_statement_timeout_set_when_needed(self):
+        """Test that PostgreSQL only gets a new statement_timeout once the one set is too long by the slack"""
+        deadline = Mock(spec=Deadline, expired=False)
+        query_deadline = QueryDeadline(deadline, slack_ms=100)
+        database = Mock(vendor='postgresql')
+        context = {'connection': database, 'cursor': Mock()}
+        execute = Mock()
+
+        for remaining in (10, 9.95, 9.5, 9.45):
+            deadline.remaining.return_value = remaining
+            query_deadline(execute, 'SELECT 1', None, False, context)
+
+        sets = context['cursor'].cursor.execute.call_args_list
+        self.assertEqual([call.args[1] for call in sets], [[10000], [9500]])
+        self.assertEqual(execute.call_count, 4)
+
+    @override_settings(REQUEST_DEADLINES={'TIMEOUT_MS': 50, 'MAX_IN_FLIGHT': 2, 'EXPENSIVE_SHARE': 1})
+    def test_overloaded_request_stops_at_deadline(self):
+        """Test that a slow request runs no more queries once its deadline passed, it gets 503 instead"""
+        now = [100.0]
+        executed = []
+
+        def app(request):
+            for _ in range(3):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                executed.append(now[0])
+                now[0] += 0.03  # every query of the overloaded database takes 30 ms
+            return HttpResponse()
+
+        middleware = DeadlineMiddleware(app)
+        with patch('core.deadlines.time.monotonic', side_effect=lambda: now[0]):
+            request = RequestFactory().get(RECIPES_URL)
+            try:
+                res = middleware(request)
+            except DeadlineExceeded as exc:
+                res = middleware.process_exception(request, exc)
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(executed, [100.0, 100.03])
+        self.assertEqual(middleware.shedder.in_flight, 0)
+
+    def test_expired_request_answered_503(self):
+        """Test that a request whose deadline passed gets 503 instead of running its queries"""
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user('sample@gmail.com', 'testpass123'))
+
+        with patch.object(Deadline, 'remaining', return_value=-1):
+            res = client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', res)
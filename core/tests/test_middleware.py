@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, Client, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+# the middleware of core/settings_api.py when the admin is enabled
+PREFIX_AWARE_MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'core.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'core.middleware.CsrfViewMiddleware',
+    'core.middleware.AuthenticationMiddleware',
+    'core.middleware.MessageMiddleware',
+    'core.middleware.XFrameOptionsMiddleware',
+]
+
+
+@override_settings(MIDDLEWARE=PREFIX_AWARE_MIDDLEWARE, API_PATH_PREFIX='/api/')
+class ApiExemptMiddlewareTests(TestCase):
+    """Test that the browser middleware is skipped for API requests only"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser('admin@gmail.com', 'testpass123')
+
+    def test_api_skips_browser_middleware(self):
+        """Test that API responses carry no session, CSRF or frame options handling"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        res = client.get(reverse('recipe:tag-list'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('X-Frame-Options', res)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, res.cookies)
+        self.assertFalse(hasattr(res.wsgi_request, 'session'))
+
+    def test_api_token_auth_still_works(self):
+        """Test that token authentication does not depend on the skipped middleware"""
+        client = APIClient()
+        res = client.post(reverse('user:token'), {'email': 'admin@gmail.com', 'password': 'testpass123'})
+        self.assertEqual(res.status_code, 200)
+
+        client.credentials(HTTP_AUTHORIZATION='Token ' + res.data['token'])
+        res = client.get(reverse('user:me'))
+        self.assertEqual(res.data['email'], 'admin@gmail.com')
+
+    def test_admin_keeps_browser_middleware(self):
+        """Test that the admin still gets sessions, CSRF and frame options"""
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+
+        res = client.get(reverse('admin:index'))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['X-Frame-Options'], 'DENY')
+
+        # CSRF is still enforced outside the API
+        res = client.post(reverse('admin:logout'))
+        self.assertEqual(res.status_code, 403)
+
+
+class StartupImportTests(SimpleTestCase):
+    """Test that the heavy libraries are only imported by the endpoints that use them"""
+
+    def test_no_heavy_imports_at_startup(self):
+        """Test that loading the project and its URLconf imports neither numpy nor Pillow"""
+        code = (
+            'import sys, django; django.setup(); '
+            'from django.urls import resolve; resolve("/api/recipe/recipes/"); '
+            'print(sorted(name for name in ("numpy", "PIL") if name in sys.modules))'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'core.settings'},
+            cwd=settings.BASE_DIR,
+        )
+        self.assertEqual(result.stdout.strip(), '[]')
@@ -0,0 +1,101 @@
+import os
+import pstats
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from main_app.models import ProfileCapture
+
+TAGS_URL = reverse('recipe:tag-list')
+PROFILES_DIR = tempfile.mkdtemp()
+
+
+@override_settings(PROFILING={'HEADER': 'X-Profile', 'SAMPLE_RATE': 0, 'DIRECTORY': PROFILES_DIR, 'MAX_CAPTURES': 2})
+class ProfilingMiddlewareTests(TestCase):
+    """Test the on-demand and sampled request profiling"""
+
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user('staff@gmail.com', 'testpass123', is_staff=True)
+        self.user = get_user_model().objects.create_user('user@gmail.com', 'testpass123')
+        self.client = APIClient()
+
+    def tearDown(self):
+        shutil.rmtree(PROFILES_DIR, ignore_errors=True)
+
+    def get_profiled(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        return self.client.get(TAGS_URL, HTTP_AUTHORIZATION='Token ' + token.key, HTTP_X_PROFILE='1')
+
+    def test_staff_token_profiles_request(self):
+        """Test that a staff token with the header stores a capture with its files"""
+        res = self.get_profiled(self.staff)
+
+        self.assertEqual(res.status_code, 200)
+        capture = ProfileCapture.objects.get(pk=res['X-Profile-Id'])
+        self.assertEqual(capture.path, TAGS_URL)
+        self.assertEqual(capture.user, self.staff)
+        self.assertFalse(capture.sampled)
+        self.assertGreater(capture.query_count, 0)
+        self.assertGreater(capture.memory_peak, 0)
+        # the .prof file loads with pstats
+        stats = pstats.Stats(capture.file_path('prof', PROFILES_DIR))
+        self.assertGreater(stats.total_calls, 0)
+        self.assertTrue(os.path.exists(capture.file_path('json', PROFILES_DIR)))
+
+    def test_header_ignored_for_other_users(self):
+        """Test that users who are not staff can not profile requests"""
+        res = self.get_profiled(self.user)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('X-Profile-Id', res)
+        self.assertFalse(ProfileCapture.objects.exists())
+
+    def test_not_profiled_without_header(self):
+        """Test that requests are not profiled by default"""
+        self.client.force_authenticate(self.staff)
+        res = self.client.get(TAGS_URL)
+
+        self.assertNotIn('X-Profile-Id', res)
+        self.assertFalse(ProfileCapture.objects.exists())
+
+    def test_sampled_requests(self):
+        """Test that a sample rate of 1 profiles every request"""
+        with self.settings(PROFILING={'SAMPLE_RATE': 1, 'DIRECTORY': PROFILES_DIR}):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            res = client.get(TAGS_URL)
+
+        capture = ProfileCapture.objects.get(pk=res['X-Profile-Id'])
+        self.assertTrue(capture.sampled)
+        self.assertIsNone(capture.user)
+
+    def test_ring_buffer_keeps_newest_captures(self):
+        """Test that only MAX_CAPTURES captures and their files are kept"""
+        ids = [int(self.get_profiled(self.staff)['X-Profile-Id']) for _ in range(3)]
+
+        self.assertEqual(list(ProfileCapture.objects.order_by('pk').values_list('pk', flat=True)), ids[1:])
+        self.assertEqual(len(os.listdir(PROFILES_DIR)), 4)
+        self.assertFalse(os.path.exists(ProfileCapture(pk=ids[0]).file_path('prof', PROFILES_DIR)))
+
+    def test_admin_download(self):
+        """Test that staff browse and download the captures in the admin"""
+        capture_id = self.get_profiled(self.staff)['X-Profile-Id']
+        admin = get_user_model().objects.create_superuser('admin@gmail.com', 'testpass123')
+        client = Client()
+        client.force_login(admin)
+
+        res = client.get(reverse('admin:main_app_profilecapture_change', args=[capture_id]))
+        self.assertContains(res, 'slowest queries')
+
+        res = client.get(reverse('admin:main_app_profilecapture_download', args=[capture_id, 'prof']))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('attachment', res['Content-Disposition'])
+
+        res = client.get(reverse('admin:main_app_profilecapture_download', args=[capture_id, 'txt']))
+        self.assertEqual(res.status_code, 404)
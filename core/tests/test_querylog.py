@@ -0,0 +1,109 @@
+import json
+import logging
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import querylog
+from main_app.models import QueryFingerprint, Tag
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class NormalizeTests(TestCase):
+    """Test the normalization of SQL and parameters"""
+
+    def test_values_and_lists_normalize_the_same(self):
+        """Test that queries differing only in values or list lengths share a fingerprint"""
+        first = querylog.normalize('SELECT "id" FROM "t1" WHERE "id" IN (%s, %s) AND "name" = \'x\'')
+        second = querylog.normalize('SELECT  "id" FROM "t1"\nWHERE "id" IN (%s) AND "name" = \'it\'\'s\'')
+
+        self.assertEqual(first, 'SELECT "id" FROM "t1" WHERE "id" IN (...) AND "name" = ?')
+        self.assertEqual(first, second)
+
+    def test_multi_row_values(self):
+        """Test that the rows of a bulk insert are collapsed"""
+        sql = querylog.normalize('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s), (%s, %s)')
+        self.assertEqual(sql, 'INSERT INTO "t" ("a", "b") VALUES (...), ...')
+
+    def test_params_shape(self):
+        """Test that only the types of the parameters are described"""
+        self.assertEqual(querylog.params_shape((1, 2, 3, 'secret', None), False), 'int x 3, str, NoneType')
+        self.assertEqual(querylog.params_shape(iter([]), True), 'executemany')
+
+    def test_repeated_sql_is_n_plus_one_suspect(self):
+        """Test that SQL repeated within a request is reported once with its count"""
+        queries = querylog.RequestQueries(threshold_ms=1000)
+        for _ in range(3):
+            queries(lambda *args: None, 'SELECT 1 WHERE %s', (1,), False, {'connection': connection})
+        queries(lambda *args: None, 'SELECT 2', (), False, {'connection': connection})
+
+        reports = queries.reports(n_plus_one_threshold=3)
+
+        self.assertEqual(reports, [{'kind': 'n+1', 'view': 'unknown', 'sql': 'SELECT 1 WHERE %s', 'repeats': 3}])
+
+
+@override_settings(SLOW_QUERIES={'THRESHOLD_MS': 0, 'N_PLUS_ONE_THRESHOLD': 1000, 'BACKGROUND': False})
+class SlowQueryMiddlewareTests(TestCase):
+    """Test the slow query log of requests"""
+
+    def setUp(self):
+        # with THRESHOLD_MS 0 every request logs, keep the reports away from the log file of LOGGING
+        self.records = []
+        handler = logging.Handler()
+        handler.emit = self.records.append
+        handlers = patch.object(querylog.logger, 'handlers', [handler])
+        handlers.start()
+        self.addCleanup(handlers.stop)
+
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_slow_queries_logged_and_fingerprinted(self):
+        """Test that slow queries are logged and summed up per view with their plan"""
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        with self.assertLogs('core.querylog') as logs:
+            self.client.get(TAGS_URL)
+            self.client.get(TAGS_URL)
+
+        entries = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+        self.assertTrue(all(entry['view'] == 'TagViewSet.list' for entry in entries))
+        # the values of the parameters are never logged, only their types
+        self.assertTrue(all('params' not in entry for entry in entries))
+        self.assertIn('int', {entry['params_shape'] for entry in entries})
+        fingerprint = QueryFingerprint.objects.get(view='TagViewSet.list', sql__contains='main_app_tag')
+        self.assertEqual(fingerprint.slow_count, 2)
+        self.assertGreaterEqual(fingerprint.max_ms, 0)
+        self.assertIn('main_app_tag', fingerprint.explain)
+
+    def test_n_plus_one_suspects(self):
+        """Test that SQL repeated in a request counts as an N+1 suspect of its view"""
+        with self.settings(SLOW_QUERIES={'THRESHOLD_MS': 10 ** 6, 'N_PLUS_ONE_THRESHOLD': 1, 'BACKGROUND': False}):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            with self.assertLogs('core.querylog'):
+                client.get(TAGS_URL)
+
+        fingerprint = QueryFingerprint.objects.filter(view='TagViewSet.list').first()
+        self.assertEqual(fingerprint.n_plus_one_count, 1)
+        self.assertEqual(fingerprint.slow_count, 0)
+
+    def test_admin_lists_fingerprints(self):
+        """Test that the fingerprints are listed in the admin"""
+        with self.assertLogs('core.querylog'):
+            self.client.get(TAGS_URL)
+        admin = get_user_model().objects.create_superuser('admin@gmail.com', 'testpass123')
+        self.client.force_login(admin)
+
+        res = self.client.get(reverse('admin:main_app_queryfingerprint_changelist') + '?n_plus_one=no')
+
+        self.assertContains(res, 'TagViewSet.list')
+        # the queries of the admin page are slow as well
+        self.assertTrue(any('changelist_view' in record.getMessage() for record in self.records))
@@ -0,0 +1,118 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import throttling
+from main_app.models import Recipe
+
+TOKEN_URL = reverse('user:token')
+CREATE_USER_URL = reverse('user:create')
+TAGS_URL = reverse('recipe:tag-list')
+
+RATES = {'login': '3/min', 'login_account': '5/min', 'signup': '2/hour', 'writes': '3/min', 'uploads': '1/min'}
+
+
+@override_settings(REST_FRAMEWORK={
+    'DEFAULT_THROTTLE_CLASSES': ['core.throttling.WriteThrottle'], 'DEFAULT_THROTTLE_RATES': RATES,
+})
+class ThrottlingTests(TestCase):
+    """Test the sliding window throttles of the login, signup, write and upload requests"""
+
+    def setUp(self):
+        # the counters live in the cache, outside the test transaction
+        cache.clear()
+        throttling.fallback_cache.clear()
+        self.addCleanup(cache.clear)
+        self.now = 1200.0  # the start of a minute
+        clock = patch('core.throttling.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpass123')
+
+    def login(self, email='sample@gmail.com', ip='10.0.0.1'):
+        return self.client.post(TOKEN_URL, {'email': email, 'password': 'testpass123'}, REMOTE_ADDR=ip)
+
+    def test_login_throttled_per_ip(self):
+        """Test that an address gets 429 with Retry-After over the login rate, other addresses do not"""
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+        res = self.login()
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '60')
+        self.assertEqual(self.login(ip='10.0.0.2').status_code, status.HTTP_200_OK)
+
+    def test_login_throttled_per_account(self):
+        """Test that an account is throttled when it is tried from many addresses"""
+        for i in range(5):
+            self.assertEqual(self.login(ip=f'10.0.0.{i}').status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.login(ip='10.0.1.1').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(
+            self.login(email='other@gmail.com', ip='10.0.1.1').status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+    def test_window_slides(self):
+        """Test that the requests of the previous window count less the further it is behind"""
+        for _ in range(3):
+            self.login()
+        # half of the previous minute is still in the window: 3 * 0.5 + 1 allowed, 3 * 0.5 + 2 not
+        self.now += 90
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.login().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        self.now += 60  # the requests are two minutes old
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+    def test_signup_throttled(self):
+        """Test that creating users is throttled per address"""
+        statuses = [
+            self.client.post(
+                CREATE_USER_URL, {'email': f'new{i}@gmail.com', 'password': 'testpass123', 'name': 'New'}
+            ).status_code
+            for i in range(3)
+        ]
+
+        self.assertEqual(statuses, [status.HTTP_201_CREATED] * 2 + [status.HTTP_429_TOO_MANY_REQUESTS])
+        self.assertFalse(get_user_model().objects.filter(email='new2@gmail.com').exists())
+
+    def test_writes_throttled_per_user(self):
+        """Test that writes are throttled per user and reads are not counted"""
+        other = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        self.client.force_authenticate(self.user)
+        for i in range(3):
+            self.assertEqual(self.client.get(TAGS_URL).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.post(TAGS_URL, {'name': f'Tag {i}'}).status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(self.client.post(TAGS_URL, {'name': 'Tag'}).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.get(TAGS_URL).status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.post(TAGS_URL, {'name': 'Tag'}).status_code, status.HTTP_201_CREATED)
+
+    def test_uploads_have_own_budget(self):
+        """Test that image uploads are throttled apart from the other writes"""
+        self.client.force_authenticate(self.user)
+        recipe = Recipe.objects.create(user=self.user, title='Soup', time_minutes=10, price=5)
+        url = reverse('recipe:recipe-start-upload', args=[recipe.id])
+        payload = {'filename': 'soup.jpg', 'size': 10}
+
+        self.assertEqual(self.client.post(url, payload).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.post(url, payload).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.post(TAGS_URL, {'name': 'Tag'}).status_code, status.HTTP_201_CREATED)
+
+    def test_cache_failure_falls_back_to_memory(self):
+        """Test that the requests are still counted when the shared cache fails"""
+        with patch.object(cache, 'incr', side_effect=ConnectionError('cache is down')), \
+                self.assertLogs('core.throttling', 'WARNING'):
+            for _ in range(3):
+                self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+            self.assertEqual(self.login().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
@@ -0,0 +1,154 @@
+"""
+Request throttles with a sliding window counter in the cache.
+
+every client (the user, or the IP address for the anonymous endpoints) has one
+counter per scope and fixed window, e.g. per minute, incremented atomically in the
+cache. the requests of the last window are estimated from the counters of the
+current and the previous window, the previous one weighted by how much of it is
+still inside the sliding window:
+
+    previous * (1 - elapsed / window) + current
+
+that is two cache operations per request (incr, get) whatever the rate, instead of
+the list of timestamps DRF's SimpleRateThrottle reads and writes back on every request.
+the counters expire by themselves after two windows. refused requests are counted
+too, so a client that keeps retrying stays throttled until it slows down.
+
+the rates are the DEFAULT_THROTTLE_RATES of REST_FRAMEWORK in the settings, per scope:
+
+- login: POST /api/user/token/ per IP address, and login_account per email, so an
+  account is not guessed at from many addresses either
+- signup: POST /api/user/create/ per IP address
+- writes: POST, PUT, PATCH and DELETE of the API per user, the default throttle
+- uploads: the image uploads per user, a budget of their own instead of writes
+
+the counters are in the THROTTLING['CACHE'] cache, shared by all processes when it
+is redis or memcached. when that cache fails, the process counts in its own memory
+until it is back, so the limits still hold per process.
+"""
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'KEY_PREFIX': 'throttle',
+}
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+fallback_cache = LocMemCache('throttle-fallback', {'OPTIONS': {'MAX_ENTRIES': 100000}})
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THROTTLING', {})}
+
+
+def parse_rate(rate):
+    """'<requests>/<period>', the period as in DRF: s, m, h or d, e.g. '10/min'. returns (requests, seconds)"""
+    requests, period = rate.split('/')
+    return int(requests), PERIODS[period[0]]
+
+
+def increment(cache, key, timeout):
+    """Add one to the counter of the key, creating it when this is the first request of the window"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # add is a no-op when another process created the counter in between
+        cache.add(key, 0, timeout)
+        return cache.incr(key)
+
+
+def count(key, number, window):
+    """Count a request in window number, returns (requests in the previous window, in this one)"""
+    cache = caches[get_config()['CACHE']]
+    current_key, previous_key = f'{key}:{number}', f'{key}:{number - 1}'
+    try:
+        current = increment(cache, current_key, window * 2)
+        previous = cache.get(previous_key, 0)
+    except Exception:
+        logger.warning('The throttle cache failed, counting in the memory of the process', exc_info=True)
+        current = increment(fallback_cache, current_key, window * 2)
+        previous = fallback_cache.get(previous_key, 0)
+    return previous, current
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """Throttle the requests of a client to the rate of the scope"""
+    scope = None
+
+    def get_client(self, request, view):
+        """The client to count the request for, None does not count it"""
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        client = self.get_client(request, view)
+        if rate is None or client is None:
+            return True
+
+        self.limit, self.window = parse_rate(rate)
+        number, self.elapsed = divmod(time.time(), self.window)
+        self.previous, self.current = count(
+            f"{get_config()['KEY_PREFIX']}:{self.scope}:{client}", int(number), self.window
+        )
+        return self.previous * (1 - self.elapsed / self.window) + self.current <= self.limit
+
+    def wait(self):
+        """Seconds until the estimate is back under the limit, the Retry-After of the 429"""
+        if self.current >= self.limit:
+            # the previous window already counts nothing by the end of this one
+            return self.window - self.elapsed
+        # the previous window weighs less every second
+        return max(self.window * (1 - (self.limit - self.current) / self.previous) - self.elapsed, 1)
+
+
+class LoginThrottle(SlidingWindowThrottle):
+    scope = 'login'
+
+    def get_client(self, request, view):
+        return f'ip:{self.get_ident(request)}'
+
+
+class LoginAccountThrottle(SlidingWindowThrottle):
+    scope = 'login_account'
+
+    def get_client(self, request, view):
+        email = request.data.get('email')
+        if not isinstance(email, str) or not email:
+            return None
+        # hashed, cache keys can not have spaces and the email should not be in them
+        return 'email:' + hashlib.sha256(email.strip().lower().encode()).hexdigest()[:32]
+
+
+class SignupThrottle(SlidingWindowThrottle):
+    scope = 'signup'
+
+    def get_client(self, request, view):
+        return f'ip:{self.get_ident(request)}'
+
+
+class WriteThrottle(SlidingWindowThrottle):
+    """The default throttle, reads are not counted"""
+    scope = 'writes'
+
+    def get_client(self, request, view):
+        if request.method in SAFE_METHODS:
+            return None
+        return super().get_client(request, view)
+
+
+class UploadThrottle(WriteThrottle):
+    scope = 'uploads'
@@ -1,12 +1,19 @@
-from django.contrib import admin
 from django.urls import path, include
 
 from django.conf.urls.static import static
 from django.conf import settings
 
+from .batch import BatchView
+
 urlpatterns = [
-                  path('admin/', admin.site.urls),
                   path('api/user/', include('user.urls', namespace='user')),
                   path('api/recipe/', include('recipe.urls', namespace='recipe')),
+                  path('api/batch/', BatchView.as_view(), name='batch'),
               ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 # it makes the media url available in development server
+
+# the admin is optional, API only processes can leave it out of INSTALLED_APPS (see core/settings_api.py)
+if 'django.contrib.admin' in settings.INSTALLED_APPS:
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
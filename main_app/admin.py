@@ -1,12 +1,81 @@
-from django.contrib import admin
+import json
+
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.http import FileResponse, Http404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from django.utils.functional import cached_property
 from .models import *
+from .purge import purge_user
 from django.utils.translation import gettext as _
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an unbounded COUNT(*).
+    on PostgreSQL an unfiltered changelist uses the planner estimate of the table size,
+    anything else is counted up to COUNT_LIMIT rows only.
+    pages past a capped count are still served, the count then grows to one row past the
+    requested page so the page links keep offering the next one.
+    """
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            # reltuples is -1 (or 0) for tables that were never analyzed
+            if row and row[0] > self.COUNT_LIMIT:
+                return int(row[0])
+
+        # SELECT COUNT(*) FROM (SELECT ... LIMIT n) stops scanning after n rows
+        return queryset.order_by()[:self.COUNT_LIMIT].count()
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if self.count < self.COUNT_LIMIT:
+                raise
+            number = int(number)
+            bottom = (number - 1) * self.per_page
+            if not self.object_list[bottom:bottom + 1].exists():
+                raise
+            self.__dict__['count'] = number * self.per_page + 1
+            self.__dict__.pop('num_pages', None)
+            return number
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Base admin for the tables that can grow to millions of rows"""
+    paginator = EstimatedCountPaginator
+    # otherwise the changelist runs a second, unfiltered COUNT(*) for "(x total)"
+    show_full_result_count = False
+
+
 class UserAdmin(BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # every filter is backed by an index on the user table (see User.Meta.indexes),
+    # the default "groups" filter is dropped because it joins the groups table.
+    list_filter = ('is_staff', 'is_superuser', 'is_active')
+    # the default search fields include "username" which our user model does not have.
+    # the unique index on email serves this prefix lookup.
+    search_fields = ('email__startswith',)
 
     # we should customize our user admin fieldsets field to
     # support our custom model as default model in project that is expecting.
@@ -25,8 +94,174 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+    actions = ['purge_users']
+
+    @admin.action(description=_('Purge selected users and their catalogs'), permissions=['delete'])
+    def purge_users(self, request, queryset):
+        """Delete the users with the batched purge instead of the delete collector"""
+        for user in list(queryset.order_by('pk')):
+            stats = purge_user(user)
+            self.message_user(
+                request,
+                _('Purged %(email)s: %(recipes)d recipes, %(tags)d tags, %(ingredients)d ingredients.') % {
+                    'email': user.email, **stats
+                },
+                messages.SUCCESS
+            )
+
+
+class RecipeAttrAdmin(LargeTableAdmin):
+    """Admin for tags and ingredients"""
+    list_display = ('name', 'user')
+    list_select_related = ('user',)  # one join instead of one user query per row
+    raw_id_fields = ('user',)
+    # needed by the recipe autocomplete widgets, served by the index on name
+    search_fields = ('name__startswith',)
+
+
+class RecipeAdmin(LargeTableAdmin):
+    list_display = ('title', 'user', 'time_minutes', 'price')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    # autocomplete widgets only load the options that match what is typed,
+    # instead of rendering every tag and ingredient of every user.
+    autocomplete_fields = ('tags', 'ingredients')
+    search_fields = ('title__startswith',)
+
+
+class ProfileCaptureAdmin(admin.ModelAdmin):
+    """Browse and download the captures of the profiling middleware (see core/profiling.py)"""
+    list_display = (
+        'created_at', 'method', 'path', 'status_code', 'duration_ms',
+        'query_count', 'query_ms', 'memory_peak', 'user', 'sampled',
+    )
+    list_filter = ('method', 'sampled')
+    list_select_related = ('user',)
+    ordering = ('-pk',)
+    fields = (
+        'created_at', 'method', 'path', 'status_code', 'duration_ms', 'query_count',
+        'query_ms', 'memory_peak', 'user', 'sampled', 'downloads', 'summary',
+    )
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:object_id>/download/<str:extension>/',
+                self.admin_site.admin_view(self.download),
+                name='main_app_profilecapture_download'
+            ),
+        ] + super().get_urls()
+
+    @property
+    def directory(self):
+        from core.profiling import get_config
+        return get_config()['DIRECTORY']
+
+    def download(self, request, object_id, extension):
+        capture = self.get_object(request, object_id)
+        if capture is None or extension not in ProfileCapture.FILE_EXTENSIONS:
+            raise Http404
+        if not self.has_view_permission(request, capture):
+            raise Http404
+        try:
+            return FileResponse(open(capture.file_path(extension, self.directory), 'rb'), as_attachment=True)
+        except FileNotFoundError:
+            raise Http404
+
+    @admin.display(description=_('Files'))
+    def downloads(self, obj):
+        return format_html(
+            '<a href="{}">.prof</a> &middot; <a href="{}">.json</a>',
+            reverse('admin:main_app_profilecapture_download', args=[obj.pk, 'prof']),
+            reverse('admin:main_app_profilecapture_download', args=[obj.pk, 'json']),
+        )
+
+    @admin.display(description=_('Summary'))
+    def summary(self, obj):
+        """The profile, the slowest queries and the allocation sites of the capture"""
+        try:
+            with open(obj.file_path('json', self.directory)) as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return _('The files of this capture are gone.')
+        queries = sorted(data['queries'], key=lambda query: -query['ms'])
+        lines = [data['profile'], 'slowest queries:']
+        lines += [f'{query["ms"]:>10.3f} ms  {query["alias"]}  {query["sql"]}' for query in queries[:30]]
+        if data['top_allocations']:
+            lines += ['', 'allocated and still alive at the end of the request:']
+            lines += data['top_allocations']
+        return format_html('<pre style="white-space: pre-wrap">{}</pre>', '\n'.join(lines))
+
+    def delete_model(self, request, obj):
+        obj.delete_files(self.directory)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            obj.delete_files(self.directory)
+        super().delete_queryset(request, queryset)
+
+
+class NPlusOneFilter(admin.SimpleListFilter):
+    title = _('N+1 suspect')
+    parameter_name = 'n_plus_one'
+
+    def lookups(self, request, model_admin):
+        return (('yes', _('Yes')), ('no', _('No')))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(n_plus_one_count__gt=0)
+        if self.value() == 'no':
+            return queryset.filter(n_plus_one_count=0)
+        return queryset
+
+
+class QueryFingerprintAdmin(admin.ModelAdmin):
+    """The slow queries and N+1 suspects reported by the slow query log (see core/querylog.py)"""
+    list_display = (
+        'view', 'short_sql', 'slow_count', 'average_ms', 'max_ms',
+        'n_plus_one_count', 'max_repeats', 'last_seen',
+    )
+    list_filter = (NPlusOneFilter,)
+    search_fields = ('view__startswith',)
+    # the statements that cost the most time in total first
+    ordering = ('-total_ms',)
+    readonly_fields = (
+        'fingerprint', 'view', 'sql', 'params_shape', 'slow_count', 'total_ms', 'max_ms',
+        'n_plus_one_count', 'max_repeats', 'plan', 'first_seen', 'last_seen',
+    )
+    exclude = ('explain',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description=_('SQL'))
+    def short_sql(self, obj):
+        return obj.sql if len(obj.sql) <= 120 else obj.sql[:117] + '...'
+
+    @admin.display(description=_('Average ms'), ordering='total_ms')
+    def average_ms(self, obj):
+        return round(obj.total_ms / obj.slow_count, 1) if obj.slow_count else None
+
+    @admin.display(description=_('Explain'))
+    def plan(self, obj):
+        return format_html('<pre style="white-space: pre-wrap">{}</pre>', obj.explain)
+
 
 admin.site.register(User, UserAdmin)
-admin.site.register(Tag)  # and you don't need to specify the admin because we'll use the default one.
-admin.site.register(Ingredient)  # same as tag
-admin.site.register(Recipe)
+admin.site.register(Tag, RecipeAttrAdmin)
+admin.site.register(Ingredient, RecipeAttrAdmin)
+admin.site.register(Recipe, RecipeAdmin)
+admin.site.register(ProfileCapture, ProfileCaptureAdmin)
+admin.site.register(QueryFingerprint, QueryFingerprintAdmin)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MainAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main_app'
+
+    def ready(self):
+        # connect the receivers keeping updated_at and the tombstones current
+        from . import signals  # noqa: F401
@@ -0,0 +1,106 @@
+"""
+SQLite for several processes writing at once, the ENGINE of the databases in core/settings.py.
+
+with Django's defaults concurrent writers end in "database is locked":
+
+- the rollback journal blocks the readers while a write commits. in WAL mode they
+  go on reading the last commit, and synchronous=NORMAL only syncs the WAL at
+  checkpoints, which survives a crash of the application (a power loss can drop the
+  last commits).
+- atomic() starts a deferred transaction, which reads first and takes the write lock
+  at its first write. when another connection wrote meanwhile SQLite can not wait for
+  it, that would deadlock, so it fails right away. BEGIN IMMEDIATE takes the write lock
+  at the start instead, where busy_timeout waits for it.
+- when busy_timeout runs out, a statement that ran nothing yet is retried a few times
+  with a growing delay: the BEGIN, or a statement in autocommit. a statement inside a
+  transaction is not retried, its atomic block fails as a whole.
+
+the pragmas and the retries are configured with settings.SQLITE.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+DEFAULTS = {
+    'JOURNAL_MODE': 'wal',
+    'SYNCHRONOUS': 'normal',
+    # how long a statement waits for the lock of another connection
+    'BUSY_TIMEOUT_MS': 5000,
+    # the database file is read through the page cache of the OS up to this size
+    'MMAP_SIZE': 256 * 1024 * 1024,
+    # page cache of every connection
+    'CACHE_SIZE_KIB': 64 * 1024,
+    'BEGIN_IMMEDIATE': True,
+    # attempts after the first, each waiting about twice as long as the one before
+    'RETRIES': 3,
+    'RETRY_DELAY_MS': 50,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SQLITE', {})}
+
+
+def retry_locked(run, config):
+    """Return run(), running it again while the database is locked"""
+    for attempt in range(config['RETRIES'] + 1):
+        try:
+            return run()
+        except base.Database.OperationalError as exc:
+            if attempt == config['RETRIES'] or 'locked' not in str(exc):
+                raise
+        # the jitter keeps the waiting writers from all retrying at the same moment
+        time.sleep(config['RETRY_DELAY_MS'] / 1000 * 2 ** attempt * random.uniform(.5, 1.5))
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sqlite_config = get_config()
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        config = self.sqlite_config
+        pragmas = {
+            'busy_timeout': config['BUSY_TIMEOUT_MS'],
+            'synchronous': config['SYNCHRONOUS'],
+            'mmap_size': config['MMAP_SIZE'],
+            # negative sizes are in KiB, positive ones in pages
+            'cache_size': -config['CACHE_SIZE_KIB'] if config['CACHE_SIZE_KIB'] is not None else None,
+        }
+        for name, value in pragmas.items():
+            if value is not None:
+                conn.execute(f'PRAGMA {name} = {value}')
+        # the file keeps its journal mode, changing it takes an exclusive lock, so only
+        # the first connection does. an in-memory database has no journal file.
+        mode = config['JOURNAL_MODE']
+        if mode and not self.is_in_memory_db() and conn.execute('PRAGMA journal_mode').fetchone()[0] != mode.lower():
+            conn.execute(f'PRAGMA journal_mode = {mode}')
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.config = self.sqlite_config
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE' if self.sqlite_config['BEGIN_IMMEDIATE'] else 'BEGIN')
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    """Retries the statements that run outside of a transaction while the database is locked"""
+
+    def execute(self, query, params=None):
+        if self.connection.in_transaction:
+            return super().execute(query, params)
+        return retry_locked(lambda: base.SQLiteCursorWrapper.execute(self, query, params), self.config)
+
+    def executemany(self, query, param_list):
+        if self.connection.in_transaction:
+            return super().executemany(query, param_list)
+        # param_list can be a generator, which the first attempt would use up
+        param_list = list(param_list)
+        return retry_locked(lambda: base.SQLiteCursorWrapper.executemany(self, query, param_list), self.config)
@@ -0,0 +1,41 @@
+from django.core.exceptions import EmptyResultSet
+from django.db import models
+from django.db.models import Lookup
+
+
+class IdArrayField(models.JSONField):
+    """
+    A sorted JSON list of ids, the denormalized copy of a many to many relation.
+    a JSON column rather than an ArrayField, so it works on SQLite as well as on PostgreSQL.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('default', list)
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+
+@IdArrayField.register_lookup
+class Overlaps(Lookup):
+    """field__overlaps=[1, 2]: the list holds at least one of the ids"""
+    lookup_name = 'overlaps'
+    prepare_rhs = False
+
+    def get_ids(self):
+        ids = [int(value) for value in self.rhs]
+        if not ids:
+            raise EmptyResultSet
+        return ids
+
+    def as_sql(self, compiler, connection):
+        # SQLite, json_each turns the list into rows
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        ids = self.get_ids()
+        placeholders = ', '.join(['%s'] * len(ids))
+        sql = f'EXISTS (SELECT 1 FROM json_each({lhs}) WHERE json_each.value IN ({placeholders}))'
+        return sql, [*lhs_params, *ids]
+
+    def as_postgresql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        sql = f'EXISTS (SELECT 1 FROM jsonb_array_elements_text({lhs}) AS item WHERE item::bigint = ANY(%s))'
+        return sql, [*lhs_params, self.get_ids()]
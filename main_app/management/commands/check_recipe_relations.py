@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app import sharding
+from main_app.models import Recipe
+from main_app.signals import read_relation_ids, refresh_relation_ids
+
+
+class Command(BaseCommand):
+    """Django command to compare the id arrays of the recipes with the through tables"""
+    help = 'Check (and with --repair fix) Recipe.tag_ids and Recipe.ingredient_ids against the through tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repair', action='store_true',
+            help='Rewrite the arrays of the recipes that are out of sync'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of recipes compared per round of queries (default: 500)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive number.')
+
+        # with user shards every shard has recipes of its own
+        stats = {'checked': 0, 'broken': 0}
+        for alias in sharding.catalog_databases():
+            self.check_database(alias, batch_size, options['repair'], stats)
+
+        action = 'repaired' if options['repair'] else 'out of sync'
+        style = self.style.SUCCESS if options['repair'] or not stats['broken'] else self.style.ERROR
+        self.stdout.write(style(f"Checked {stats['checked']} recipes, {stats['broken']} {action}."))
+
+    def check_database(self, alias, batch_size, repair, stats):
+        last_pk = 0
+        while True:
+            rows = list(
+                Recipe.objects.using(alias).filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', 'tag_ids', 'ingredient_ids')[:batch_size]
+            )
+            if not rows:
+                return
+            last_pk = rows[-1][0]
+
+            expected = read_relation_ids([pk for pk, _, _ in rows], using=alias)
+            broken = [
+                pk for pk, tag_ids, ingredient_ids in rows
+                if expected[pk] != {'tag_ids': tag_ids, 'ingredient_ids': ingredient_ids}
+            ]
+            for pk in broken:
+                self.stdout.write(f'{alias}: recipe {pk} is out of sync')
+            if repair and broken:
+                refresh_relation_ids(broken, using=alias)
+
+            stats['checked'] += len(rows)
+            stats['broken'] += len(broken)
@@ -0,0 +1,109 @@
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app import sharding
+from main_app.models import Recipe, UploadSession
+
+RECIPE_UPLOAD_DIR = 'uploads/recipe/'
+
+
+class Command(BaseCommand):
+    """Django command to remove recipe images that no recipe points to"""
+    help = 'Delete (or quarantine) orphaned files under the recipe upload directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help='Only touch files older than this many hours (default: 24)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of file names checked against the database per query'
+        )
+        parser.add_argument(
+            '--quarantine', metavar='DIR',
+            help='Move orphans into DIR instead of deleting them'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report the orphans, do not delete or move anything'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive number.')
+
+        upload_dir = os.path.join(settings.MEDIA_ROOT, RECIPE_UPLOAD_DIR)
+        if not os.path.isdir(upload_dir):
+            self.stdout.write('No upload directory, nothing to clean.')
+            return
+
+        quarantine = options['quarantine']
+        if quarantine and not options['dry_run']:
+            os.makedirs(quarantine, exist_ok=True)
+
+        cutoff = time.time() - options['grace_hours'] * 3600
+        stats = {'scanned': 0, 'orphans': 0, 'bytes': 0}
+
+        # only one batch of directory entries is held in memory at a time,
+        # so the command stays flat no matter how many files are on disk.
+        batch = []
+        with os.scandir(upload_dir) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stats['scanned'] += 1
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime > cutoff:
+                    continue  # still inside the grace period, may be an upload in progress
+                batch.append((entry.name, entry.path, stat.st_size))
+                if len(batch) >= batch_size:
+                    self._process_batch(batch, stats, options)
+                    batch = []
+        if batch:
+            self._process_batch(batch, stats, options)
+
+        action = 'would remove' if options['dry_run'] else (
+            'quarantined' if quarantine else 'removed'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {stats['scanned']} files, {action} {stats['orphans']} orphans "
+            f"({stats['bytes']} bytes)."
+        ))
+
+    def _process_batch(self, batch, stats, options):
+        """Check one batch of file names against Recipe.image, with a single query per database"""
+        names = [RECIPE_UPLOAD_DIR + name for name, _, _ in batch]
+        referenced = set()
+        # with user shards the recipes are spread over the shards, a file is
+        # only an orphan when no shard points to it
+        for alias in sharding.catalog_databases():
+            referenced.update(
+                Recipe.objects.using(alias).filter(image__in=names).values_list('image', flat=True)
+            )
+            # the files of resumable uploads only get a recipe once they are finalized,
+            # expire_upload_sessions removes the ones that never will be
+            referenced.update(
+                UploadSession.objects.using(alias).filter(image__in=names).values_list('image', flat=True)
+            )
+
+        for name, path, size in batch:
+            if RECIPE_UPLOAD_DIR + name in referenced:
+                continue
+            stats['orphans'] += 1
+            stats['bytes'] += size
+
+            if options['dry_run']:
+                self.stdout.write(f'orphan: {name}')
+            elif options['quarantine']:
+                shutil.move(path, os.path.join(options['quarantine'], name))
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # somebody else removed it in the meantime
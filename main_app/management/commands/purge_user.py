@@ -0,0 +1,64 @@
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.purge import purge_user, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """Django command to delete a user together with their whole catalog"""
+    help = 'Delete a user, their recipes, tags, ingredients, tokens and images in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', nargs='+', help='Email addresses or ids of the users to purge')
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help=f'Number of rows deleted per transaction (default: {BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--keep-files', action='store_true',
+            help='Leave the image files for clean_orphan_media instead of removing them now'
+        )
+        parser.add_argument(
+            '--measure', action='store_true',
+            help='Also report the peak Python memory used while purging'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number.')
+
+        for identifier in options['users']:
+            user = self._get_user(identifier)
+
+            if options['measure']:
+                tracemalloc.start()
+            stats = purge_user(
+                user,
+                batch_size=options['batch_size'],
+                remove_files=not options['keep_files']
+            )
+
+            rows = sum(stats[key] for key in ('recipes', 'tags', 'ingredients', 'relations'))
+            rate = rows / stats['seconds'] if stats['seconds'] else 0
+            message = (
+                f"Purged {identifier}: {stats['recipes']} recipes, {stats['tags']} tags, "
+                f"{stats['ingredients']} ingredients, {stats['relations']} relations, "
+                f"{stats['files']} files in {stats['seconds']:.2f}s ({rate:.0f} rows/s)"
+            )
+            if options['measure']:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                message += f', peak memory {peak / 1024:.0f} KiB'
+            self.stdout.write(self.style.SUCCESS(message))
+
+    def _get_user(self, identifier):
+        """Find a user by email address or id"""
+        queryset = get_user_model().objects
+        try:
+            if identifier.isdigit():
+                return queryset.get(pk=identifier)
+            return queryset.get(email=identifier)
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User "{identifier}" does not exist.')
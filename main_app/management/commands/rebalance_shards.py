@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count
+
+from main_app import sharding
+from main_app.models import Recipe
+from main_app.signals import recipes_bulk_changed
+
+
+class Command(BaseCommand):
+    """Django command to even out the number of recipes on the user shards"""
+    help = 'Move users between the DATABASE_SHARDS until every shard holds about as many recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-moves', type=int, default=100,
+            help='Move at most this many users in one run (default: 100)'
+        )
+        parser.add_argument(
+            '--user', metavar='EMAIL',
+            help='Only move this user, to the shard given with --to'
+        )
+        parser.add_argument('--to', metavar='ALIAS', help='Target shard of --user')
+        parser.add_argument(
+            '--migrate', action='store_true',
+            help="Move the users from before sharding, whose catalog is still in 'default', to their shard"
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only print the planned moves'
+        )
+
+    def handle(self, *args, **options):
+        shards = settings.DATABASE_SHARDS
+        if not shards:
+            raise CommandError('Sharding is off, DATABASE_SHARDS is empty.')
+
+        if options['user']:
+            if options['to'] not in shards:
+                raise CommandError(f'--to must be one of {", ".join(shards)}.')
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'No user {options["user"]}.')
+            moves = [(user.pk, sharding.db_for_user(user), options['to'])]
+        elif options['migrate']:
+            users = get_user_model().objects.filter(shard='').order_by('pk').values_list('pk', flat=True)
+            moves = [
+                (user_id, DEFAULT_DB_ALIAS, sharding.hash_shard(user_id))
+                for user_id in users[:options['max_moves']]
+            ]
+        else:
+            moves = self.plan(shards, options['max_moves'])
+
+        for user_id, source, target in moves:
+            if options['dry_run']:
+                self.stdout.write(f'user {user_id}: {source} -> {target}')
+                continue
+            user = get_user_model().objects.get(pk=user_id)
+            rows = sharding.move_user(user, target)
+            # the indexes and event streams of the user were reading the old shard
+            recipes_bulk_changed.send(sender=Recipe, user_id=user_id, recipe_ids=None)
+            self.stdout.write(f'user {user_id}: {source} -> {target}, {rows} rows')
+
+        self.stdout.write(self.style.SUCCESS(f'{len(moves)} users moved.'))
+
+    def plan(self, shards, max_moves):
+        """
+        Greedily move users from the fullest to the emptiest shard. a user only
+        moves when that brings the two shards closer together, so the plan never
+        swings back and forth.
+        """
+        load = {alias: 0 for alias in shards}
+        users = {alias: [] for alias in shards}
+        for alias in shards:
+            rows = (
+                Recipe.objects.using(alias).values('user_id')
+                .annotate(recipes=Count('id')).values_list('user_id', 'recipes')
+            )
+            for user_id, recipes in rows:
+                users[alias].append((recipes, user_id))
+                load[alias] += recipes
+
+        moves = []
+        while len(moves) < max_moves:
+            fullest = max(shards, key=load.get)
+            emptiest = min(shards, key=load.get)
+            gap = load[fullest] - load[emptiest]
+            candidates = [item for item in users[fullest] if 0 < item[0] < gap]
+            if not candidates:
+                break
+            # the user closest to half the gap evens the two shards out best
+            recipes, user_id = min(candidates, key=lambda item: abs(gap / 2 - item[0]))
+            users[fullest].remove((recipes, user_id))
+            users[emptiest].append((recipes, user_id))
+            load[fullest] -= recipes
+            load[emptiest] += recipes
+            moves.append((user_id, fullest, emptiest))
+        return moves
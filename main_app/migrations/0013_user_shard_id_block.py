@@ -0,0 +1,25 @@
+# Generated by Django 4.0 on 2026-10-19 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0012_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='shard',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
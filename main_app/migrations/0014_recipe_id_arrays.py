@@ -0,0 +1,55 @@
+# Generated by Django 4.0 on 2026-10-19 11:06
+
+from django.db import migrations
+import main_app.fields
+
+
+BATCH_SIZE = 1000
+
+
+def fill_id_arrays(apps, schema_editor):
+    """Copy the existing through rows into the new id arrays, BATCH_SIZE recipes at a time"""
+    Recipe = apps.get_model('main_app', 'Recipe')
+    db = schema_editor.connection.alias
+    last_pk = 0
+    while True:
+        pks = list(
+            Recipe.objects.using(db).filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE]
+        )
+        if not pks:
+            return
+        last_pk = pks[-1]
+
+        arrays = {}
+        for name, column in (('tags', 'tag_id'), ('ingredients', 'ingredient_id')):
+            through = Recipe._meta.get_field(name).remote_field.through
+            rows = through.objects.using(db).filter(
+                recipe_id__gte=pks[0], recipe_id__lte=last_pk
+            ).order_by('recipe_id', column).values_list('recipe_id', column)
+            for recipe_id, target_id in rows:
+                arrays.setdefault(recipe_id, {'tag_ids': [], 'ingredient_ids': []})[column + 's'].append(target_id)
+
+        recipes = [Recipe(pk=recipe_id, **ids) for recipe_id, ids in arrays.items()]
+        Recipe.objects.using(db).bulk_update(recipes, ['tag_ids', 'ingredient_ids'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0013_user_shard_id_block'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=main_app.fields.IdArrayField(default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tag_ids',
+            field=main_app.fields.IdArrayField(default=list, editable=False),
+        ),
+        # the hint lets the shard router run this on the shards as well
+        migrations.RunPython(fill_id_arrays, migrations.RunPython.noop, hints={'model_name': 'recipe'}),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.0 on 2026-10-19 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0015_profile_capture'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('view', models.CharField(max_length=200)),
+                ('sql', models.TextField()),
+                ('params_shape', models.CharField(blank=True, max_length=200)),
+                ('slow_count', models.PositiveIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('n_plus_one_count', models.PositiveIntegerField(default=0)),
+                ('max_repeats', models.PositiveIntegerField(default=0)),
+                ('explain', models.TextField(blank=True)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='queryfingerprint',
+            constraint=models.UniqueConstraint(fields=('fingerprint', 'view'), name='unique_fingerprint_view'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-19 11:22
+
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0016_query_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(django.db.models.expressions.F('user'), django.db.models.functions.text.Lower('name'), name='ingredient_user_lower_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(django.db.models.expressions.F('user'), django.db.models.functions.text.Lower('name'), name='tag_user_lower_name_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0 on 2026-10-19 11:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0017_name_typeahead_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='view_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'view_count'], name='main_app_re_user_id_c2c985_idx'),
+        ),
+    ]
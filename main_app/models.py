@@ -2,11 +2,14 @@ import uuid
 import os
 
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import (AbstractBaseUser,
                                         BaseUserManager,
                                         PermissionsMixin)
 from django.conf import settings  # this is a recommended way to retrieve different settings from the django settings
 
+from .fields import IdArrayField
+
 
 def recipe_image_file_path(instance, filename):
     """Generate file path for the new recipe image that was uploaded"""
@@ -46,17 +49,37 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # database alias of the shard holding the catalog of the user, see main_app/sharding.py.
+    # it is loaded together with the user, so routing a request costs no extra query
+    shard = models.CharField(max_length=50, blank=True)
 
     objects = UserManager()
 
     # by default username field name is "username" but we are customizing to email
     USERNAME_FIELD = 'email'
 
+    class Meta:
+        # these back the list filters of the user admin
+        indexes = [
+            models.Index(fields=['is_staff']),
+            models.Index(fields=['is_superuser']),
+            models.Index(fields=['is_active']),
+        ]
+
 
 class Tag(models.Model):
     """Tag to be used for the recipe"""
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # serves the delta sync, which reads what changed for one user since a point in time
+            models.Index(fields=['user', 'updated_at']),
+            # the names of a user in typeahead order, see recipe/typeahead.py
+            models.Index('user', Lower('name'), name='tag_user_lower_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -64,8 +87,15 @@ class Tag(models.Model):
 
 class Ingredient(models.Model):
     """Ingredient to be used in recipe"""
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'updated_at']),
+            models.Index('user', Lower('name'), name='ingredient_user_lower_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -74,7 +104,7 @@ class Ingredient(models.Model):
 class Recipe(models.Model):
     """Recipe object"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    title = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, db_index=True)
     time_minutes = models.IntegerField()
     price = models.IntegerField()
     link = models.CharField(max_length=255, blank=True)  # link of the recipe if it's stored online
@@ -83,6 +113,136 @@ class Recipe(models.Model):
 
     # we don't put () at the end of the function because we just want to reference to this function
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # also bumped when the tags or ingredients of the recipe change (see main_app/signals.py)
+    updated_at = models.DateTimeField(auto_now=True)
+    # sorted copies of the ids in the two through tables, so listing and filtering recipes
+    # reads this table only. kept in sync by main_app/signals.py and recipe/bulk.py
+    tag_ids = IdArrayField()
+    ingredient_ids = IdArrayField()
+    # views of the recipe detail, buffered in memory and added in batches (see recipe/view_counts.py)
+    view_count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        # the recipe list is always filtered by user, these serve its sort options
+        indexes = [
+            models.Index(fields=['user', 'price']),
+            models.Index(fields=['user', 'time_minutes']),
+            models.Index(fields=['user', 'title']),
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'updated_at']),
+            models.Index(fields=['user', 'view_count']),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class Tombstone(models.Model):
+    """Record of a deleted recipe, tag or ingredient, so the delta sync can report deletes"""
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+
+    # a plain column rather than a foreign key: the tombstones of a user are
+    # written while the delete of that user is cascading
+    user_id = models.BigIntegerField()
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user_id', 'deleted_at'])]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}'
+
+
+class UploadSession(models.Model):
+    """A resumable upload of a recipe image, written chunk by chunk straight into its file"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE)
+    # the final name of the image under MEDIA_ROOT, finalizing only points the recipe at it
+    image = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # sessions that were not written to for RECIPE_UPLOAD_SESSION_HOURS are expired
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['updated_at'])]
+
+    def __str__(self):
+        return f'{self.image} ({self.received}/{self.size})'
+
+
+class IdBlock(models.Model):
+    """
+    A block of ids handed to one process by the id allocator of the user shards.
+    recipes, tags and ingredients take their ids from these blocks while sharding
+    is on, so their ids stay unique across the shards and survive a move.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ProfileCapture(models.Model):
+    """
+    One profiled request (see core/profiling.py). the profile, the queries and the
+    allocation sites are in files named after the id in PROFILING['DIRECTORY'].
+    """
+    FILE_EXTENSIONS = ('prof', 'json')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField()
+    query_ms = models.FloatField()
+    memory_peak = models.BigIntegerField(help_text='bytes')
+    # who asked for the capture, empty for sampled requests
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    sampled = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.duration_ms:.0f} ms)'
+
+    def file_path(self, extension, directory):
+        return os.path.join(directory, f'capture-{self.pk}.{extension}')
+
+    def delete_files(self, directory):
+        for extension in self.FILE_EXTENSIONS:
+            try:
+                os.remove(self.file_path(extension, directory))
+            except FileNotFoundError:
+                pass
+
+
+class QueryFingerprint(models.Model):
+    """
+    The slow query reports of one normalized SQL statement in one view, summed up
+    (see core/querylog.py). n_plus_one_count counts the requests that ran it
+    N_PLUS_ONE_THRESHOLD times or more.
+    """
+    fingerprint = models.CharField(max_length=40)
+    view = models.CharField(max_length=200)
+    sql = models.TextField()
+    params_shape = models.CharField(max_length=200, blank=True)
+    slow_count = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    n_plus_one_count = models.PositiveIntegerField(default=0)
+    max_repeats = models.PositiveIntegerField(default=0)
+    # the plan of the latest slow run
+    explain = models.TextField(blank=True)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'view'], name='unique_fingerprint_view'),
+        ]
+
+    def __str__(self):
+        return f'{self.view}: {self.sql[:80]}'
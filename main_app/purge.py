@@ -0,0 +1,100 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from .models import Tag, Ingredient, Recipe, UploadSession
+from .sharding import db_for_user, use_shard_of
+from .signals import recipes_bulk_changed
+
+BATCH_SIZE = 1000
+
+
+def _through_tables():
+    """Return (through model, recipe column, target column) of every recipe relation"""
+    tables = []
+    for name in ('tags', 'ingredients'):
+        field = Recipe._meta.get_field(name)
+        tables.append((
+            field.remote_field.through,
+            field.m2m_field_name() + '_id',
+            field.m2m_reverse_field_name() + '_id',
+        ))
+    return tables
+
+
+def _batches(queryset, batch_size):
+    """Yield lists of primary keys in key order, one query per batch"""
+    last_pk = None
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        pks = list(page.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+def purge_user(user, batch_size=BATCH_SIZE, remove_files=True):
+    """
+    Delete a user with their recipes, tags, ingredients and tokens.
+    the rows are deleted in key-ordered batches, each in its own short transaction,
+    instead of letting the delete collector load the whole account into memory.
+    returns the number of deleted rows per table and the elapsed time.
+    """
+    started = time.perf_counter()
+    with use_shard_of(user.pk):
+        stats = _purge_catalog(user, batch_size, remove_files, db_for_user(user))
+
+    user_id = user.pk
+    with transaction.atomic():
+        Token.objects.filter(user=user).delete()
+        # only a handful of rows (groups, permissions, admin log) are left for the collector
+        user.delete()
+    recipes_bulk_changed.send(sender=Recipe, user_id=user_id, recipe_ids=None)
+
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def _purge_catalog(user, batch_size, remove_files, using):
+    """Delete the recipes, tags and ingredients of the user from the database they are in"""
+    stats = {'recipes': 0, 'tags': 0, 'ingredients': 0, 'relations': 0, 'files': 0}
+    tables = _through_tables()
+
+    recipes = Recipe.objects.filter(user=user)
+    for pks in _batches(recipes, batch_size):
+        with transaction.atomic(using=using):
+            images = list(
+                Recipe.objects.filter(pk__in=pks).exclude(image='').exclude(image=None)
+                .values_list('image', flat=True)
+            )
+            for through, recipe_column, _ in tables:
+                stats['relations'] += through.objects.filter(**{recipe_column + '__in': pks}).delete()[0]
+            # the unfinished uploads point at the recipes too, their files are partial images
+            sessions = UploadSession.objects.filter(recipe_id__in=pks)
+            images += sessions.values_list('image', flat=True)
+            sessions.delete()
+            # the through rows are gone, so there is nothing left to cascade into.
+            # _raw_delete runs a plain DELETE without collecting the objects first, nor
+            # post_delete: the receivers get recipes_bulk_changed (see signals.py)
+            stats['recipes'] += Recipe.objects.filter(pk__in=pks)._raw_delete(recipes.db)
+
+        # only remove the files once the rows pointing at them are committed
+        if remove_files:
+            for name in images:
+                default_storage.delete(name)
+            stats['files'] += len(images)
+
+    for key, model, (through, _, target_column) in (('tags', Tag, tables[0]),
+                                                   ('ingredients', Ingredient, tables[1])):
+        queryset = model.objects.filter(user=user)
+        for pks in _batches(queryset, batch_size):
+            with transaction.atomic(using=using):
+                # recipes of other users may still point at these rows
+                stats['relations'] += through.objects.filter(**{target_column + '__in': pks}).delete()[0]
+                stats[key] += model.objects.filter(pk__in=pks)._raw_delete(queryset.db)
+    return stats
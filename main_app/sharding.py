@@ -0,0 +1,264 @@
+"""
+User-sharded storage.
+
+every query of the recipe API is scoped to one user, so the catalog of a user
+(recipes, tags, ingredients, their through rows, tombstones and upload sessions)
+can live in its own database, one of the aliases in settings.DATABASE_SHARDS.
+users, tokens and the rest of the project stay in 'default', so authentication
+is still a single lookup, and that lookup also loads User.shard.
+
+- the views activate the shard of the authenticated user for the request
+  (current_shard), and UserShardRouter sends the catalog queries there.
+- the user row is mirrored to the shard, so the foreign keys hold there.
+- recipes, tags and ingredients get their ids from IdBlock on 'default',
+  which keeps the ids of the API unique across the shards.
+- move_user copies a catalog to another shard, see the rebalance_shards command.
+- users created before DATABASE_SHARDS was set have no shard yet: their catalog stays in
+  'default' and is served from there until `rebalance_shards --migrate` moves it to a shard.
+
+with DATABASE_SHARDS empty the router stays out of the way and everything is in 'default'.
+"""
+import threading
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+# model names of main_app that live on the shards
+SHARDED_MODELS = {
+    'recipe', 'tag', 'ingredient', 'recipe_tags', 'recipe_ingredients', 'tombstone', 'uploadsession'
+}
+# their ids are part of the API, so they are allocated across all shards
+GLOBAL_ID_MODELS = {'recipe', 'tag', 'ingredient'}
+ID_BLOCK_SIZE = 1000
+BATCH_SIZE = 1000
+
+current_shard = ContextVar('current_shard', default=None)
+
+
+def enabled():
+    return bool(settings.DATABASE_SHARDS)
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'main_app' and model._meta.model_name in SHARDED_MODELS
+
+
+def hash_shard(user_id):
+    """The shard a new user starts on, stable as long as the list of shards does not change"""
+    shards = settings.DATABASE_SHARDS
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+
+def catalog_databases():
+    """The aliases that can hold catalogs: 'default', for the users not migrated yet, and the shards"""
+    return [DEFAULT_DB_ALIAS, *(alias for alias in settings.DATABASE_SHARDS if alias != DEFAULT_DB_ALIAS)]
+
+
+def db_for_user(user):
+    """Return the database alias holding the catalog of the user"""
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    # a user without a shard is one from before sharding, their catalog is still in 'default'
+    return user.shard or DEFAULT_DB_ALIAS
+
+
+def shard_of(user_id):
+    """Like db_for_user, for code that only has the id of the user at hand"""
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    shard = get_user_model().objects.filter(pk=user_id).values_list('shard', flat=True).first()
+    return shard or DEFAULT_DB_ALIAS
+
+
+def activate(user):
+    """Route the catalog queries of this context to the shard of the user, returns a token for deactivate"""
+    if not enabled() or not user.is_authenticated:
+        return None
+    return current_shard.set(db_for_user(user))
+
+
+def deactivate(token):
+    if token is not None:
+        current_shard.reset(token)
+
+
+@contextmanager
+def use_shard_of(user_id):
+    """Run a block outside of a request (commands, background work) against the shard of a user"""
+    token = current_shard.set(shard_of(user_id)) if enabled() else None
+    try:
+        yield
+    finally:
+        deactivate(token)
+
+
+class UserShardRouter:
+    """Send the catalog tables to the shard of their user"""
+
+    def db_for_read(self, model, **hints):
+        if not enabled() or not is_sharded(model):
+            return None
+
+        instance = hints.get('instance')
+        if isinstance(instance, get_user_model()):
+            return db_for_user(instance)  # user.recipe_set, recipe.user = user, ...
+        if instance is not None and instance._state.db is not None:
+            return instance._state.db
+        shard = current_shard.get()
+        if shard is not None:
+            return shard
+        if instance is not None and getattr(instance, 'user_id', None) is not None:
+            return shard_of(instance.user_id)
+        # without a user there is no shard to pick, e.g. the admin changelists
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not enabled():
+            return None
+        user_model = get_user_model()
+        # users are mirrored to every shard
+        if isinstance(obj1, user_model) or isinstance(obj2, user_model):
+            return True
+        if is_sharded(type(obj1)) and is_sharded(type(obj2)):
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS:
+            return None
+        # every other alias of this project is a shard, whether or not it is in use yet
+        return app_label == 'main_app' and (model_name in SHARDED_MODELS or model_name == 'user')
+
+
+# ------------------------------------------------ user mirror
+
+def mirror_user(user, alias=None):
+    """Write the row of the user to their shard, without the password"""
+    alias = alias or db_for_user(user)
+    fields = {
+        field.attname: getattr(user, field.attname)
+        for field in type(user)._meta.concrete_fields if not field.primary_key
+    }
+    fields['password'] = '!'  # an unusable password, the hash stays in 'default'
+    type(user).objects.using(alias).update_or_create(pk=user.pk, defaults=fields)
+
+
+def delete_mirror(user_id, alias):
+    """Delete the mirrored user together with whatever is left of their catalog on a shard"""
+    with transaction.atomic(using=alias):
+        _delete_catalog(alias, user_id)
+
+
+# ------------------------------------------------ global ids
+
+class IdAllocator:
+    """Hand out ids from blocks of ID_BLOCK_SIZE, taking one IdBlock row per block"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    def allocate(self, count=1):
+        from .models import IdBlock
+
+        ids = []
+        with self._lock:
+            while len(ids) < count:
+                if self._next == self._end:
+                    block = IdBlock.objects.using(DEFAULT_DB_ALIAS).create()
+                    self._next, self._end = block.pk * ID_BLOCK_SIZE, (block.pk + 1) * ID_BLOCK_SIZE
+                take = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+        return ids
+
+
+allocator = IdAllocator()
+
+
+def assign_ids(objs):
+    """Give unsaved recipes, tags or ingredients their ids before a bulk_create"""
+    if not enabled():
+        return
+    objs = [obj for obj in objs if obj.pk is None]
+    for obj, pk in zip(objs, allocator.allocate(len(objs))):
+        obj.pk = pk
+
+
+# ------------------------------------------------ moving users
+
+def _catalog(alias, user_id):
+    """Return the querysets of the catalog of a user on one shard, parents before children"""
+    from .models import Tag, Ingredient, Recipe, Tombstone, UploadSession
+
+    return [
+        Tag.objects.using(alias).filter(user_id=user_id),
+        Ingredient.objects.using(alias).filter(user_id=user_id),
+        Recipe.objects.using(alias).filter(user_id=user_id),
+        Recipe.tags.through.objects.using(alias).filter(recipe__user_id=user_id),
+        Recipe.ingredients.through.objects.using(alias).filter(recipe__user_id=user_id),
+        Tombstone.objects.using(alias).filter(user_id=user_id),
+        UploadSession.objects.using(alias).filter(user_id=user_id),
+    ]
+
+
+def move_user(user, target):
+    """
+    Copy the catalog of the user to the target shard, switch the user over
+    and delete the catalog from the old shard. returns the number of copied rows.
+    writes of the user that arrive during the copy can be lost, so move users
+    that are not active at the moment. the copied rows get new updated_at times,
+    so the clients of the user pick the whole catalog up again on their next sync.
+    """
+    source = db_for_user(user)
+    if source == target:
+        return 0
+    # the ids of a catalog from before sharding were not taken from IdBlock, they may
+    # collide with the ones on the target: the copy then fails and the user stays where they are
+
+    copied = 0
+    mirror_user(user, target)
+    with transaction.atomic(using=target):
+        for queryset in _catalog(source, user.pk):
+            model = queryset.model
+            keep_pk = model._meta.model_name in GLOBAL_ID_MODELS or model._meta.model_name == 'uploadsession'
+            fields = [
+                field.attname for field in model._meta.concrete_fields
+                if keep_pk or not field.primary_key
+            ]
+            batch = []
+            for row in queryset.order_by('pk').values(*fields).iterator(chunk_size=BATCH_SIZE):
+                batch.append(model(**row))
+                if len(batch) >= BATCH_SIZE:
+                    copied += len(model.objects.using(target).bulk_create(batch))
+                    batch = []
+            copied += len(model.objects.using(target).bulk_create(batch))
+
+    type(user).objects.filter(pk=user.pk).update(shard=target)
+    user.shard = target
+
+    with transaction.atomic(using=source):
+        # nothing was deleted as far as the API is concerned, so no signals and no tombstones
+        _delete_catalog(source, user.pk)
+    return copied
+
+
+def _delete_catalog(alias, user_id):
+    """
+    Delete the catalog and the mirrored row of a user from a shard, children first.
+    in 'default' the row is the user itself and stays. without post_delete,
+    see recipes_bulk_changed in signals.py
+    """
+    for queryset in reversed(_catalog(alias, user_id)):
+        pks = list(queryset.values_list('pk', flat=True))
+        for start in range(0, len(pks), BATCH_SIZE):
+            queryset.model.objects.using(alias).filter(pk__in=pks[start:start + BATCH_SIZE])._raw_delete(alias)
+    if alias != DEFAULT_DB_ALIAS:
+        # the delete collector would also look for tokens and admin log entries, which only exist in 'default'
+        get_user_model().objects.using(alias).filter(pk=user_id)._raw_delete(alias)
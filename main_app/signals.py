@@ -0,0 +1,166 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from . import sharding
+from .models import Tag, Ingredient, Recipe, Tombstone
+
+# sent after a bulk write changed recipes without going through the model signals
+# (bulk_update, bulk_create of through rows, raw deletes).
+# arguments: user_id, and recipe_ids, which is None when every recipe of the user may have changed.
+#
+# the bulk delete (recipe/bulk.py), the purge (purge.py) and the shard moves (sharding.py)
+# delete with QuerySet._raw_delete: a plain DELETE, because the delete collector would load
+# every row to send post_delete for it. so no post_delete receiver of Recipe, Tag or Ingredient
+# runs for those rows, and every receiver keeping something derived from them (indexes, caches,
+# event streams) must listen to recipes_bulk_changed as well. the tombstones are the exception:
+# the bulk delete writes its own, and a purged or moved catalog has nobody to sync it.
+recipes_bulk_changed = Signal()
+
+
+# recipe relation -> (through table column, id array on the recipe)
+RELATION_COLUMNS = {'tags': ('tag_id', 'tag_ids'), 'ingredients': ('ingredient_id', 'ingredient_ids')}
+BATCH_SIZE = 500
+
+
+def read_relation_ids(recipe_ids, names=tuple(RELATION_COLUMNS), using=None):
+    """Return {recipe id: {'tag_ids': [...], ...}} as it is in the through tables, one query per batch"""
+    recipe_ids = list(recipe_ids)
+    arrays = {recipe_id: {RELATION_COLUMNS[name][1]: [] for name in names} for recipe_id in recipe_ids}
+    for name in names:
+        column, attr = RELATION_COLUMNS[name]
+        through = Recipe._meta.get_field(name).remote_field.through
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            rows = (
+                through.objects.using(using)
+                .filter(recipe_id__in=recipe_ids[start:start + BATCH_SIZE])
+                .order_by(column).values_list('recipe_id', column)
+            )
+            for recipe_id, target_id in rows:
+                arrays[recipe_id][attr].append(target_id)
+    return arrays
+
+
+def refresh_relation_ids(recipe_ids, names=tuple(RELATION_COLUMNS), using=None):
+    """
+    Rewrite the id arrays of the recipes from the through tables and bump their updated_at.
+    every write to a through table ends up here, returns the new arrays.
+    """
+    arrays = read_relation_ids(recipe_ids, names, using)
+    if not arrays:
+        return arrays
+
+    # one UPDATE run with executemany: bulk_update would build a CASE expression
+    # per recipe and column in Python, which costs more than the write itself
+    connection = connections[using or router.db_for_write(Recipe)]
+    fields = [Recipe._meta.get_field(RELATION_COLUMNS[name][1]) for name in names]
+    updated_at = Recipe._meta.get_field('updated_at')
+    quote = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        quote(Recipe._meta.db_table),
+        ', '.join(f'{quote(field.column)} = %s' for field in fields + [updated_at]),
+        quote(Recipe._meta.pk.column),
+    )
+    now = updated_at.get_db_prep_save(timezone.now(), connection)
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [*(field.get_db_prep_save(ids[field.attname], connection) for field in fields), now, recipe_id]
+            for recipe_id, ids in arrays.items()
+        ])
+    return arrays
+
+
+def sender_target(through):
+    """Return the name of the tag or ingredient foreign key of a recipe through table"""
+    return 'tag' if through is Recipe.tags.through else 'ingredient'
+
+
+def sender_relation(through):
+    return 'tags' if through is Recipe.tags.through else 'ingredients'
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """A change of the tags or ingredients of a recipe is a change of the recipe and its id array"""
+    names = (sender_relation(sender),)
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            arrays = refresh_relation_ids([instance.pk], names, using)
+            # the serializer answers with this very instance, so it has to see the new ids too
+            for attr, ids in arrays[instance.pk].items():
+                setattr(instance, attr, ids)
+    elif action == 'pre_clear':
+        # pk_set is not given for a clear, remember which recipes are about to lose the relation
+        instance._cleared_recipe_ids = list(
+            sender.objects.using(using).filter(**{sender_target(sender) + '_id': instance.pk})
+            .values_list('recipe_id', flat=True)
+        )
+    elif action == 'post_clear':
+        refresh_relation_ids(getattr(instance, '_cleared_recipe_ids', []), names, using)
+    elif action in ('post_add', 'post_remove'):
+        refresh_relation_ids(pk_set, names, using)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def recipe_attr_deleting(sender, instance, using, **kwargs):
+    # the through rows go away in the cascade, without m2m_changed,
+    # so remember the recipes whose id arrays lose this tag or ingredient
+    relation = 'tags' if sender is Tag else 'ingredients'
+    instance._affected_recipe_ids = list(
+        Recipe.objects.using(using).filter(**{relation: instance}).values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_attr_deleted(sender, instance, using, **kwargs):
+    relation = 'tags' if sender is Tag else 'ingredients'
+    refresh_relation_ids(getattr(instance, '_affected_recipe_ids', []), (relation,), using)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def catalog_object_deleted(sender, instance, using, **kwargs):
+    Tombstone.objects.using(using).create(
+        user_id=instance.user_id,
+        model=sender._meta.model_name,
+        object_id=instance.pk
+    )
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted(sender, instance, using, **kwargs):
+    # the cascade wrote tombstones for everything the user owned, nobody syncs them anymore
+    Tombstone.objects.using(using).filter(user_id=instance.pk).delete()
+    if sharding.enabled() and using == DEFAULT_DB_ALIAS and instance.shard:
+        # the catalog is on the shard of the user, under the mirrored user row
+        sharding.delete_mirror(instance.pk, instance.shard)
+
+
+# ------------------------------------------------ user shards
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created, using, raw, **kwargs):
+    # only the saves in 'default' are the real ones, the rest are the mirrors themselves
+    if sharding.enabled() and using == DEFAULT_DB_ALIAS and not raw:
+        if created and not instance.shard:
+            # pin the user, so adding shards later does not move them without their catalog
+            instance.shard = sharding.hash_shard(instance.pk)
+            sender.objects.filter(pk=instance.pk).update(shard=instance.shard)
+        # the users from before sharding keep their catalog in 'default' until it is migrated
+        if instance.shard:
+            sharding.mirror_user(instance)
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=Tag)
+@receiver(pre_save, sender=Ingredient)
+def catalog_object_saving(sender, instance, raw, **kwargs):
+    # the ids have to be unique across the shards, so a shard does not pick them
+    if sharding.enabled() and instance.pk is None and not raw:
+        sharding.assign_ids([instance])
@@ -1,6 +1,11 @@
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
+from django.core.paginator import EmptyPage
 from django.urls import reverse
+from unittest.mock import patch
+
+from main_app.admin import EstimatedCountPaginator, RecipeAdmin
+from main_app.models import Tag, Ingredient, Recipe
 
 
 class AdminSiteTests(TestCase):
@@ -51,3 +56,70 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+    def test_user_search(self):
+        """Test that searching users by email works"""
+        url = reverse('admin:main_app_user_changelist')
+        res = self.client.get(url, {'q': 'test@'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, self.user.email)
+
+    def test_recipe_pages(self):
+        """Test that the recipe changelist and change page work"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(user=self.user, title='Salad', time_minutes=5, price=3)
+        recipe.tags.add(tag)
+
+        res = self.client.get(reverse('admin:main_app_recipe_changelist'))
+        self.assertContains(res, recipe.title)
+
+        res = self.client.get(reverse('admin:main_app_recipe_change', args=[recipe.id]))
+        self.assertEqual(res.status_code, 200)
+        # the tags widget is an autocomplete, so it only renders the selected options
+        self.assertContains(res, 'admin-autocomplete')
+
+    def test_tag_and_ingredient_changelists(self):
+        """Test that the tag and ingredient changelists work"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        Ingredient.objects.create(user=self.user, name='Salt')
+
+        res = self.client.get(reverse('admin:main_app_tag_changelist'), {'q': 'Veg'})
+        self.assertContains(res, 'Vegan')
+
+        res = self.client.get(reverse('admin:main_app_ingredient_changelist'))
+        self.assertContains(res, 'Salt')
+
+    def test_pages_past_count_limit(self):
+        """Test that the pages past the capped count are still served"""
+        Recipe.objects.bulk_create([
+            Recipe(user=self.user, title=f'Recipe {i}', time_minutes=5, price=3) for i in range(9)
+        ])
+
+        with patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 4):
+            paginator = EstimatedCountPaginator(Recipe.objects.order_by('id'), 2)
+            self.assertEqual(paginator.num_pages, 2)
+            self.assertEqual(len(paginator.page(4)), 2)
+            self.assertEqual(paginator.num_pages, 5)
+            self.assertEqual(paginator.page(5).object_list[0].title, 'Recipe 8')
+            with self.assertRaises(EmptyPage):
+                paginator.page(6)
+
+        url = reverse('admin:main_app_recipe_changelist')
+        with patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 4), patch.object(RecipeAdmin, 'list_per_page', 2):
+            res = self.client.get(url, {'p': 5})
+            self.assertEqual(len(res.context['cl'].result_list), 1)
+
+            res = self.client.get(url, {'p': 6})
+            self.assertEqual(res.status_code, 302)
+
+    def test_purge_users_action(self):
+        """Test that the purge action removes the user and their catalog"""
+        Recipe.objects.create(user=self.user, title='Salad', time_minutes=5, price=3)
+
+        url = reverse('admin:main_app_user_changelist')
+        res = self.client.post(url, {'action': 'purge_users', '_selected_action': [self.user.id]})
+
+        self.assertEqual(res.status_code, 302)
+        self.assertFalse(get_user_model().objects.filter(id=self.user.id).exists())
+        self.assertFalse(Recipe.objects.exists())
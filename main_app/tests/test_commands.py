@@ -0,0 +1,235 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from main_app import sharding
+from main_app.models import Recipe, Tag, Ingredient, UploadSession
+
+
+class CleanOrphanMediaTests(TestCase):
+    """Test the clean_orphan_media command"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.upload_dir = os.path.join(self.media_root, 'uploads', 'recipe')
+        os.makedirs(self.upload_dir)
+
+        # every test runs against its own throw-away MEDIA_ROOT
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.user = get_user_model().objects.create_user('test@gmail.com', 'testpass123')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def make_file(self, name, age_hours=48):
+        """Create a file in the upload directory that is age_hours old"""
+        path = os.path.join(self.upload_dir, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10)
+        mtime = time.time() - age_hours * 3600
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_orphans_removed_and_referenced_kept(self):
+        """Test that only files no recipe points to are deleted"""
+        kept = self.make_file('kept.jpg')
+        orphan = self.make_file('orphan.jpg')
+        Recipe.objects.create(
+            user=self.user, title='Steak', time_minutes=5, price=10,
+            image='uploads/recipe/kept.jpg'
+        )
+
+        call_command('clean_orphan_media', batch_size=1, stdout=StringIO())
+
+        self.assertTrue(os.path.exists(kept))
+        self.assertFalse(os.path.exists(orphan))
+
+    def test_upload_in_progress_kept(self):
+        """Test that the file of an unfinished resumable upload is not an orphan"""
+        partial = self.make_file('partial.jpg')
+        recipe = Recipe.objects.create(user=self.user, title='Steak', time_minutes=5, price=10)
+        UploadSession.objects.create(
+            user=self.user, recipe=recipe, image='uploads/recipe/partial.jpg', size=100
+        )
+
+        call_command('clean_orphan_media', stdout=StringIO())
+
+        self.assertTrue(os.path.exists(partial))
+
+    def test_grace_period_respected(self):
+        """Test that recently written files are left alone"""
+        fresh = self.make_file('fresh.jpg', age_hours=1)
+
+        call_command('clean_orphan_media', grace_hours=24, stdout=StringIO())
+
+        self.assertTrue(os.path.exists(fresh))
+
+    def test_dry_run_keeps_files(self):
+        """Test that a dry run only reports the orphans"""
+        orphan = self.make_file('orphan.jpg')
+        out = StringIO()
+
+        call_command('clean_orphan_media', dry_run=True, stdout=out)
+
+        self.assertTrue(os.path.exists(orphan))
+        self.assertIn('orphan.jpg', out.getvalue())
+
+    def test_quarantine_moves_orphans(self):
+        """Test that orphans are moved into the quarantine directory"""
+        orphan = self.make_file('orphan.jpg')
+        quarantine = os.path.join(self.media_root, 'quarantine')
+
+        call_command('clean_orphan_media', quarantine=quarantine, stdout=StringIO())
+
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(os.path.join(quarantine, 'orphan.jpg')))
+
+
+@override_settings(DATABASE_SHARDS=['shard_1', 'shard_2'])
+class CleanOrphanMediaShardedTests(TestCase):
+    """Test the clean_orphan_media command with the recipes on user shards"""
+    databases = {'default', 'shard_1', 'shard_2'}
+
+    setUp = CleanOrphanMediaTests.setUp
+    tearDown = CleanOrphanMediaTests.tearDown
+    make_file = CleanOrphanMediaTests.make_file
+
+    def test_image_on_shard_kept(self):
+        """Test that an image referenced from a shard only is not an orphan"""
+        kept = self.make_file('kept.jpg')
+        partial = self.make_file('partial.jpg')
+        orphan = self.make_file('orphan.jpg')
+        sharding.move_user(self.user, 'shard_1')
+        with sharding.use_shard_of(self.user.pk):
+            recipe = Recipe.objects.create(
+                user=self.user, title='Steak', time_minutes=5, price=10, image='uploads/recipe/kept.jpg'
+            )
+            UploadSession.objects.create(
+                user=self.user, recipe=recipe, image='uploads/recipe/partial.jpg', size=100
+            )
+        self.assertEqual(recipe._state.db, 'shard_1')
+
+        call_command('clean_orphan_media', stdout=StringIO())
+
+        self.assertTrue(os.path.exists(kept))
+        self.assertTrue(os.path.exists(partial))
+        self.assertFalse(os.path.exists(orphan))
+
+
+class PurgeUserTests(TestCase):
+    """Test the purge_user command"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.user = get_user_model().objects.create_user('purge@gmail.com', 'testpass123')
+        self.other = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def make_catalog(self, user, size):
+        """Create size recipes for the user, each with a tag and an ingredient"""
+        for i in range(size):
+            recipe = Recipe.objects.create(user=user, title=f'recipe {i}', time_minutes=1, price=1)
+            recipe.tags.add(Tag.objects.create(user=user, name=f'tag {i}'))
+            recipe.ingredients.add(Ingredient.objects.create(user=user, name=f'ingredient {i}'))
+
+    def test_purge_user_and_catalog(self):
+        """Test that the user and everything they own is removed in batches"""
+        self.make_catalog(self.user, 5)
+        self.make_catalog(self.other, 2)
+        Token.objects.create(user=self.user)
+
+        out = StringIO()
+        call_command('purge_user', 'purge@gmail.com', batch_size=2, stdout=out)
+
+        self.assertFalse(get_user_model().objects.filter(email='purge@gmail.com').exists())
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertEqual(Tag.objects.count(), 2)
+        self.assertEqual(Ingredient.objects.count(), 2)
+        self.assertEqual(Recipe.tags.through.objects.count(), 2)
+        self.assertFalse(Token.objects.exists())
+        self.assertIn('5 recipes', out.getvalue())
+
+    def test_purge_removes_images(self):
+        """Test that the image files of the purged recipes are removed"""
+        path = os.path.join(self.media_root, 'uploads', 'recipe', 'image.jpg')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        Recipe.objects.create(
+            user=self.user, title='Steak', time_minutes=1, price=1,
+            image='uploads/recipe/image.jpg'
+        )
+
+        call_command('purge_user', str(self.user.id), stdout=StringIO())
+
+        self.assertFalse(os.path.exists(path))
+
+    def test_purge_upload_in_progress(self):
+        """Test that the unfinished uploads of the purged recipes go with them, partial files too"""
+        path = os.path.join(self.media_root, 'uploads', 'recipe', 'partial.jpg')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        recipe = Recipe.objects.create(user=self.user, title='Steak', time_minutes=1, price=1)
+        UploadSession.objects.create(user=self.user, recipe=recipe, image='uploads/recipe/partial.jpg', size=100)
+
+        call_command('purge_user', str(self.user.id), stdout=StringIO())
+
+        self.assertFalse(get_user_model().objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_purge_unknown_user(self):
+        """Test that an unknown user is reported"""
+        with self.assertRaises(CommandError):
+            call_command('purge_user', 'nobody@gmail.com', stdout=StringIO())
+
+
+class CheckRecipeRelationsTests(TestCase):
+    """Test the check_recipe_relations command"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@gmail.com', 'testpass123')
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe = Recipe.objects.create(user=self.user, title='Steak', time_minutes=5, price=10)
+        self.recipe.tags.add(self.tag)
+
+    def test_arrays_in_sync(self):
+        """Test that the id arrays follow the relation changes"""
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.tag_ids, [self.tag.id])
+
+        out = StringIO()
+        call_command('check_recipe_relations', stdout=out)
+        self.assertIn('0 out of sync', out.getvalue())
+
+    def test_repair(self):
+        """Test that an array that drifted is found and rewritten"""
+        Recipe.objects.filter(pk=self.recipe.pk).update(tag_ids=[], ingredient_ids=[12345])
+
+        out = StringIO()
+        call_command('check_recipe_relations', stdout=out)
+        self.assertIn('1 out of sync', out.getvalue())
+
+        call_command('check_recipe_relations', repair=True, stdout=StringIO())
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.tag_ids, [self.tag.id])
+        self.assertEqual(self.recipe.ingredient_ids, [])
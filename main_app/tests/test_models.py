@@ -1,5 +1,9 @@
+import importlib
+from types import SimpleNamespace
 from unittest.mock import patch
 
+from django.apps import apps
+from django.db import connection
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 
@@ -95,3 +99,26 @@ class ModelTests(TestCase):
         exp_path = f'uploads/recipe/{uuid}.jpg'
 
         self.assertEqual(exp_path, file_path)
+
+    # -----------------------id arrays of the recipes
+    def test_id_array_migration_batches(self):
+        """Test that the migration fills the id arrays of every recipe, one batch at a time"""
+        migration = importlib.import_module('main_app.migrations.0014_recipe_id_arrays')
+        user = sample_user()
+        tags = [Tag.objects.create(user=user, name=f'Tag {i}') for i in range(3)]
+        recipes = [
+            Recipe.objects.create(user=user, title=f'Recipe {i}', time_minutes=5, price=5) for i in range(5)
+        ]
+        for i, recipe in enumerate(recipes[:4]):
+            recipe.tags.add(*tags[:i])
+        Recipe.objects.update(tag_ids=[], ingredient_ids=[])
+
+        # 3 batches of the recipe ids and their two through tables, the empty 4th batch,
+        # and an update for the two batches that have tags
+        with patch.object(migration, 'BATCH_SIZE', 2), self.assertNumQueries(3 * 3 + 1 + 2):
+            migration.fill_id_arrays(apps, SimpleNamespace(connection=connection))
+
+        self.assertEqual(
+            list(Recipe.objects.order_by('pk').values_list('tag_ids', flat=True)),
+            [[], [tags[0].pk], [tags[0].pk, tags[1].pk], [tag.pk for tag in tags], []]
+        )
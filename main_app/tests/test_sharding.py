@@ -0,0 +1,153 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main_app import sharding
+from main_app.models import Recipe, Tag, Tombstone, UploadSession
+from main_app.purge import purge_user
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+@override_settings(DATABASE_SHARDS=['shard_1', 'shard_2'])
+class UserShardTests(TestCase):
+    """Test that the catalog of a user lives on the shard of the user"""
+    databases = {'default', 'shard_1', 'shard_2'}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.shard = self.user.shard
+        self.other_shard = 'shard_2' if self.shard == 'shard_1' else 'shard_1'
+
+    def create_recipe(self, user, title='Salad'):
+        self.client.force_authenticate(user)
+        tag = self.client.post(TAGS_URL, {'name': 'Vegan'}).data
+        res = self.client.post(RECIPES_URL, {
+            'title': title, 'time_minutes': 5, 'price': 3, 'tags': [tag['id']]
+        })
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def test_user_pinned_and_mirrored(self):
+        """Test that a new user gets a shard and a copy of their row there, without the password"""
+        self.assertIn(self.shard, ('shard_1', 'shard_2'))
+        mirror = get_user_model().objects.using(self.shard).get(pk=self.user.pk)
+        self.assertEqual(mirror.email, self.user.email)
+        self.assertFalse(mirror.has_usable_password())
+
+    def test_catalog_written_to_shard(self):
+        """Test that the API writes and reads the catalog on the shard of the user"""
+        recipe_id = self.create_recipe(self.user)
+
+        self.assertTrue(Recipe.objects.using(self.shard).filter(pk=recipe_id).exists())
+        self.assertFalse(Recipe.objects.using('default').exists())
+        self.assertEqual(Recipe.objects.using(self.shard).get().tags.count(), 1)
+
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual([recipe['id'] for recipe in res.data], [recipe_id])
+
+    def test_ids_unique_across_shards(self):
+        """Test that users on different shards never get the same recipe id"""
+        other = get_user_model().objects.create_user('other@gmail.com', 'testpassword1234')
+        sharding.move_user(other, self.other_shard)
+
+        first = self.create_recipe(self.user)
+        second = self.create_recipe(other)
+
+        self.assertNotEqual(first, second)
+        self.assertTrue(Recipe.objects.using(self.other_shard).filter(pk=second).exists())
+
+    def test_rebalance_moves_catalog(self):
+        """Test that moving a user keeps the ids and leaves nothing on the old shard"""
+        recipe_id = self.create_recipe(self.user)
+
+        call_command('rebalance_shards', user=self.user.email, to=self.other_shard, stdout=StringIO())
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.shard, self.other_shard)
+        self.assertFalse(Recipe.objects.using(self.shard).exists())
+        self.assertFalse(Tag.objects.using(self.shard).exists())
+        self.assertFalse(get_user_model().objects.using(self.shard).filter(pk=self.user.pk).exists())
+        self.client.force_authenticate(self.user)
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual([recipe['id'] for recipe in res.data], [recipe_id])
+        self.assertEqual(len(res.data[0]['tags']), 1)
+
+    def test_rebalance_plan(self):
+        """Test that the planner moves the user that evens out the shards"""
+        for i in range(3):
+            self.create_recipe(self.user, title=f'recipe {i}')
+        other = get_user_model().objects.create_user('other@gmail.com', 'testpassword1234')
+        sharding.move_user(other, self.shard)
+        self.create_recipe(other)
+        third = get_user_model().objects.create_user('third@gmail.com', 'testpassword1234')
+        sharding.move_user(third, self.other_shard)
+        for i in range(2):
+            self.create_recipe(third, title=f'recipe {i}')
+
+        out = StringIO()
+        call_command('rebalance_shards', stdout=out)
+
+        other.refresh_from_db()
+        self.assertEqual(other.shard, self.other_shard)
+        self.assertIn('1 users moved', out.getvalue())
+
+    def test_purge_user_on_shard(self):
+        """Test that purging a user removes their catalog and mirror from the shard"""
+        recipe_id = self.create_recipe(self.user)
+        self.client.delete(reverse('recipe:recipe-detail', args=[recipe_id]))
+        self.assertTrue(Tombstone.objects.using(self.shard).exists())
+
+        purge_user(self.user)
+
+        self.assertFalse(Tag.objects.using(self.shard).exists())
+        self.assertFalse(Tombstone.objects.using(self.shard).exists())
+        self.assertFalse(get_user_model().objects.using(self.shard).exists())
+
+    def test_expire_upload_sessions_on_shard(self):
+        """Test that stale upload sessions are expired on the shards, not only in default"""
+        recipe_id = self.create_recipe(self.user)
+        with sharding.use_shard_of(self.user.pk):
+            UploadSession.objects.create(
+                user=self.user, recipe_id=recipe_id, image='uploads/recipe/partial.jpg', size=100
+            )
+        UploadSession.objects.using(self.shard).update(updated_at=timezone.now() - timedelta(days=2))
+
+        call_command('expire_upload_sessions', stdout=StringIO())
+
+        self.assertFalse(UploadSession.objects.using(self.shard).exists())
+
+    def test_user_from_before_sharding(self):
+        """Test that a user without a shard is served from 'default' until the migration moves them"""
+        with override_settings(DATABASE_SHARDS=[]):
+            legacy = get_user_model().objects.create_user('legacy@gmail.com', 'testpassword1234')
+            Recipe.objects.create(user=legacy, title='Soup', time_minutes=5, price=3)
+        self.assertEqual(legacy.shard, '')
+
+        self.create_recipe(legacy)
+        tag_id = Tag.objects.using('default').get().pk
+        self.assertEqual(Recipe.objects.using('default').count(), 2)
+
+        out = StringIO()
+        call_command('rebalance_shards', migrate=True, stdout=out)
+
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.shard, sharding.hash_shard(legacy.pk))
+        self.assertFalse(Recipe.objects.using('default').exists())
+        self.assertTrue(get_user_model().objects.using(legacy.shard).filter(pk=legacy.pk).exists())
+        self.assertTrue(get_user_model().objects.using('default').filter(pk=legacy.pk).exists())
+        self.assertIn('1 users moved', out.getvalue())
+        self.client.force_authenticate(legacy)
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(sorted(recipe['title'] for recipe in res.data), ['Salad', 'Soup'])
+        self.assertEqual(self.client.get(TAGS_URL).data[0]['id'], tag_id)
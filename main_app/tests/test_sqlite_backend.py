@@ -0,0 +1,90 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from unittest.mock import Mock
+
+from django.db import connections, transaction
+from django.db.utils import load_backend
+from django.test import SimpleTestCase
+
+from main_app.backends.sqlite3.base import DEFAULTS, retry_locked
+
+NO_DELAY = {**DEFAULTS, 'RETRY_DELAY_MS': 0}
+ALIAS = 'sqlite_backend_test'
+
+
+class SQLiteBackendTests(SimpleTestCase):
+    """Test the SQLite backend for concurrent writers"""
+
+    def setUp(self):
+        # a file of its own, the test database of default lives in memory and has no journal
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'db.sqlite3')
+        backend = load_backend('main_app.backends.sqlite3')
+        connections[ALIAS] = backend.DatabaseWrapper({**connections['default'].settings_dict, 'NAME': self.path}, ALIAS)
+        # switches the new file to WAL
+        connections[ALIAS].ensure_connection()
+
+    def tearDown(self):
+        connections[ALIAS].close()
+        del connections[ALIAS]
+        shutil.rmtree(self.directory)
+
+    def connect(self, **params):
+        return sqlite3.connect(self.path, isolation_level=None, **params)
+
+    def pragma(self, name):
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        """Test that every connection gets the configured pragmas"""
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -DEFAULTS['CACHE_SIZE_KIB'])
+
+    def test_transactions_take_the_write_lock(self):
+        """Test that atomic blocks begin with the write lock, before their first write"""
+        other = self.connect(timeout=0)
+        try:
+            with transaction.atomic(using=ALIAS):
+                with self.assertRaisesRegex(sqlite3.OperationalError, 'locked'):
+                    other.execute('BEGIN IMMEDIATE')
+            other.execute('BEGIN IMMEDIATE')
+            other.execute('ROLLBACK')
+        finally:
+            other.close()
+
+    def test_waits_for_other_writer(self):
+        """Test that a transaction waits for the writer before it instead of failing"""
+        other = self.connect(check_same_thread=False)
+        other.execute('BEGIN IMMEDIATE')
+        release = threading.Timer(0.2, other.execute, ['COMMIT'])
+        release.start()
+        try:
+            with transaction.atomic(using=ALIAS):
+                connections[ALIAS].cursor().execute('CREATE TABLE waited (id integer)')
+        finally:
+            release.join()
+            other.close()
+
+    def test_retry_locked(self):
+        """Test that only locked errors are retried, up to the configured number of times"""
+        locked = sqlite3.OperationalError('database is locked')
+        run = Mock(side_effect=[locked, locked, 'done'])
+        self.assertEqual(retry_locked(run, NO_DELAY), 'done')
+        self.assertEqual(run.call_count, 3)
+
+        run = Mock(side_effect=sqlite3.OperationalError('no such table: x'))
+        with self.assertRaises(sqlite3.OperationalError):
+            retry_locked(run, NO_DELAY)
+        self.assertEqual(run.call_count, 1)
+
+        run = Mock(side_effect=locked)
+        with self.assertRaises(sqlite3.OperationalError):
+            retry_locked(run, NO_DELAY)
+        self.assertEqual(run.call_count, NO_DELAY['RETRIES'] + 1)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class RecipeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipe'
+
+    def ready(self):
+        # connect the signal receivers that keep the in-memory indexes current
+        from . import signals  # noqa: F401
+        from django.core.signals import request_finished
+        from . import view_counts
+        # write the buffered recipe views once a response went out
+        request_finished.connect(view_counts.flush_if_due, dispatch_uid='recipe_view_counts')
@@ -0,0 +1,202 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from main_app.models import Tag, Ingredient, Recipe, Tombstone, UploadSession
+from main_app.sharding import db_for_user
+from main_app.signals import RELATION_COLUMNS, read_relation_ids, recipes_bulk_changed, refresh_relation_ids
+from .serializers import find_ids
+from .uploads import remove_partial_files
+
+BATCH_SIZE = 500
+SCALAR_FIELDS = ('title', 'time_minutes', 'price', 'link')
+RELATED_MODELS = {'tags': Tag, 'ingredients': Ingredient}
+
+
+def chunks(items, size=BATCH_SIZE):
+    """Split a list into lists of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def filter_recipes(user, recipe_filter):
+    """Return the ids of the user's recipes matching a bulk filter"""
+    queryset = Recipe.objects.filter(user=user)
+    if 'ids' in recipe_filter:
+        queryset = queryset.filter(pk__in=recipe_filter['ids'])
+    # the id arrays answer these without joining the through tables, so no distinct either
+    if 'tags' in recipe_filter:
+        queryset = queryset.filter(tag_ids__overlaps=recipe_filter['tags'])
+    if 'ingredients' in recipe_filter:
+        queryset = queryset.filter(ingredient_ids__overlaps=recipe_filter['ingredients'])
+
+    return list(queryset.order_by('pk').values_list('pk', flat=True))
+
+
+def check_recipes(user, recipe_ids):
+    """Make sure all the ids belong to recipes of the user"""
+    found = set()
+    for chunk in chunks(list(recipe_ids)):
+        found.update(
+            Recipe.objects.filter(user=user, pk__in=chunk).values_list('pk', flat=True)
+        )
+    missing = sorted(set(recipe_ids) - found)
+    if missing:
+        raise ValidationError({'ids': f'Unknown recipes: {missing}'})
+
+
+def check_related(user, name, ids):
+    """Make sure all tag or ingredient ids belong to the user, like the relation fields of RecipeSerializer"""
+    found = find_ids(RELATED_MODELS[name].objects.filter(user=user), list(ids))
+    missing = sorted(set(ids) - set(found))
+    if missing:
+        raise ValidationError({name: f'Unknown {name}: {missing}'})
+
+
+def apply_relation_changes(name, changes):
+    """
+    Apply add/remove diffs to the through table of a recipe relation.
+    changes is a list of (recipe_id, {'add': [...], 'remove': [...]}).
+    rows are inserted with batched INSERTs and removed with batched DELETEs,
+    the recipes and the related objects themselves are never loaded.
+    """
+    field = Recipe._meta.get_field(name)
+    through = field.remote_field.through
+    recipe_column = field.m2m_field_name() + '_id'
+    target_column = field.m2m_reverse_field_name() + '_id'
+
+    rows = []
+    removed = {}  # target id -> recipe ids, so one condition covers many recipes
+    for recipe_id, diff in changes:
+        for target_id in diff['add']:
+            rows.append(through(**{recipe_column: recipe_id, target_column: target_id}))
+        for target_id in diff['remove']:
+            removed.setdefault(target_id, []).append(recipe_id)
+
+    # the through table is unique on (recipe, target), so existing pairs are simply skipped
+    through.objects.bulk_create(rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    conditions = [
+        Q(**{target_column: target_id, f'{recipe_column}__in': recipe_ids})
+        for target_id, recipe_ids in removed.items()
+    ]
+    for chunk in chunks(conditions, 50):
+        condition = Q()
+        for q in chunk:
+            condition |= q
+        through.objects.filter(condition).delete()
+
+
+def notify_on_commit(user, recipe_ids):
+    """Tell the listeners which recipes changed, once the transaction is committed"""
+    transaction.on_commit(
+        lambda: recipes_bulk_changed.send(sender=Recipe, user_id=user.pk, recipe_ids=recipe_ids),
+        using=db_for_user(user)
+    )
+
+
+def bulk_update_recipes(user, items):
+    """
+    Update many recipes of the user in one transaction.
+    items is a list of (recipe_id, changes) as validated by RecipeChangesSerializer.
+    """
+    # the catalog of the user may be on a shard, the transaction has to be there too
+    with transaction.atomic(using=db_for_user(user)):
+        check_recipes(user, [recipe_id for recipe_id, _ in items])
+        for name in RELATED_MODELS:
+            ids = set()
+            for _, changes in items:
+                diff = changes.get(name, {})
+                ids.update(diff.get('add', []), diff.get('remove', []))
+            check_related(user, name, ids)
+
+        # the new id arrays follow from the current through rows and the diffs applied
+        # below, so they go out in the same bulk_update as the fields. recipes changing
+        # the same set of columns share one bulk_update, which also bumps their updated_at
+        names = [name for name in RELATED_MODELS if any(name in changes for _, changes in items)]
+        current = read_relation_ids(
+            [recipe_id for recipe_id, changes in items if any(name in changes for name in names)], names
+        )
+        now = timezone.now()
+        groups = {}
+        for recipe_id, changes in items:
+            values = {field: changes[field] for field in SCALAR_FIELDS if field in changes}
+            for name in names:
+                if name in changes:
+                    attr = RELATION_COLUMNS[name][1]
+                    ids = set(current[recipe_id][attr]) | set(changes[name]['add'])
+                    values[attr] = sorted(ids - set(changes[name]['remove']))
+            groups.setdefault(tuple(sorted(values)), []).append((recipe_id, values))
+        for fields, group in groups.items():
+            recipes = [Recipe(pk=recipe_id, updated_at=now, **values) for recipe_id, values in group]
+            Recipe.objects.bulk_update(recipes, fields + ('updated_at',), batch_size=BATCH_SIZE)
+
+        for name in names:
+            apply_relation_changes(
+                name,
+                [(recipe_id, changes[name]) for recipe_id, changes in items if name in changes]
+            )
+        notify_on_commit(user, [recipe_id for recipe_id, _ in items])
+
+    return len({recipe_id for recipe_id, _ in items})
+
+
+def bulk_patch_recipes(user, recipe_filter, patch):
+    """Apply the same patch to all the recipes of the user matching the filter"""
+    with transaction.atomic(using=db_for_user(user)):
+        recipe_ids = filter_recipes(user, recipe_filter)
+        for name in RELATED_MODELS:
+            if name in patch:
+                check_related(user, name, patch[name]['add'] + patch[name]['remove'])
+
+        scalars = {field: patch[field] for field in SCALAR_FIELDS if field in patch}
+        scalars['updated_at'] = timezone.now()
+        for chunk in chunks(recipe_ids):
+            Recipe.objects.filter(pk__in=chunk).update(**scalars)
+
+        names = [name for name in RELATED_MODELS if name in patch]
+        for name in names:
+            apply_relation_changes(name, [(recipe_id, patch[name]) for recipe_id in recipe_ids])
+        if names:
+            refresh_relation_ids(recipe_ids, names)
+        notify_on_commit(user, recipe_ids)
+
+    return len(recipe_ids)
+
+
+def bulk_delete_recipes(user, recipe_ids=None, recipe_filter=None):
+    """Delete many recipes of the user in one transaction"""
+    using = db_for_user(user)
+    with transaction.atomic(using=using):
+        if recipe_filter is not None:
+            recipe_ids = filter_recipes(user, recipe_filter)
+        else:
+            recipe_ids = sorted(set(recipe_ids))
+            check_recipes(user, recipe_ids)
+
+        for chunk in chunks(recipe_ids):
+            # clear the through tables with one DELETE each, so the recipes
+            # below have nothing left to cascade into
+            for name in RELATED_MODELS:
+                field = Recipe._meta.get_field(name)
+                field.remote_field.through.objects.filter(
+                    **{field.m2m_field_name() + '_id__in': chunk}
+                ).delete()
+            # one INSERT for the tombstones instead of one per post_delete signal,
+            # and _raw_delete skips the collector that would send those signals,
+            # the other receivers get recipes_bulk_changed (see main_app/signals.py)
+            Tombstone.objects.bulk_create(
+                Tombstone(user_id=user.pk, model=Tombstone.RECIPE, object_id=recipe_id)
+                for recipe_id in chunk
+            )
+            # the unfinished uploads of the recipes would block their DELETE
+            sessions = UploadSession.objects.filter(recipe_id__in=chunk)
+            partial = list(sessions.values_list('image', flat=True))
+            sessions.delete()
+            if partial:
+                transaction.on_commit(lambda partial=partial: remove_partial_files(partial), using=using)
+            Recipe.objects.filter(pk__in=chunk)._raw_delete(Recipe.objects.db)
+        notify_on_commit(user, recipe_ids)
+
+    return len(recipe_ids)
@@ -0,0 +1,128 @@
+"""
+"What can I cook": find the recipes whose ingredients are covered by the ingredients on hand.
+
+every user gets a bit matrix with one row per recipe and one bit per ingredient used
+by the user's recipes, packed into uint64 words. a query masks out the ingredients on
+hand and counts the remaining bits of every row with one vectorized popcount.
+"""
+import numpy as np
+
+from main_app.models import Recipe
+from main_app.sharding import use_shard_of
+from .index_cache import cookable_indexes
+
+# rows per popcount step, bounds the temporary arrays of a query
+CHUNK_ROWS = 16384
+
+# number of set bits of every byte value
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def popcount_rows(words):
+    """Return the number of set bits of every row of a 2d uint64 array"""
+    if hasattr(np, 'bitwise_count'):  # numpy 2.0+
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    return POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+
+class CookableIndex:
+    """Ingredient bitsets of the recipes of one user"""
+
+    def __init__(self, recipe_ids, ingredient_ids, bits):
+        self.recipe_ids = recipe_ids  # sorted, row i of bits belongs to recipe_ids[i]
+        self.ingredient_ids = ingredient_ids  # sorted, bit j belongs to ingredient_ids[j]
+        self.bits = bits
+
+    @classmethod
+    def from_pairs(cls, recipe_ids, pair_recipes, pair_ingredients):
+        """Build the index from all recipe ids and the (recipe, ingredient) pairs"""
+        recipe_ids = np.unique(np.asarray(recipe_ids, dtype=np.int64))
+        ingredient_ids = np.unique(np.asarray(pair_ingredients, dtype=np.int64))
+
+        rows = np.searchsorted(recipe_ids, pair_recipes)
+        cols = np.searchsorted(ingredient_ids, pair_ingredients)
+        n_words = max((len(ingredient_ids) + 63) // 64, 1)
+        bits = np.zeros((len(recipe_ids), n_words), dtype=np.uint64)
+        np.bitwise_or.at(
+            bits,
+            (rows, cols // 64),
+            np.left_shift(np.uint64(1), (cols % 64).astype(np.uint64))
+        )
+        return cls(recipe_ids, ingredient_ids, bits)
+
+    @classmethod
+    def build(cls, user_id):
+        """Load the index of the user with two queries"""
+        recipe_ids = np.fromiter(
+            Recipe.objects.filter(user_id=user_id).values_list('pk', flat=True), dtype=np.int64
+        )
+        pairs = np.fromiter(
+            (value for pair in Recipe.ingredients.through.objects.filter(
+                recipe__user_id=user_id
+            ).values_list('recipe_id', 'ingredient_id') for value in pair),
+            dtype=np.int64
+        )
+        return cls.from_pairs(recipe_ids, pairs[0::2], pairs[1::2])
+
+    @property
+    def nbytes(self):
+        return self.recipe_ids.nbytes + self.ingredient_ids.nbytes + self.bits.nbytes
+
+    def mask(self, ingredient_ids):
+        """Return the bitset of the given ingredients, ingredients no recipe uses are ignored"""
+        ids = np.asarray(list(ingredient_ids), dtype=np.int64)
+        positions = np.searchsorted(self.ingredient_ids, ids)
+        found = positions < len(self.ingredient_ids)
+        found[found] = self.ingredient_ids[positions[found]] == ids[found]
+        positions = positions[found]
+
+        mask = np.zeros(self.bits.shape[1], dtype=np.uint64)
+        np.bitwise_or.at(
+            mask, positions // 64, np.left_shift(np.uint64(1), (positions % 64).astype(np.uint64))
+        )
+        return mask
+
+    def missing_counts(self, on_hand):
+        """Return the number of missing ingredients of every recipe"""
+        missing_mask = ~self.mask(on_hand)
+        counts = np.empty(len(self.recipe_ids), dtype=np.int64)
+        for start in range(0, len(self.recipe_ids), CHUNK_ROWS):
+            chunk = self.bits[start:start + CHUNK_ROWS]
+            counts[start:start + CHUNK_ROWS] = popcount_rows(chunk & missing_mask)
+        return counts
+
+    def missing_ingredients(self, recipe_id, on_hand):
+        """Return the ids of the ingredients of a recipe that are not on hand"""
+        row = np.searchsorted(self.recipe_ids, recipe_id)
+        words = self.bits[row] & ~self.mask(on_hand)
+        bits = np.unpackbits(words.view(np.uint8), bitorder='little')[:len(self.ingredient_ids)]
+        return [int(ingredient_id) for ingredient_id in self.ingredient_ids[bits.astype(bool)]]
+
+    def query(self, on_hand, max_missing=2, limit=50):
+        """
+        Return up to limit (recipe id, missing count) pairs: the fully covered
+        recipes first, then the ones missing at most max_missing ingredients.
+        """
+        counts = self.missing_counts(on_hand)
+        rows = np.flatnonzero(counts <= max_missing)
+        rows = rows[np.lexsort((self.recipe_ids[rows], counts[rows]))][:limit]
+        return [(int(self.recipe_ids[row]), int(counts[row])) for row in rows]
+
+
+def build_index(user_id):
+    """Build the index of the user, called by cookable_indexes on a cache miss"""
+    with use_shard_of(user_id):
+        return CookableIndex.build(user_id)
+
+
+indexes = cookable_indexes
+
+
+def cookable_recipes(user_id, on_hand, max_missing=2, limit=50):
+    """Return (recipe id, missing ingredient ids) of the user's recipes, fully covered ones first"""
+    index = indexes.get(user_id)
+    on_hand = set(on_hand)
+    return [
+        (recipe_id, index.missing_ingredients(recipe_id, on_hand) if missing else [])
+        for recipe_id, missing in index.query(on_hand, max_missing, limit)
+    ]
@@ -0,0 +1,237 @@
+"""
+Server-sent events stream of the changes to a user's recipes, tags and ingredients.
+
+the stream is a plain ASGI app, mounted in front of Django by core/asgi.py, because
+it has to hold many idle connections in one event loop. the model signals publish
+into an in-process broker, which fans out to the connections of the user. with the
+redis backend the events go through a redis channel, so every worker sees them.
+"""
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+from rest_framework.authtoken.models import Token
+
+DEFAULTS = {
+    'BACKEND': 'local',  # or 'redis'
+    'REDIS_URL': 'redis://localhost:6379/0',
+    'CHANNEL': 'catalog-events',
+    'QUEUE_SIZE': 100,  # events buffered per connection before it is told to resync
+    'HEARTBEAT_SECONDS': 15,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_EVENTS', {})}
+
+
+class Subscriber:
+    """One open event stream, with a bounded queue of events"""
+
+    def __init__(self, user_id, queue_size):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def put(self, event):
+        """Queue an event, runs in the loop of the subscriber"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a slow client does not get to hold an unbounded backlog: drop what is
+            # buffered and tell it to catch up through the delta sync instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'resync'})
+            self.overflowed = True
+
+
+class Broker:
+    """In-process pub/sub of catalog events, keyed by user"""
+
+    def __init__(self):
+        self.subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, queue_size):
+        subscriber = Subscriber(user_id, queue_size)
+        with self._lock:
+            self.subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self.subscribers.get(subscriber.user_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self.subscribers.pop(subscriber.user_id, None)
+
+    def has_subscribers(self, user_id):
+        return user_id in self.subscribers
+
+    def dispatch(self, user_id, event):
+        """Hand an event to the local subscribers of the user, safe to call from any thread"""
+        with self._lock:
+            subscribers = list(self.subscribers.get(user_id, ()))
+        for subscriber in subscribers:
+            subscriber.loop.call_soon_threadsafe(subscriber.put, event)
+
+
+broker = Broker()
+
+
+class RedisBackend:
+    """Relay the events of all workers through one redis channel"""
+
+    def __init__(self, config):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise ImproperlyConfigured('The redis catalog events backend needs the "redis" package.')
+        self.channel = config['CHANNEL']
+        self.client = redis.Redis.from_url(config['REDIS_URL'])
+        self.async_client = redis.asyncio.Redis.from_url(config['REDIS_URL'])
+        self.listener = None
+
+    def publish(self, user_id, event):
+        self.client.publish(self.channel, json.dumps({'user_id': user_id, 'event': event}))
+
+    def ensure_listening(self):
+        """Start relaying the channel into the local broker, once per event loop"""
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.get_running_loop().create_task(self.listen())
+
+    async def listen(self):
+        pubsub = self.async_client.pubsub()
+        await pubsub.subscribe(self.channel)
+        async for message in pubsub.listen():
+            if message['type'] == 'message':
+                payload = json.loads(message['data'])
+                broker.dispatch(payload['user_id'], payload['event'])
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None and get_config()['BACKEND'] == 'redis':
+        _backend = RedisBackend(get_config())
+    return _backend
+
+
+def publish(user_id, event):
+    """Publish a catalog event to the streams of the user"""
+    backend = get_backend()
+    if backend is not None:
+        backend.publish(user_id, event)
+    elif broker.has_subscribers(user_id):
+        broker.dispatch(user_id, event)
+
+
+def format_event(event, event_id):
+    return f'id: {event_id}\nevent: {event["type"]}\ndata: {json.dumps(event)}\n\n'.encode()
+
+
+def authenticate(token_key):
+    """Return the active user of an API token, or None"""
+    close_old_connections()
+    try:
+        token = Token.objects.select_related('user').get(key=token_key)
+    except Token.DoesNotExist:
+        return None
+    finally:
+        close_old_connections()
+    return token.user if token.user.is_active else None
+
+
+def get_token_key(scope):
+    """Read the token from the Authorization header, or from ?token= for EventSource clients"""
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            keyword, _, key = value.decode('latin1').partition(' ')
+            if keyword.lower() == 'token':
+                return key.strip()
+    query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+    return query.get('token', [None])[0]
+
+
+async def send_error(send, status, message):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps({'detail': message}).encode()})
+
+
+async def catalog_events_app(scope, receive, send):
+    """ASGI app streaming the catalog events of the authenticated user"""
+    if scope['method'] != 'GET':
+        return await send_error(send, 405, 'Method not allowed.')
+
+    token_key = get_token_key(scope)
+    user = await sync_to_async(authenticate)(token_key) if token_key else None
+    if user is None:
+        return await send_error(send, 401, 'Authentication credentials were not provided or are invalid.')
+
+    config = get_config()
+    backend = get_backend()
+    if backend is not None:
+        backend.ensure_listening()
+
+    subscriber = broker.subscribe(user.id, config['QUEUE_SIZE'])
+    stream = asyncio.current_task()
+    disconnected = False
+
+    async def watch_disconnect():
+        nonlocal disconnected
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        # the stream is waiting on its queue, cancelling it is the cheapest way to wake it
+        disconnected = True
+        stream.cancel()
+
+    watcher = asyncio.get_running_loop().create_task(watch_disconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),  # keep nginx from buffering the stream
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+
+        event_id = 0
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), config['HEARTBEAT_SECONDS'])
+            except asyncio.TimeoutError:
+                # the heartbeat keeps proxies from closing an idle connection
+                await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                continue
+
+            event_id += 1
+            await send({'type': 'http.response.body', 'body': format_event(event, event_id), 'more_body': True})
+            if event['type'] == 'resync':
+                break  # the client reconnects after syncing, with a fresh queue
+
+        await send({'type': 'http.response.body', 'body': b''})
+    except asyncio.CancelledError:
+        if not disconnected:
+            raise
+    finally:
+        watcher.cancel()
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,29 @@
+"""
+Entry point of the worker processes of the import_recipes command.
+
+the workers are spawned, so they unpickle this function before Django is set up.
+it lives apart from recipe/importer.py because importing the models there would fail.
+"""
+
+
+def worker_main(worker, tasks, results, name_cache_size):
+    """
+    Import the batches from tasks until None comes, and put
+    ('batch', worker, offset, records, recipes, unknown emails) for each of them.
+    """
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    from .importer import Importer
+
+    importer = Importer(name_cache_size)
+    try:
+        for batch in iter(tasks.get, None):
+            offset, records = batch
+            imported, unknown = importer.import_batch(records)
+            results.put(('batch', worker, offset, len(records), imported, unknown))
+        importer.finish()
+        results.put(('done', worker))
+    except Exception as exc:
+        results.put(('error', worker, f'{type(exc).__name__}: {exc}'))
@@ -0,0 +1,302 @@
+"""
+Streaming import of recipe catalogs, run by the import_recipes command.
+
+    {"user": "cook@example.com", "title": "Soup", "time_minutes": 20, "price": 5,
+     "link": "", "tags": ["Vegan"], "ingredients": ["Salt", "Water"]}
+
+one record per line (NDJSON), or CSV with these columns and the names of the tags
+and ingredients separated by '|'. the users must exist, the tags and ingredients
+are looked up by name and created when the user does not have them yet.
+
+the file is read as a stream and the records are handed to the workers in batches.
+every user belongs to one worker (partition), so the tags and ingredients of a user
+are only ever created by one process. a worker imports a batch with a few bulk
+INSERTs per user and reports back the offset in the file it got to, which the
+Checkpoint keeps per worker, so an interrupted import resumes where every worker
+stopped. memory is bounded by the batch size, the queue depth and the name caches,
+whatever the size of the file.
+"""
+import csv
+import json
+import os
+import zlib
+from collections import OrderedDict
+from contextlib import ExitStack
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from main_app import sharding
+from main_app.models import Tag, Ingredient, Recipe
+from main_app.signals import recipes_bulk_changed
+
+FORMATS = ('ndjson', 'csv')
+LIST_SEPARATOR = '|'
+REQUIRED_FIELDS = ('user', 'title', 'time_minutes', 'price')
+MAX_LENGTH = 255
+# names looked up with one query
+LOOKUP_BATCH_SIZE = 500
+
+
+class RecordError(ValueError):
+    """A record that can not be imported, the import skips it"""
+
+
+# ------------------------------------------------ reading
+
+def detect_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def read_records(path, fmt, start=0):
+    """
+    Yield (offset, record) for the records of the file from the byte offset start on,
+    offset being where the record ends. records that do not parse come as RecordError.
+    """
+    with open(path, 'rb') as file:
+        if fmt == 'ndjson':
+            file.seek(start)
+            offset = start
+            for line in file:
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as exc:
+                    record = RecordError(f'not JSON: {exc}')
+                if not isinstance(record, (dict, RecordError)):
+                    record = RecordError('not a JSON object')
+                yield offset, record
+            return
+
+        header = next(csv.reader([file.readline().decode('utf-8-sig')]), [])
+        offset = max(start, file.tell())
+        file.seek(offset)
+
+        def lines():
+            nonlocal offset
+            for line in file:
+                offset += len(line)
+                yield line.decode('utf-8')
+
+        # the reader pulls lines as it needs them, so after a row offset is where it ends
+        for row in csv.DictReader(lines(), fieldnames=header):
+            yield offset, row
+
+
+def split_names(value):
+    if value in (None, ''):
+        return ()
+    if isinstance(value, str):
+        value = value.split(LIST_SEPARATOR)
+    if not isinstance(value, list):
+        raise RecordError('tags and ingredients must be lists of names')
+    names = tuple(dict.fromkeys(str(name).strip() for name in value if str(name).strip()))
+    if any(len(name) > MAX_LENGTH for name in names):
+        raise RecordError(f'names are limited to {MAX_LENGTH} characters')
+    return names
+
+
+def clean_record(record):
+    """Return (email, fields, tag names, ingredient names) of a parsed record"""
+    if isinstance(record, RecordError):
+        raise record
+    missing = [field for field in REQUIRED_FIELDS if record.get(field) in (None, '')]
+    if missing:
+        raise RecordError(f'missing {", ".join(missing)}')
+    try:
+        time_minutes, price = int(record['time_minutes']), int(record['price'])
+    except (TypeError, ValueError):
+        raise RecordError('time_minutes and price must be whole numbers')
+    title, link = str(record['title']).strip(), str(record.get('link') or '').strip()
+    if len(title) > MAX_LENGTH or len(link) > MAX_LENGTH:
+        raise RecordError(f'title and link are limited to {MAX_LENGTH} characters')
+
+    fields = {'title': title, 'time_minutes': time_minutes, 'price': price, 'link': link}
+    return str(record['user']).strip(), fields, split_names(record.get('tags')), \
+        split_names(record.get('ingredients'))
+
+
+def partition(email, workers):
+    """The worker importing the records of a user"""
+    return zlib.crc32(email.encode()) % workers
+
+
+# ------------------------------------------------ checkpoint
+
+class Checkpoint:
+    """
+    Progress of an import: worker w has imported every record of its users that
+    ends at or before positions[w]. saved after every batch, with a rename so a
+    crash never leaves half a file behind.
+    """
+
+    def __init__(self, path, source, fmt, workers, restart=False):
+        self.path = path
+        self.state = {
+            'source': os.path.abspath(source), 'format': fmt, 'workers': workers,
+            'positions': [0] * workers, 'complete': False,
+        }
+        if os.path.exists(path) and not restart:
+            with open(path) as file:
+                saved = json.load(file)
+            for key in ('source', 'format', 'workers'):
+                if saved[key] != self.state[key]:
+                    raise ValueError(
+                        f'The checkpoint was written with {key}={saved[key]}, '
+                        f'resume with the same options or start over with --restart.'
+                    )
+            self.state = saved
+
+    @property
+    def positions(self):
+        return self.state['positions']
+
+    @property
+    def complete(self):
+        return self.state['complete']
+
+    @property
+    def start(self):
+        """The offset every worker got to, reading starts there"""
+        return min(self.positions)
+
+    def advance(self, worker, offset):
+        self.positions[worker] = max(self.positions[worker], offset)
+        self.save()
+
+    def finish(self, offset):
+        self.state.update(positions=[offset] * len(self.positions), complete=True)
+        self.save()
+
+    def save(self):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.state, file)
+        os.replace(temporary, self.path)
+
+
+# ------------------------------------------------ importing
+
+class NameCache:
+    """
+    Bounded map of (user id, name) -> id of the tags or the ingredients.
+    the least recently used names are dropped, a name that is not in the
+    cache is looked up in batches and created when the user does not have it.
+    """
+
+    def __init__(self, model, capacity):
+        self.model = model
+        self.capacity = capacity
+        self._ids = OrderedDict()
+
+    def resolve(self, user, names):
+        """Return {name: id} of the names of the user, creating the missing ones"""
+        ids, missing = {}, []
+        for name in names:
+            pk = self._ids.get((user.pk, name))
+            if pk is None:
+                missing.append(name)
+            else:
+                self._ids.move_to_end((user.pk, name))
+                ids[name] = pk
+
+        for start in range(0, len(missing), LOOKUP_BATCH_SIZE):
+            rows = self.model.objects.filter(
+                user=user, name__in=missing[start:start + LOOKUP_BATCH_SIZE]
+            ).order_by('-pk').values_list('name', 'pk')
+            ids.update(rows)  # newest first, so with duplicate names the oldest row wins
+        new = [self.model(user=user, name=name) for name in missing if name not in ids]
+        sharding.assign_ids(new)
+        ids.update((obj.name, obj.pk) for obj in self.model.objects.bulk_create(new))
+
+        for name in missing:
+            self._ids[(user.pk, name)] = ids[name]
+        while len(self._ids) > self.capacity:
+            self._ids.popitem(last=False)
+        return ids
+
+
+class Importer:
+    """The importing side of a worker: turns batches of clean records into rows"""
+
+    def __init__(self, name_cache_size):
+        self.tags = NameCache(Tag, name_cache_size)
+        self.ingredients = NameCache(Ingredient, name_cache_size)
+        self.users = OrderedDict()  # email -> user, bounded like the names
+        self.name_cache_size = name_cache_size
+        self.touched = set()  # ids of the users who got recipes
+
+    def get_users(self, emails):
+        missing = [email for email in emails if email not in self.users]
+        for start in range(0, len(missing), LOOKUP_BATCH_SIZE):
+            for user in get_user_model().objects.filter(email__in=missing[start:start + LOOKUP_BATCH_SIZE]):
+                self.users[user.email] = user
+        users = {email: self.users[email] for email in emails if email in self.users}
+        while len(self.users) > self.name_cache_size:
+            self.users.popitem(last=False)
+        return users
+
+    def import_batch(self, records):
+        """
+        Import a list of (email, fields, tag names, ingredient names).
+        returns the number of recipes and the emails that are not users.
+        """
+        by_user = {}
+        for record in records:
+            by_user.setdefault(record[0], []).append(record)
+        users = self.get_users(list(by_user))
+
+        imported = 0
+        # the whole batch commits at once (once per shard), so a batch is either in or out
+        # when the checkpoint is read again. only a crash between the commit and the
+        # checkpoint save imports a batch twice.
+        with ExitStack() as stack:
+            for alias in {sharding.db_for_user(user) for user in users.values()}:
+                stack.enter_context(transaction.atomic(using=alias))
+            for email, items in by_user.items():
+                user = users.get(email)
+                if user is None:
+                    continue
+                token = sharding.activate(user)
+                try:
+                    imported += self.import_recipes(user, items)
+                finally:
+                    sharding.deactivate(token)
+                self.touched.add(user.pk)
+        return imported, sorted(set(by_user) - set(users))
+
+    def import_recipes(self, user, items):
+        tag_ids = self.tags.resolve(user, list(dict.fromkeys(name for item in items for name in item[2])))
+        ingredient_ids = self.ingredients.resolve(
+            user, list(dict.fromkeys(name for item in items for name in item[3]))
+        )
+        recipes = [
+            Recipe(
+                user=user,
+                # the id arrays are written with the rows, nothing refreshes them afterwards
+                tag_ids=sorted({tag_ids[name] for name in tags}),
+                ingredient_ids=sorted({ingredient_ids[name] for name in ingredients}),
+                **fields
+            )
+            for _, fields, tags, ingredients in items
+        ]
+        sharding.assign_ids(recipes)
+        # without batch_size Django packs as many rows in each INSERT as the database takes
+        Recipe.objects.bulk_create(recipes)
+
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=pk) for recipe in recipes for pk in recipe.tag_ids
+        )
+        Recipe.ingredients.through.objects.bulk_create(
+            Recipe.ingredients.through(recipe_id=recipe.pk, ingredient_id=pk)
+            for recipe in recipes for pk in recipe.ingredient_ids
+        )
+        return len(recipes)
+
+    def finish(self):
+        """Tell the listeners once per user, instead of per recipe"""
+        for user_id in self.touched:
+            recipes_bulk_changed.send(sender=Recipe, user_id=user_id, recipe_ids=None)
+
@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class UserIndexCache:
+    """
+    Keep in-memory indexes per user, built lazily on first use.
+    the least recently used indexes are dropped once the sum of their
+    nbytes goes over the memory budget returned by max_bytes().
+    builder may be a dotted path, so the index module (and numpy) is only
+    imported once the first index is built.
+
+    a change of the user's catalog while their index is being built is either
+    dropped by invalidate() or applied to an index that is not stored yet, so
+    every build notes the generation of the user when it starts. invalidate()
+    and changed() move the generation on, and a build that finishes on an
+    older generation is returned to its caller but not stored.
+
+    the catalog also changes in the other worker processes and in the commands, so
+    a named cache keeps a second, shared generation per user in the RECIPE_INDEX_CACHE
+    cache. invalidate() and changed() increment it, every index remembers the one it
+    was built for, and get() rebuilds an index whose generation is not the shared one
+    anymore. an index is also rebuilt after RECIPE_INDEX_MAX_AGE_SECONDS, in case a
+    change was missed while the shared cache was down or dropped the generation.
+    """
+
+    def __init__(self, builder, max_bytes, name=None):
+        self._builder = builder
+        self.max_bytes = max_bytes
+        # the key of the shared generations, without a name the cache only sees the changes of its process
+        self.name = name
+        # user id -> (index, shared generation, monotonic time of the build)
+        self._indexes = OrderedDict()
+        # user id -> [builds running, generation], only while an index of the user is built
+        self._builds = {}
+        self._lock = threading.Lock()
+
+    @property
+    def builder(self):
+        if isinstance(self._builder, str):
+            self._builder = import_string(self._builder)
+        return self._builder
+
+    def get(self, user_id):
+        """Return the index of the user, building it if needed"""
+        shared = self._shared_generation(user_id)
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is not None:
+                if self._is_current(entry, shared):
+                    self._indexes.move_to_end(user_id)
+                    return entry[0]
+                # changed in another process, or too old
+                del self._indexes[user_id]
+            build = self._builds.setdefault(user_id, [0, 0])
+            build[0] += 1
+            generation = build[1]
+
+        # build outside the lock, so other users are not blocked by a slow build
+        try:
+            index = self.builder(user_id)
+        finally:
+            with self._lock:
+                build[0] -= 1
+                if not build[0]:
+                    del self._builds[user_id]
+        with self._lock:
+            if build[1] == generation:
+                self._indexes[user_id] = (index, shared, time.monotonic())
+                self._evict()
+        return index
+
+    def peek(self, user_id):
+        """Return the index of the user if it is loaded, without building it"""
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            return entry and entry[0]
+
+    def changed(self, user_id):
+        """
+        Note a change of the user's catalog that is applied to the loaded index in place,
+        returns that index (or None) like peek(). a build running now is not stored,
+        and the other processes rebuild theirs.
+        """
+        shared = self._next_shared_generation(user_id)
+        with self._lock:
+            self._next_generation(user_id)
+            entry = self._indexes.get(user_id)
+            if entry is None:
+                return None
+            if shared is not None:
+                if entry[1] != shared - 1:
+                    # it missed a change of another process, updating it in place would not help
+                    del self._indexes[user_id]
+                    return None
+                self._indexes[user_id] = (entry[0], shared, entry[2])
+            return entry[0]
+
+    def invalidate(self, user_id):
+        """Drop the index of the user in every process, the next get() builds it again"""
+        self._next_shared_generation(user_id)
+        with self._lock:
+            self._next_generation(user_id)
+            self._indexes.pop(user_id, None)
+
+    def clear(self):
+        """Drop all indexes of this process"""
+        with self._lock:
+            for build in self._builds.values():
+                build[1] += 1
+            self._indexes.clear()
+
+    def nbytes(self):
+        """Return the memory used by the loaded indexes"""
+        with self._lock:
+            return sum(entry[0].nbytes for entry in self._indexes.values())
+
+    def _next_generation(self, user_id):
+        build = self._builds.get(user_id)
+        if build is not None:
+            build[1] += 1
+
+    def _is_current(self, entry, shared):
+        max_age = getattr(settings, 'RECIPE_INDEX_MAX_AGE_SECONDS', 3600)
+        if max_age is not None and time.monotonic() - entry[2] >= max_age:
+            return False
+        # None when the shared cache failed, the age is all there is to go by then
+        return shared is None or entry[1] == shared
+
+    def _key(self, user_id):
+        return f'index:{self.name}:{user_id}'
+
+    def _shared_generation(self, user_id):
+        if self.name is None:
+            return None
+        try:
+            return caches[getattr(settings, 'RECIPE_INDEX_CACHE', 'default')].get(self._key(user_id), 0)
+        except Exception:
+            logger.warning('The index cache failed, using the %s index as it is', self.name, exc_info=True)
+            return None
+
+    def _next_shared_generation(self, user_id):
+        if self.name is None:
+            return None
+        cache = caches[getattr(settings, 'RECIPE_INDEX_CACHE', 'default')]
+        key = self._key(user_id)
+        try:
+            try:
+                return cache.incr(key)
+            except ValueError:
+                # add is a no-op when another process created the generation in between
+                cache.add(key, 0, None)
+                return cache.incr(key)
+        except Exception:
+            logger.warning('The index cache failed, the other processes keep their %s index', self.name, exc_info=True)
+            return None
+
+    def _evict(self):
+        total = sum(entry[0].nbytes for entry in self._indexes.values())
+        limit = self.max_bytes()
+        # always keep the index that was just built, even if it is over budget on its own
+        while total > limit and len(self._indexes) > 1:
+            _, entry = self._indexes.popitem(last=False)
+            total -= entry[0].nbytes
+
+
+similarity_indexes = UserIndexCache(
+    'recipe.similarity.build_index',
+    lambda: getattr(settings, 'RECIPE_SIMILARITY_MAX_BYTES', 64 * 1024 * 1024),
+    name='similarity',
+)
+cookable_indexes = UserIndexCache(
+    'recipe.cookable.build_index',
+    lambda: getattr(settings, 'RECIPE_COOKABLE_MAX_BYTES', 64 * 1024 * 1024),
+    name='cookable',
+)
+typeahead_indexes = UserIndexCache(
+    'recipe.typeahead.build_index',
+    lambda: getattr(settings, 'RECIPE_TYPEAHEAD_MAX_BYTES', 32 * 1024 * 1024),
+    name='typeahead',
+)
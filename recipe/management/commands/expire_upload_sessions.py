@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from recipe.uploads import expire_sessions
+
+
+class Command(BaseCommand):
+    """Django command to drop the resumable uploads nobody finished"""
+    help = 'Delete upload sessions older than RECIPE_UPLOAD_SESSION_HOURS together with their partial files'
+
+    def handle(self, *args, **options):
+        count = expire_sessions()
+        self.stdout.write(self.style.SUCCESS(f'Expired {count} upload sessions.'))
@@ -0,0 +1,205 @@
+import multiprocessing
+import os
+import queue
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from recipe.import_worker import worker_main
+from recipe.importer import (
+    FORMATS, Checkpoint, Importer, RecordError, clean_record, detect_format, partition, read_records
+)
+
+# batches waiting for each worker, this and --batch-size bound the memory of the import
+QUEUE_DEPTH = 2
+REPORT_SECONDS = 5
+
+
+class Command(BaseCommand):
+    """Django command to import recipe catalogs of existing users from NDJSON or CSV"""
+    help = (
+        'Stream recipes from an NDJSON or CSV file into the catalogs of their users. '
+        'interrupted imports resume from the checkpoint file, see recipe/importer.py for the format.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON or CSV file')
+        parser.add_argument('--format', choices=FORMATS, help='Default: csv for .csv files, ndjson otherwise')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Worker processes, the users are split between them (default: 1, import in this process)'
+        )
+        parser.add_argument('--batch-size', type=int, default=2000, help='Records per transaction (default: 2000)')
+        parser.add_argument(
+            '--name-cache', type=int, default=100000,
+            help='Tag and ingredient names each worker keeps in memory (default: 100000)'
+        )
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and import from the start')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'No file {path}.')
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be at least 1.')
+        fmt = options['format'] or detect_format(path)
+        try:
+            checkpoint = Checkpoint(
+                options['checkpoint'] or path + '.checkpoint', path, fmt, options['workers'], options['restart']
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if checkpoint.complete:
+            self.stdout.write(f'{path} was imported already, use --restart to import it again.')
+            return
+
+        self.checkpoint = checkpoint
+        self.imported = self.skipped = 0
+        self.started = self.reported = time.monotonic()
+        if checkpoint.start:
+            self.stdout.write(f'Resuming at byte {checkpoint.start}.')
+
+        if options['workers'] == 1:
+            end = self.run_inline(path, fmt, options)
+        else:
+            end = self.run_pool(path, fmt, options)
+        checkpoint.finish(end)
+
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} recipes in {elapsed:.1f}s '
+            f'({self.imported / max(elapsed, 1e-9):.0f} rows/s), {self.skipped} records skipped.'
+        ))
+
+    def read(self, path, fmt, options, dispatch):
+        """Hand the records out to the workers in batches, returns the offset the file ends at"""
+        workers, batch_size = options['workers'], options['batch_size']
+        positions = self.checkpoint.positions
+        pending = [[] for _ in range(workers)]
+        end = self.checkpoint.start
+        for end, record in read_records(path, fmt, self.checkpoint.start):
+            try:
+                record = clean_record(record)
+            except RecordError as exc:
+                self.skip(f'record ending at byte {end}: {exc}')
+                continue
+            worker = partition(record[0], workers)
+            if end <= positions[worker]:
+                continue  # imported before the interruption
+            pending[worker].append(record)
+            if len(pending[worker]) >= batch_size:
+                dispatch(worker, end, pending[worker])
+                pending[worker] = []
+
+        # the workers have no records after their last one, so they got to the end of the file
+        for worker, batch in enumerate(pending):
+            if batch:
+                dispatch(worker, end, batch)
+        return end
+
+    def run_inline(self, path, fmt, options):
+        importer = Importer(options['name_cache'])
+
+        def dispatch(worker, offset, batch):
+            imported, unknown = importer.import_batch(batch)
+            self.batch_done(worker, offset, len(batch), imported, unknown)
+
+        end = self.read(path, fmt, options, dispatch)
+        importer.finish()
+        return end
+
+    def run_pool(self, path, fmt, options):
+        # spawned workers set Django up themselves, forking a process with open connections is not safe
+        context = multiprocessing.get_context('spawn')
+        tasks = [context.Queue(QUEUE_DEPTH) for _ in range(options['workers'])]
+        results = context.Queue()
+        connections.close_all()
+        processes = [
+            context.Process(target=worker_main, args=(worker, tasks[worker], results, options['name_cache']))
+            for worker in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+
+        done = set()
+
+        def collect(block):
+            """Handle the messages of the workers, waiting for one if block"""
+            while True:
+                try:
+                    message = results.get(timeout=1) if block else results.get_nowait()
+                except queue.Empty:
+                    if any(not process.is_alive() for worker, process in enumerate(processes) if worker not in done):
+                        self.stop(processes, tasks)
+                        self.drain(results)
+                        raise CommandError('A worker died, run the command again to resume.')
+                    return
+                if message[0] == 'batch':
+                    self.batch_done(*message[1:])
+                elif message[0] == 'done':
+                    done.add(message[1])
+                else:
+                    self.stop(processes, tasks)
+                    self.drain(results)
+                    raise CommandError(f'Worker {message[1]} failed: {message[2]}. run the command again to resume.')
+                if block:
+                    return
+
+        def put(worker, item):
+            # waits while the worker is behind, which keeps the reading from running ahead
+            while True:
+                try:
+                    tasks[worker].put(item, timeout=1)
+                    return
+                except queue.Full:
+                    collect(block=False)
+
+        try:
+            end = self.read(path, fmt, options, lambda worker, offset, batch: put(worker, (offset, batch)))
+            for worker in range(len(processes)):
+                put(worker, None)
+            while len(done) < len(processes):
+                collect(block=True)
+        except KeyboardInterrupt:
+            self.stop(processes, tasks)
+            raise
+        for process in processes:
+            process.join()
+        return end
+
+    def stop(self, processes, tasks):
+        for process in processes:
+            process.terminate()
+        # batches nobody will read would keep this process from exiting
+        for worker_tasks in tasks:
+            worker_tasks.cancel_join_thread()
+
+    def drain(self, results):
+        """Checkpoint the batches the other workers committed before they were stopped"""
+        while True:
+            try:
+                message = results.get(timeout=0.1)
+            except queue.Empty:
+                return
+            if message[0] == 'batch':
+                self.batch_done(*message[1:])
+
+    def batch_done(self, worker, offset, records, imported, unknown):
+        self.imported += imported
+        self.skipped += records - imported
+        for email in unknown:
+            self.stderr.write(f'Skipped the records of {email}, there is no such user')
+        self.checkpoint.advance(worker, offset)
+
+        now = time.monotonic()
+        if now - self.reported >= REPORT_SECONDS:
+            self.reported = now
+            self.stdout.write(
+                f'{self.imported} recipes, {self.imported / (now - self.started):.0f} rows/s'
+            )
+
+    def skip(self, reason):
+        self.skipped += 1
+        self.stderr.write(f'Skipped {reason}')
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main_app import sharding
+from main_app.models import Tombstone
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """Django command to delete the tombstones no sync token can ask for anymore"""
+    help = 'Delete tombstones older than RECIPE_SYNC_MAX_AGE_DAYS, older sync tokens get a full sync'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=getattr(settings, 'RECIPE_SYNC_MAX_AGE_DAYS', 30))
+        count = 0
+        # runs outside of a request, so no shard is active: every shard is pruned in turn
+        for alias in sharding.catalog_databases():
+            old = Tombstone.objects.using(alias).filter(deleted_at__lt=cutoff)
+            # in batches, so the table is not locked for one long DELETE
+            while True:
+                pks = list(old.order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+                if not pks:
+                    break
+                count += Tombstone.objects.using(alias).filter(pk__in=pks).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Pruned {count} tombstones.'))
@@ -0,0 +1,201 @@
+"""
+Meal plans: recipes of the user for a number of days that together use as many
+different tags and ingredients as possible, within a total price and a time per recipe.
+
+that is a budgeted maximum coverage problem, too big to search for catalogs of any
+size, so the planner runs heuristics under a time limit and returns the best plan found:
+
+- the candidates are loaded with one query. their tag and ingredient ids become the
+  rows of a bit matrix, packed into uint64 words as in recipe/cookable.py, so the new
+  tags and ingredients every candidate would add is one vectorized popcount.
+- greedy: add the recipe with the most new tags and ingredients per price, as long
+  as the days after it still fit in the budget with the cheapest recipes left. a
+  second run picks by the most new ones, cheapest first, and the better plan is kept.
+- local search: swap a planned recipe for the one covering the most with the rest
+  of the plan, while that covers more (or the same for less), until no swap helps
+  or the time is up. it starts from the better greedy plan, then from the other one.
+
+the first greedy run always finishes, the second one and the swaps only run in the time left.
+"""
+import time
+
+import numpy as np
+
+from .cookable import popcount_rows
+
+
+class Candidates:
+    """Prices, times and tag and ingredient bitsets of the recipes a plan can use"""
+
+    def __init__(self, recipe_ids, prices, times, bits, n_tags):
+        self.recipe_ids = recipe_ids
+        self.prices = prices
+        self.times = times
+        self.bits = bits  # row i: bit j < n_tags is tag j, the rest are the ingredients
+        self.n_tags = n_tags
+
+    @classmethod
+    def load(cls, queryset):
+        """Load the recipes of the queryset with one query, their id arrays hold the features"""
+        rows = list(queryset.values_list('id', 'price', 'time_minutes', 'tag_ids', 'ingredient_ids'))
+        recipe_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        prices = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        times = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+
+        features = []
+        for column in (3, 4):
+            lengths = np.fromiter((len(row[column]) for row in rows), dtype=np.int64, count=len(rows))
+            ids = np.fromiter((pk for row in rows for pk in row[column]), dtype=np.int64, count=lengths.sum())
+            features.append((np.repeat(np.arange(len(rows)), lengths), ids))
+        tag_ids = np.unique(features[0][1])
+        ingredient_ids = np.unique(features[1][1])
+
+        bits = np.zeros((len(rows), max((len(tag_ids) + len(ingredient_ids) + 63) // 64, 1)), dtype=np.uint64)
+        for (recipe_rows, ids), known, offset in (
+            (features[0], tag_ids, 0), (features[1], ingredient_ids, len(tag_ids))
+        ):
+            columns = np.searchsorted(known, ids) + offset
+            np.bitwise_or.at(
+                bits, (recipe_rows, columns // 64), np.left_shift(np.uint64(1), (columns % 64).astype(np.uint64))
+            )
+        return cls(recipe_ids, prices, times, bits, len(tag_ids))
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def covered(self, rows):
+        """The union of the tags and ingredients of the rows"""
+        return np.bitwise_or.reduce(self.bits[rows], axis=0) if len(rows) else np.zeros_like(self.bits[0])
+
+    def count(self, covered):
+        """Return (tags, ingredients) in the covered bits"""
+        flags = np.unpackbits(covered.view(np.uint8), bitorder='little')
+        return int(flags[:self.n_tags].sum()), int(flags[self.n_tags:].sum())
+
+
+class Planner:
+
+    def __init__(self, candidates, days, budget=None, seconds=0.2):
+        self.candidates = candidates
+        self.days = min(days, len(candidates))
+        self.budget = budget
+        self.stop_at = time.monotonic() + seconds
+        self.swaps = 0
+        self.complete = True  # False when the time ran out before the local search finished
+
+    def out_of_time(self):
+        if time.monotonic() >= self.stop_at:
+            self.complete = False
+        return not self.complete
+
+    def value(self, rows):
+        """What a plan is worth: more tags and ingredients, then a lower price"""
+        covered = self.candidates.covered(rows)
+        return int(popcount_rows(covered[np.newaxis])[0]), -int(self.candidates.prices[rows].sum())
+
+    def affordable(self, available, spent, days_left):
+        """Mask of the candidates the plan can add while the days after still fit in the budget"""
+        prices = self.candidates.prices
+        if self.budget is None:
+            return available
+        remaining = self.budget - spent
+        later = min(days_left - 1, int(available.sum()) - 1)
+        if later <= 0:
+            return available & (prices <= remaining)
+        # the cheapest recipes left pay for the later days, without the candidate itself
+        cheapest = np.sort(np.partition(prices[available], later)[:later + 1])
+        needed = np.where(prices <= cheapest[later], cheapest.sum(), prices + cheapest[:later].sum())
+        return available & (needed <= remaining)
+
+    def greedy(self, per_price):
+        candidates = self.candidates
+        available = np.ones(len(candidates), dtype=bool)
+        covered = np.zeros(candidates.bits.shape[1], dtype=np.uint64)
+        rows, spent = [], 0
+        for day in range(self.days):
+            feasible = self.affordable(available, spent, self.days - day)
+            if not feasible.any():
+                break
+            gains = popcount_rows(candidates.bits & ~covered).astype(np.float64)
+            if per_price:
+                # one more than the price, so free recipes do not win by default
+                score = gains / (candidates.prices + 1)
+            else:
+                score = gains - candidates.prices / (candidates.prices.max() + 1)
+            score[~feasible] = -np.inf
+            row = int(np.argmax(score))
+            rows.append(row)
+            available[row] = False
+            covered |= candidates.bits[row]
+            spent += int(candidates.prices[row])
+        return rows
+
+    def improve(self, rows):
+        """Swap recipes of the plan for better ones until no swap helps or the time is up"""
+        candidates = self.candidates
+        value = self.value(rows)
+        while not self.out_of_time():
+            best = None
+            available = np.ones(len(candidates), dtype=bool)
+            available[rows] = False
+            spent = int(candidates.prices[rows].sum())
+            for position in range(len(rows)):
+                if self.out_of_time():
+                    break
+                rest = rows[:position] + rows[position + 1:]
+                others = candidates.covered(rest)
+                coverage = popcount_rows(others[np.newaxis])[0] + popcount_rows(candidates.bits & ~others)
+                price = spent - candidates.prices[rows[position]] + candidates.prices
+                feasible = available if self.budget is None else available & (price <= self.budget)
+                if not feasible.any():
+                    continue
+                # the most coverage, then the lowest price
+                order = np.lexsort((price, -coverage))
+                row = int(order[np.argmax(feasible[order])])
+                swapped = (int(coverage[row]), -int(price[row]))
+                if swapped > value and (best is None or swapped > best[0]):
+                    best = (swapped, position, row)
+            if best is None:
+                break
+            value, position, row = best
+            rows = rows[:position] + [row] + rows[position + 1:]
+            self.swaps += 1
+        return rows
+
+    def plan(self):
+        """Return the rows of the best plan found"""
+        if not self.days:
+            return []
+        starts = [self.greedy(per_price=True)]
+        if not self.out_of_time():
+            starts.append(self.greedy(per_price=False))
+        # the plan with the most days first, then the most variety for the least money
+        starts.sort(key=lambda rows: (len(rows), self.value(rows)), reverse=True)
+        best = starts[0]
+        for rows in starts:
+            if self.out_of_time() or len(rows) < len(best):
+                break
+            rows = self.improve(rows)
+            if self.value(rows) > self.value(best):
+                best = rows
+        return best
+
+
+def plan_meals(queryset, days, budget=None, seconds=0.2):
+    """
+    Plan days of the recipes of the queryset, spending at most budget in total.
+    returns the plan as a dict, with the ids of its recipes in 'recipe_ids'
+    """
+    candidates = Candidates.load(queryset)
+    planner = Planner(candidates, days, budget, seconds)
+    rows = planner.plan()
+    tags, ingredients = candidates.count(candidates.covered(rows)) if len(candidates) else (0, 0)
+    return {
+        'recipe_ids': [int(candidates.recipe_ids[row]) for row in rows],
+        'total_price': int(candidates.prices[rows].sum()),
+        'total_time_minutes': int(candidates.times[rows].sum()),
+        'variety': {'tags': tags, 'ingredients': ingredients},
+        'candidates': len(candidates),
+        'swaps': planner.swaps,
+        'complete': planner.complete,
+    }
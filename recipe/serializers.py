@@ -1,8 +1,21 @@
+from django.conf import settings
 from rest_framework import serializers
-from main_app.models import Tag, Ingredient, Recipe
+from main_app.models import Tag, Ingredient, Recipe, UploadSession
 
 
-class TagSerializer(serializers.ModelSerializer):
+class DynamicFieldsMixin:
+    """Serializer mixin that takes a `fields` argument to keep only a subset of fields"""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class TagSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for Tag objects"""
 
     class Meta:
@@ -11,7 +24,7 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for ingredient objects"""
 
     class Meta:
@@ -20,16 +33,72 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+def find_ids(queryset, ids):
+    """
+    Return {id: object} of the ids found in the queryset with one IN query, which in_bulk
+    splits where the database limits the number of parameters. only the primary keys are
+    loaded. scoped to a user, the ids of other users are left out like unknown ones.
+    """
+    return queryset.only('pk').in_bulk(ids)
+
+
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key of a tag or an ingredient of the requesting user"""
+
+    def get_queryset(self):
+        request = self.context.get('request')
+        queryset = super().get_queryset()
+        if request is None:
+            return queryset.none()
+        return queryset.filter(user=request.user)
+
+
+class IdArrayRelatedField(serializers.ManyRelatedField):
+    """
+    Primary keys of a recipe relation. read from the id array on the recipe row, so
+    a list of recipes does not touch the through tables. on writes all the submitted
+    ids are checked against the rows of the requesting user with one query, instead
+    of one query per id, and the unknown ones are reported together.
+    """
+
+    def __init__(self, queryset, ids_attr, **kwargs):
+        self.ids_attr = ids_attr
+        super().__init__(child_relation=UserPrimaryKeyRelatedField(queryset=queryset), **kwargs)
+
+    def get_attribute(self, instance):
+        return getattr(instance, self.ids_attr)
+
+    def to_representation(self, iterable):
+        return list(iterable)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        ids = []
+        for value in data:
+            # the same checks PrimaryKeyRelatedField does on every id, without its query
+            if isinstance(value, bool):
+                self.child_relation.fail('incorrect_type', data_type=type(value).__name__)
+            try:
+                ids.append(int(value))
+            except (TypeError, ValueError):
+                self.child_relation.fail('incorrect_type', data_type=type(value).__name__)
+        ids = list(dict.fromkeys(ids))
+
+        found = find_ids(self.child_relation.get_queryset(), ids)
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            raise serializers.ValidationError(f'Unknown {self.field_name}: {missing}')
+        return [found[pk] for pk in ids]
+
+
+class RecipeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serialize a recipe list"""
-    ingredients = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Ingredient.objects.all()
-    )
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Tag.objects.all()
-    )
+    ingredients = IdArrayRelatedField(queryset=Ingredient.objects.all(), ids_attr='ingredient_ids')
+    tags = IdArrayRelatedField(queryset=Tag.objects.all(), ids_attr='tag_ids')
 
     class Meta:
         model = Recipe
@@ -45,6 +114,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('id', 'image')
         # just prevent the user from updating the id when they may create or edit request
+        # relations read from a column of the recipe, which SparseFieldsetMixin loads instead of prefetching
+        id_arrays = {'tags': 'tag_ids', 'ingredients': 'ingredient_ids'}
 
 
 class RecipeDetailSerializer(RecipeSerializer):
@@ -52,6 +123,9 @@ class RecipeDetailSerializer(RecipeSerializer):
     ingredients = IngredientSerializer(many=True, read_only=True)
     tags = TagSerializer(many=True, read_only=True)
 
+    class Meta(RecipeSerializer.Meta):
+        id_arrays = {}
+
 
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to recipes"""
@@ -60,3 +134,90 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serialize a resumable image upload, created with the size and name of the file"""
+    filename = serializers.CharField(write_only=True, max_length=100)
+
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'filename', 'size', 'received')
+        read_only_fields = ('id', 'received')
+
+    def validate_filename(self, value):
+        # only the extension is kept, and it ends up in a path on disk
+        if not value.rsplit('.', 1)[-1].isalnum():
+            raise serializers.ValidationError('Must end in a file extension like .jpg.')
+        return value
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.RECIPE_UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(
+                f'Must be between 1 and {settings.RECIPE_UPLOAD_MAX_BYTES} bytes.'
+            )
+        return value
+
+
+class RelationChangesSerializer(serializers.Serializer):
+    """Serialize the ids to add to and remove from a recipe relation"""
+    add = serializers.ListField(child=serializers.IntegerField(), default=list)
+    remove = serializers.ListField(child=serializers.IntegerField(), default=list)
+
+
+class RecipeChangesSerializer(serializers.Serializer):
+    """Serialize the changes applied to a recipe by a bulk update"""
+    title = serializers.CharField(max_length=255, required=False)
+    time_minutes = serializers.IntegerField(required=False)
+    price = serializers.IntegerField(required=False)
+    link = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    tags = RelationChangesSerializer(required=False)
+    ingredients = RelationChangesSerializer(required=False)
+
+
+class RecipeFilterSerializer(serializers.Serializer):
+    """Serialize the filter selecting the recipes of a bulk operation"""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    tags = serializers.ListField(child=serializers.IntegerField(), required=False)
+    ingredients = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError('Filter must not be empty.')
+        return attrs
+
+
+class RecipeBulkItemSerializer(serializers.Serializer):
+    """Serialize one recipe of a bulk update"""
+    id = serializers.IntegerField()
+    changes = RecipeChangesSerializer()
+
+
+class RecipeBulkUpdateSerializer(serializers.Serializer):
+    """Serialize a bulk update: a list of items, or a filter plus one patch"""
+    items = RecipeBulkItemSerializer(many=True, required=False)
+    filter = RecipeFilterSerializer(required=False)
+    patch = RecipeChangesSerializer(required=False)
+
+    def validate(self, attrs):
+        by_items = 'items' in attrs and 'filter' not in attrs and 'patch' not in attrs
+        by_filter = 'items' not in attrs and 'filter' in attrs and 'patch' in attrs
+        if not (by_items or by_filter):
+            raise serializers.ValidationError('Send either "items", or "filter" together with "patch".')
+        if by_items:
+            ids = [item['id'] for item in attrs['items']]
+            if len(set(ids)) != len(ids):
+                # the id arrays are computed per item, two diffs of one recipe would overwrite each other
+                raise serializers.ValidationError({'items': 'Every recipe may only appear once.'})
+        return attrs
+
+
+class RecipeBulkDeleteSerializer(serializers.Serializer):
+    """Serialize a bulk delete: a list of ids or a filter"""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    filter = RecipeFilterSerializer(required=False)
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError('Send either "ids" or "filter".')
+        return attrs
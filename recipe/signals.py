@@ -0,0 +1,182 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from main_app.models import Tag, Ingredient, Recipe
+from main_app.signals import recipes_bulk_changed
+from . import events
+from .index_cache import cookable_indexes, similarity_indexes, typeahead_indexes
+
+
+# the index modules import numpy, so they are only imported here once an index
+# of the user is loaded. a user without a loaded index has nothing to update.
+
+def reload_similar_recipe(user_id, recipe_id, using=None):
+    if similarity_indexes.changed(user_id) is not None:
+        from . import similarity
+        similarity.recipe_changed(user_id, recipe_id, using)
+
+
+def remove_similar_recipe(user_id, recipe_id):
+    if similarity_indexes.changed(user_id) is not None:
+        from . import similarity
+        similarity.recipe_deleted(user_id, recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(sender, instance, action, reverse, using, **kwargs):
+    """Keep the in-memory indexes current when tags or ingredients of a recipe change"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    user_id = instance.user_id
+    if sender is Recipe.ingredients.through:
+        transaction.on_commit(lambda: cookable_indexes.invalidate(user_id), using=using)
+
+    if reverse:
+        # tag.recipe_set.add(...) and friends can touch many recipes, rebuild lazily
+        transaction.on_commit(lambda: similarity_indexes.invalidate(user_id), using=using)
+    else:
+        recipe_id = instance.pk
+        transaction.on_commit(lambda: reload_similar_recipe(user_id, recipe_id, using), using=using)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, using, **kwargs):
+    if created:
+        # a recipe without ingredients can always be cooked
+        user_id = instance.user_id
+        transaction.on_commit(lambda: cookable_indexes.invalidate(user_id), using=using)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, using, **kwargs):
+    user_id, recipe_id = instance.user_id, instance.pk
+    transaction.on_commit(lambda: remove_similar_recipe(user_id, recipe_id), using=using)
+    transaction.on_commit(lambda: cookable_indexes.invalidate(user_id), using=using)
+    # the through rows went with the recipe, so the names it used lost a use
+    if instance.get_deferred_fields() & {'tag_ids', 'ingredient_ids'}:
+        transaction.on_commit(lambda: typeahead_indexes.invalidate(user_id), using=using)
+    else:
+        tag_ids, ingredient_ids = instance.tag_ids, instance.ingredient_ids
+        transaction.on_commit(lambda: update_typeahead(user_id, Tag, 'add_uses', tag_ids, -1), using=using)
+        transaction.on_commit(
+            lambda: update_typeahead(user_id, Ingredient, 'add_uses', ingredient_ids, -1), using=using
+        )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_attr_deleted(sender, instance, using, **kwargs):
+    # the through rows of the deleted tag or ingredient went away without m2m_changed
+    user_id = instance.user_id
+    transaction.on_commit(lambda: similarity_indexes.invalidate(user_id), using=using)
+    if sender is Ingredient:
+        transaction.on_commit(lambda: cookable_indexes.invalidate(user_id), using=using)
+
+
+@receiver(recipes_bulk_changed)
+def recipes_changed_in_bulk(sender, user_id, recipe_ids=None, **kwargs):
+    similarity_indexes.invalidate(user_id)
+    cookable_indexes.invalidate(user_id)
+    typeahead_indexes.invalidate(user_id)
+
+
+# ------------------------------------------------ typeahead names
+
+def update_typeahead(user_id, model, method, *args):
+    index = typeahead_indexes.changed(user_id)
+    if index is not None:
+        getattr(index[model], method)(*args)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def typeahead_name_saved(sender, instance, using, **kwargs):
+    user_id, pk, name = instance.user_id, instance.pk, instance.name
+    transaction.on_commit(lambda: update_typeahead(user_id, sender, 'save', pk, name), using=using)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def typeahead_name_deleted(sender, instance, using, **kwargs):
+    user_id, pk = instance.user_id, instance.pk
+    transaction.on_commit(lambda: update_typeahead(user_id, sender, 'remove', pk), using=using)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def typeahead_uses_changed(sender, instance, action, reverse, model, pk_set, using, **kwargs):
+    """Keep the number of recipes using each name current, it ranks the typeahead matches"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    user_id = instance.user_id
+    if action == 'post_clear':
+        # the cleared rows are not known any more
+        transaction.on_commit(lambda: typeahead_indexes.invalidate(user_id), using=using)
+        return
+
+    count = 1 if action == 'post_add' else -1
+    if reverse:
+        # tag.recipe_set.add(*recipes) gives the tag one use per recipe
+        kind, pks, count = type(instance), [instance.pk], count * len(pk_set)
+    else:
+        kind, pks = model, list(pk_set)
+    transaction.on_commit(lambda: update_typeahead(user_id, kind, 'add_uses', pks, count), using=using)
+
+
+# ------------------------------------------------ catalog event stream
+
+MODEL_EVENTS = {Recipe: 'recipe', Tag: 'tag', Ingredient: 'ingredient'}
+
+
+def publish_on_commit(user_id, event, using):
+    transaction.on_commit(lambda: events.publish(user_id, event), using=using)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def publish_saved(sender, instance, created, using, **kwargs):
+    publish_on_commit(instance.user_id, {
+        'type': MODEL_EVENTS[sender],
+        'action': 'created' if created else 'updated',
+        'id': instance.pk,
+    }, using)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def publish_deleted(sender, instance, using, **kwargs):
+    publish_on_commit(
+        instance.user_id, {'type': MODEL_EVENTS[sender], 'action': 'deleted', 'id': instance.pk}, using
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def publish_relations_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # the changed recipes are only known for add and remove, a clear resyncs the client
+        if not pk_set:
+            publish_on_commit(instance.user_id, {'type': 'resync'}, using)
+            return
+        recipe_ids = sorted(pk_set)
+    else:
+        recipe_ids = [instance.pk]
+    for recipe_id in recipe_ids:
+        publish_on_commit(instance.user_id, {'type': 'recipe', 'action': 'updated', 'id': recipe_id}, using)
+
+
+@receiver(recipes_bulk_changed)
+def publish_bulk_changed(sender, user_id, recipe_ids=None, **kwargs):
+    # bulk writes can touch thousands of recipes, one event per recipe would flood the
+    # streams, so the clients get the changed ids at once and fetch them through the sync
+    if recipe_ids is None:
+        events.publish(user_id, {'type': 'resync'})
+    else:
+        events.publish(user_id, {'type': 'recipes', 'action': 'changed', 'ids': sorted(recipe_ids)})
@@ -0,0 +1,257 @@
+"""
+Similar recipes ranked by idf-weighted cosine similarity over shared tags and ingredients.
+
+every user gets a sparse recipe-by-feature matrix, kept as numpy arrays in both
+row-major (features of a recipe) and column-major (recipes with a feature) order.
+a top-K query only touches the columns of the queried recipe and is fully vectorized.
+
+writes are applied incrementally: the new features of a changed recipe are kept in
+`pending` and used for queries right away, and the arrays are rebuilt from the
+previous arrays plus the pending changes in a background thread.
+"""
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from main_app.models import Recipe
+from main_app.sharding import use_shard_of
+from .index_cache import similarity_indexes
+
+TAG_WEIGHT = 1.0
+INGREDIENT_WEIGHT = 1.0
+
+EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def _pairs(queryset, column):
+    """Load (recipe_id, feature_id) pairs of a through table into two int64 arrays"""
+    rows = np.fromiter(
+        (value for pair in queryset.values_list('recipe_id', column) for value in pair),
+        dtype=np.int64
+    )
+    return rows[0::2], rows[1::2]
+
+
+def _expand_ranges(starts, ends):
+    """Return the concatenation of range(start, end) for every pair, without a Python loop"""
+    lengths = ends - starts
+    total = lengths.sum()
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.arange(total) + offsets, lengths
+
+
+class Matrix:
+    """Immutable snapshot of the recipe-by-feature matrix of one user"""
+
+    def __init__(self, tag_pairs, ingredient_pairs):
+        self.tag_pairs = tag_pairs
+        self.ingredient_pairs = ingredient_pairs
+
+        recipe_column = np.concatenate([tag_pairs[0], ingredient_pairs[0]])
+        self.recipe_ids = np.unique(recipe_column)
+        self.tag_ids, tag_cols = np.unique(tag_pairs[1], return_inverse=True)
+        self.ingredient_ids, ingredient_cols = np.unique(ingredient_pairs[1], return_inverse=True)
+
+        rows = np.searchsorted(self.recipe_ids, recipe_column)
+        cols = np.concatenate([tag_cols, ingredient_cols + len(self.tag_ids)])
+        n_rows, n_cols = len(self.recipe_ids), len(self.tag_ids) + len(self.ingredient_ids)
+
+        # rare features say more about similarity than the ones every recipe has
+        df = np.bincount(cols, minlength=n_cols)
+        kind = np.concatenate([
+            np.full(len(self.tag_ids), TAG_WEIGHT),
+            np.full(len(self.ingredient_ids), INGREDIENT_WEIGHT),
+        ])
+        self.weights = kind * np.log1p(n_rows / np.maximum(df, 1))
+
+        order = np.lexsort((rows, cols))
+        self.col_rows = rows[order]
+        self.col_indptr = np.concatenate([[0], np.cumsum(df)])
+
+        order = np.lexsort((cols, rows))
+        self.row_cols = cols[order]
+        self.row_indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_rows))])
+
+        self.row_norms = np.sqrt(np.bincount(rows, weights=self.weights[cols] ** 2, minlength=n_rows))
+
+    @property
+    def nbytes(self):
+        arrays = (self.tag_pairs[0], self.tag_pairs[1], self.ingredient_pairs[0],
+                  self.ingredient_pairs[1], self.recipe_ids, self.tag_ids, self.ingredient_ids,
+                  self.weights, self.col_rows, self.col_indptr, self.row_cols, self.row_indptr,
+                  self.row_norms)
+        return sum(array.nbytes for array in arrays)
+
+    def columns(self, tag_ids, ingredient_ids):
+        """Map feature ids to matrix columns, returns (known columns, weight of unknown features)"""
+        cols, unknown = [], 0.0
+        for ids, known, offset, weight in ((tag_ids, self.tag_ids, 0, TAG_WEIGHT),
+                                           (ingredient_ids, self.ingredient_ids,
+                                            len(self.tag_ids), INGREDIENT_WEIGHT)):
+            ids = np.asarray(ids, dtype=np.int64)
+            positions = np.searchsorted(known, ids)
+            found = positions < len(known)
+            found[found] = known[positions[found]] == ids[found]
+            cols.append(positions[found] + offset)
+            # features the snapshot has not seen yet are only in this recipe
+            unknown += (~found).sum() * (weight * np.log1p(len(self.recipe_ids))) ** 2
+        return np.concatenate(cols), unknown
+
+    def features(self, recipe_id):
+        """Return the matrix columns of a recipe"""
+        row = np.searchsorted(self.recipe_ids, recipe_id)
+        if row == len(self.recipe_ids) or self.recipe_ids[row] != recipe_id:
+            return EMPTY
+        return self.row_cols[self.row_indptr[row]:self.row_indptr[row + 1]]
+
+    def scores(self, cols, extra_norm=0.0):
+        """Return the cosine similarity of every recipe to the feature vector given by cols"""
+        weights = self.weights[cols]
+        query_norm = np.sqrt((weights ** 2).sum() + extra_norm)
+        if not len(cols) or not query_norm:
+            return np.zeros(len(self.recipe_ids))
+
+        positions, lengths = _expand_ranges(self.col_indptr[cols], self.col_indptr[cols + 1])
+        dots = np.bincount(
+            self.col_rows[positions],
+            weights=np.repeat(weights ** 2, lengths),
+            minlength=len(self.recipe_ids)
+        )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = dots / (self.row_norms * query_norm)
+        return np.nan_to_num(scores)
+
+
+class SimilarityIndex:
+    """Similarity index of the recipes of one user"""
+
+    def __init__(self, user_id, matrix):
+        self.user_id = user_id
+        self.matrix = matrix
+        self.pending = {}  # recipe id -> (tag ids, ingredient ids), or None once deleted
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    @classmethod
+    def build(cls, user_id):
+        """Load the index of the user with one query per through table"""
+        tag_pairs = _pairs(Recipe.tags.through.objects.filter(recipe__user_id=user_id), 'tag_id')
+        ingredient_pairs = _pairs(
+            Recipe.ingredients.through.objects.filter(recipe__user_id=user_id), 'ingredient_id'
+        )
+        return cls(user_id, Matrix(tag_pairs, ingredient_pairs))
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    def update(self, recipe_id, tag_ids=None, ingredient_ids=None, deleted=False):
+        """Record the new features of a recipe, and rebuild the matrix"""
+        with self._lock:
+            self.pending[recipe_id] = None if deleted else (list(tag_ids), list(ingredient_ids))
+            if self._rebuilding:
+                return  # the running rebuild picks this change up when it is done
+            self._rebuilding = True
+
+        if getattr(settings, 'RECIPE_SIMILARITY_BACKGROUND', True):
+            threading.Thread(target=self.rebuild, daemon=True).start()
+        else:
+            self.rebuild()
+
+    def rebuild(self):
+        """Merge the pending changes into a new matrix, until there are none left"""
+        while True:
+            with self._lock:
+                pending = dict(self.pending)
+                if not pending:
+                    self._rebuilding = False
+                    return
+
+            changed = np.fromiter(pending.keys(), dtype=np.int64)
+            new_tags, new_ingredients = [], []
+            for recipe_id, features in pending.items():
+                if features is not None:
+                    new_tags.extend((recipe_id, tag_id) for tag_id in features[0])
+                    new_ingredients.extend((recipe_id, ingredient_id) for ingredient_id in features[1])
+
+            old = self.matrix
+            matrix = Matrix(
+                self._merge(old.tag_pairs, changed, new_tags),
+                self._merge(old.ingredient_pairs, changed, new_ingredients)
+            )
+
+            with self._lock:
+                self.matrix = matrix
+                # only forget the changes this matrix contains, newer ones stay pending
+                for recipe_id, features in pending.items():
+                    if self.pending.get(recipe_id, features) is features:
+                        del self.pending[recipe_id]
+
+    @staticmethod
+    def _merge(pairs, changed, new_pairs):
+        keep = ~np.isin(pairs[0], changed)
+        new = np.array(new_pairs, dtype=np.int64).reshape(-1, 2)
+        return (np.concatenate([pairs[0][keep], new[:, 0]]),
+                np.concatenate([pairs[1][keep], new[:, 1]]))
+
+    def similar(self, recipe_id, k=10):
+        """Return up to k (recipe id, score) pairs most similar to the recipe, best first"""
+        with self._lock:
+            matrix = self.matrix
+            pending = dict(self.pending)
+
+        if recipe_id in pending:
+            if pending[recipe_id] is None:
+                return []
+            cols, extra_norm = matrix.columns(*pending[recipe_id])
+        else:
+            cols, extra_norm = matrix.features(recipe_id), 0.0
+
+        scores = matrix.scores(cols, extra_norm)
+        # the recipe itself, and recipes changed since the snapshot, are not ranked from stale data
+        excluded = np.fromiter(list(pending) + [recipe_id], dtype=np.int64)
+        scores[np.isin(matrix.recipe_ids, excluded)] = 0
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.lexsort((matrix.recipe_ids[candidates], -scores[candidates]))]
+
+        return [(int(matrix.recipe_ids[row]), float(scores[row])) for row in candidates]
+
+
+def build_index(user_id):
+    """Build the index of the user, called by similarity_indexes on a cache miss"""
+    with use_shard_of(user_id):
+        return SimilarityIndex.build(user_id)
+
+
+indexes = similarity_indexes
+
+
+def similar_recipes(user_id, recipe_id, k=10):
+    """Return up to k (recipe id, score) pairs of the user's recipes similar to the recipe"""
+    return indexes.get(user_id).similar(recipe_id, k)
+
+
+def recipe_changed(user_id, recipe_id, using=None):
+    """Reload the features of one recipe into the index of its user, if that is loaded"""
+    index = indexes.changed(user_id)
+    if index is None:
+        return
+
+    tag_ids = Recipe.tags.through.objects.using(using).filter(
+        recipe_id=recipe_id
+    ).values_list('tag_id', flat=True)
+    ingredient_ids = Recipe.ingredients.through.objects.using(using).filter(
+        recipe_id=recipe_id
+    ).values_list('ingredient_id', flat=True)
+    index.update(recipe_id, tag_ids, ingredient_ids)
+
+
+def recipe_deleted(user_id, recipe_id):
+    """Remove a recipe from the index of its user, if that is loaded"""
+    index = indexes.changed(user_id)
+    if index is not None:
+        index.update(recipe_id, deleted=True)
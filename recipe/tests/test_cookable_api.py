@@ -0,0 +1,131 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main_app.models import Recipe, Ingredient
+from main_app.signals import refresh_relation_ids
+
+from recipe import cookable
+from recipe.index_cache import UserIndexCache
+
+COOKABLE_URL = reverse('recipe:recipe-cookable')
+
+
+def sample_recipe(user, ingredients=(), **params):
+    """Create and return a sample recipe with the given ingredients"""
+    defaults = {
+        'title': 'sample_recipe',
+        'time_minutes': 10,
+        'price': 50
+    }
+    defaults.update(params)
+
+    recipe = Recipe.objects.create(user=user, **defaults)
+    recipe.ingredients.add(*ingredients)
+    return recipe
+
+
+class CookableApiTests(TestCase):
+    """Test the what-can-I-cook API"""
+
+    def setUp(self):
+        # the indexes live in memory, outside the test transaction
+        cookable.indexes.clear()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.client.force_authenticate(self.user)
+
+        self.eggs = Ingredient.objects.create(user=self.user, name='Eggs')
+        self.milk = Ingredient.objects.create(user=self.user, name='Milk')
+        self.flour = Ingredient.objects.create(user=self.user, name='Flour')
+        self.sugar = Ingredient.objects.create(user=self.user, name='Sugar')
+
+    def ids(self, *ingredients):
+        return ','.join(str(ingredient.id) for ingredient in ingredients)
+
+    def test_cookable_and_near_misses(self):
+        """Test that covered recipes come first, then the ones missing few ingredients"""
+        omelette = sample_recipe(self.user, [self.eggs], title='Omelette')
+        pancakes = sample_recipe(self.user, [self.eggs, self.milk, self.flour], title='Pancakes')
+        cake = sample_recipe(self.user, [self.eggs, self.milk, self.flour, self.sugar], title='Cake')
+
+        res = self.client.get(COOKABLE_URL, {'ingredients': self.ids(self.eggs, self.milk)})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in res.data], [omelette.id, pancakes.id, cake.id])
+        self.assertEqual(res.data[0]['missing'], [])
+        self.assertEqual(res.data[1]['missing'], [self.flour.id])
+        self.assertEqual(sorted(res.data[2]['missing']), sorted([self.flour.id, self.sugar.id]))
+
+    def test_max_missing(self):
+        """Test that ?max_missing= limits the near misses"""
+        sample_recipe(self.user, [self.eggs, self.milk])
+
+        res = self.client.get(COOKABLE_URL, {'ingredients': self.ids(self.eggs), 'max_missing': 0})
+
+        self.assertEqual(res.data, [])
+
+    def test_limited_to_user(self):
+        """Test that recipes of other users are never returned"""
+        user2 = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        sample_recipe(user2)
+
+        res = self.client.get(COOKABLE_URL, {'ingredients': self.ids(self.eggs)})
+
+        self.assertEqual(res.data, [])
+
+    def test_index_rebuilt_after_change_in_other_process(self):
+        """Test that a bulk change of another process, e.g. the importer, reaches the loaded index"""
+        recipe = sample_recipe(self.user, [self.eggs])
+        self.assertEqual(len(self.client.get(COOKABLE_URL, {'ingredients': self.ids(self.eggs)}).data), 1)
+
+        # the importer writes the through rows in bulk and invalidates the cache of its own process
+        Recipe.ingredients.through.objects.bulk_create([
+            Recipe.ingredients.through(recipe=recipe, ingredient=self.milk)
+        ])
+        refresh_relation_ids([recipe.id])
+        UserIndexCache(cookable.build_index, lambda: 1024, name='cookable').invalidate(self.user.id)
+
+        res = self.client.get(COOKABLE_URL, {'ingredients': self.ids(self.eggs), 'max_missing': 0})
+        self.assertEqual(res.data, [])
+
+    def test_index_invalidated_on_write(self):
+        """Test that ingredient changes are picked up by the next query"""
+        recipe = sample_recipe(self.user, [self.eggs])
+        res = self.client.get(COOKABLE_URL, {'ingredients': self.ids(self.eggs), 'max_missing': 0})
+        self.assertEqual(len(res.data), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.ingredients.add(self.sugar)
+
+        res = self.client.get(COOKABLE_URL, {'ingredients': self.ids(self.eggs), 'max_missing': 0})
+        self.assertEqual(res.data, [])
+
+    def test_invalid_ingredients(self):
+        """Test that non numeric ids are rejected"""
+        res = self.client.get(COOKABLE_URL, {'ingredients': 'eggs'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CookableIndexTests(TestCase):
+    """Test the ingredient bitsets"""
+
+    def test_more_than_64_ingredients(self):
+        """Test that bits beyond the first word are counted"""
+        index = cookable.CookableIndex.from_pairs(
+            [1, 2], [1, 1, 2], [5, 100, 100]
+        )
+        self.assertEqual(index.bits.shape, (2, 1))
+
+        index = cookable.CookableIndex.from_pairs(
+            [1, 2], [1] * 70 + [2], list(range(70)) + [69]
+        )
+        self.assertEqual(index.bits.shape, (2, 2))
+        self.assertEqual(index.query({69}), [(2, 0)])
+        self.assertEqual(index.query(set(range(69)), max_missing=1), [(1, 1), (2, 1)])
+        self.assertEqual(index.missing_ingredients(1, set(range(69))), [69])
@@ -0,0 +1,137 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from rest_framework.authtoken.models import Token
+
+from main_app.models import Recipe, Tag
+from recipe import events
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=5))
+
+
+class FakeClient:
+    """Drive the ASGI app with a receive/send pair, disconnecting on demand"""
+
+    def __init__(self):
+        self.messages = []
+        self.disconnect = asyncio.Event()
+        self.received = asyncio.Event()
+
+    async def receive(self):
+        await self.disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        self.messages.append(message)
+        self.received.set()
+
+    @property
+    def body(self):
+        return b''.join(m.get('body', b'') for m in self.messages if m['type'] == 'http.response.body')
+
+    async def wait_for(self, text):
+        while text.encode() not in self.body:
+            self.received.clear()
+            await self.received.wait()
+
+
+def scope(token=None, method='GET'):
+    headers = [(b'authorization', f'Token {token}'.encode())] if token else []
+    return {'type': 'http', 'method': method, 'path': '/api/recipe/events/', 'headers': headers, 'query_string': b''}
+
+
+# *************************************************************************
+class BrokerTests(TestCase):
+    """Test the in-process fan-out of the events"""
+
+    def test_events_reach_only_the_user(self):
+        """Test that an event goes to the subscribers of its user only"""
+        async def scenario():
+            broker = events.Broker()
+            mine = broker.subscribe(1, queue_size=10)
+            other = broker.subscribe(2, queue_size=10)
+            broker.dispatch(1, {'type': 'tag', 'action': 'created', 'id': 5})
+            await asyncio.sleep(0)
+            return mine.queue.qsize(), other.queue.qsize()
+
+        self.assertEqual(run(scenario()), (1, 0))
+
+    def test_slow_subscriber_overflow(self):
+        """Test that a full queue is replaced by a single resync event"""
+        async def scenario():
+            broker = events.Broker()
+            subscriber = broker.subscribe(1, queue_size=3)
+            for i in range(10):
+                broker.dispatch(1, {'type': 'recipe', 'action': 'updated', 'id': i})
+            await asyncio.sleep(0)
+            return [subscriber.queue.get_nowait() for _ in range(subscriber.queue.qsize())]
+
+        self.assertEqual(run(scenario()), [{'type': 'resync'}])
+
+    def test_unsubscribe(self):
+        """Test that the last unsubscribe forgets the user"""
+        async def scenario():
+            broker = events.Broker()
+            subscriber = broker.subscribe(1, queue_size=3)
+            broker.unsubscribe(subscriber)
+            return broker.has_subscribers(1)
+
+        self.assertFalse(run(scenario()))
+
+
+# *************************************************************************
+@override_settings(CATALOG_EVENTS={'BACKEND': 'local', 'HEARTBEAT_SECONDS': 0.05})
+class CatalogEventsAppTests(TransactionTestCase):
+    """Test the event stream app, the token lookup runs in another thread"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.token = Token.objects.create(user=self.user)
+
+    def test_auth_required(self):
+        """Test that the stream needs a valid token"""
+        client = FakeClient()
+        run(events.catalog_events_app(scope('wrong'), client.receive, client.send))
+
+        self.assertEqual(client.messages[0]['status'], 401)
+
+    def test_stream_receives_events(self):
+        """Test that saved models reach the open stream, with heartbeats in between"""
+        client = FakeClient()
+
+        async def scenario():
+            stream = asyncio.ensure_future(
+                events.catalog_events_app(scope(self.token.key), client.receive, client.send)
+            )
+            await client.wait_for(': connected')
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: Tag.objects.create(user=self.user, name='Vegan')
+            )
+            await client.wait_for('event: tag')
+            await client.wait_for(': ping')
+            client.disconnect.set()
+            await stream
+
+        run(scenario())
+
+        tag = Tag.objects.get()
+        self.assertEqual(client.messages[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), client.messages[0]['headers'])
+        data = next(line for line in client.body.decode().splitlines() if line.startswith('data: '))
+        self.assertEqual(json.loads(data[6:]), {'type': 'tag', 'action': 'created', 'id': tag.id})
+        self.assertFalse(events.broker.has_subscribers(self.user.id))
+
+    @patch('recipe.events.publish')
+    def test_recipe_relation_events(self, mock_publish):
+        """Test that changing the tags of a recipe publishes a recipe update"""
+        recipe = Recipe.objects.create(user=self.user, title='Salad', time_minutes=5, price=3)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe.tags.add(tag)
+
+        mock_publish.assert_called_with(self.user.id, {'type': 'recipe', 'action': 'updated', 'id': recipe.id})
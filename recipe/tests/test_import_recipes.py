@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from main_app.models import Recipe, Tag, Ingredient
+from recipe.importer import NameCache
+
+
+def recipe_record(email='cook@gmail.com', **params):
+    record = {
+        'user': email, 'title': 'Soup', 'time_minutes': 20, 'price': 5,
+        'tags': ['Vegan'], 'ingredients': ['Salt', 'Water'],
+    }
+    record.update(params)
+    return record
+
+
+class ImportRecipesCommandTests(TestCase):
+    """Test the import_recipes command"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('cook@gmail.com', 'testpass123')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def write_ndjson(self, records):
+        return self.write('catalog.ndjson', ''.join(json.dumps(record) + '\n' for record in records))
+
+    def run_import(self, path, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_recipes', path, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_ndjson(self):
+        """Test that recipes are imported with their tags, ingredients and id arrays"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        path = self.write_ndjson([
+            recipe_record(),
+            recipe_record(title='Bread', tags=[], ingredients=['Salt', 'Flour']),
+        ])
+
+        out, _ = self.run_import(path, '--batch-size', '1')
+
+        self.assertIn('Imported 2 recipes', out)
+        self.assertIn('rows/s', out)
+        soup, bread = Recipe.objects.filter(user=self.user).order_by('pk')
+        # the existing tag is reused, the ingredients are created once
+        self.assertEqual(list(soup.tags.all()), [vegan])
+        self.assertEqual(Ingredient.objects.filter(user=self.user).count(), 3)
+        salt = Ingredient.objects.get(name='Salt')
+        self.assertIn(salt, bread.ingredients.all())
+        self.assertEqual(soup.tag_ids, [vegan.id])
+        self.assertEqual(bread.ingredient_ids, sorted(bread.ingredients.values_list('id', flat=True)))
+
+    def test_import_csv(self):
+        """Test that CSV files list the names separated by |"""
+        path = self.write(
+            'catalog.csv',
+            'user,title,time_minutes,price,link,tags,ingredients\n'
+            'cook@gmail.com,"Pasta, fresh",15,8,,Italian|Quick,Flour|Eggs\n'
+        )
+
+        self.run_import(path)
+
+        recipe = Recipe.objects.get(user=self.user)
+        self.assertEqual(recipe.title, 'Pasta, fresh')
+        self.assertEqual(sorted(recipe.tags.values_list('name', flat=True)), ['Italian', 'Quick'])
+        self.assertEqual(recipe.ingredients.count(), 2)
+
+    def test_invalid_records_skipped(self):
+        """Test that broken records and unknown users are reported and skipped"""
+        path = self.write_ndjson([
+            recipe_record(),
+            recipe_record(price='cheap'),
+            recipe_record(email='nobody@gmail.com'),
+            recipe_record(title=''),
+        ])
+
+        out, err = self.run_import(path)
+
+        self.assertIn('Imported 1 recipes', out)
+        self.assertIn('3 records skipped', out)
+        self.assertIn('must be whole numbers', err)
+        self.assertIn('nobody@gmail.com', err)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_resume_from_checkpoint(self):
+        """Test that an interrupted import continues after the last imported batch"""
+        records = [recipe_record(title=f'recipe {i}') for i in range(4)]
+        path = self.write_ndjson(records)
+        # the state after the first two records were imported
+        with open(path + '.checkpoint', 'w') as file:
+            json.dump({
+                'source': os.path.abspath(path), 'format': 'ndjson', 'workers': 1,
+                'positions': [len(json.dumps(records[0]) + '\n') * 2], 'complete': False,
+            }, file)
+
+        self.run_import(path)
+
+        self.assertEqual(list(Recipe.objects.values_list('title', flat=True)), ['recipe 2', 'recipe 3'])
+        # a finished import is not repeated
+        out, _ = self.run_import(path)
+        self.assertIn('imported already', out)
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_checkpoint_of_other_options(self):
+        """Test that a checkpoint written with another number of workers is not used"""
+        path = self.write_ndjson([recipe_record()])
+        self.run_import(path)
+        Recipe.objects.all().delete()
+
+        with self.assertRaises(Exception):
+            self.run_import(path, '--workers', '2')
+        self.run_import(path, '--restart')
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_name_cache_is_bounded(self):
+        """Test that the name cache forgets names beyond its capacity and looks them up again"""
+        cache = NameCache(Tag, capacity=2)
+        first = cache.resolve(self.user, ['a', 'b', 'c'])
+        self.assertEqual(len(cache._ids), 2)
+
+        with self.assertNumQueries(1):
+            again = cache.resolve(self.user, ['a'])
+        self.assertEqual(again['a'], first['a'])
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
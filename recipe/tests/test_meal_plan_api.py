@@ -0,0 +1,145 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main_app.models import Recipe, Tag, Ingredient
+
+from recipe import planner
+
+PLAN_URL = reverse('recipe:plan')
+
+
+def sample_recipe(user, tags=(), ingredients=(), **params):
+    """Create and return a sample recipe with the given tags and ingredients"""
+    defaults = {
+        'title': 'sample_recipe',
+        'time_minutes': 10,
+        'price': 5
+    }
+    defaults.update(params)
+
+    recipe = Recipe.objects.create(user=user, **defaults)
+    recipe.tags.add(*tags)
+    recipe.ingredients.add(*ingredients)
+    return recipe
+
+
+class MealPlanApiTests(TestCase):
+    """Test the meal plan API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.client.force_authenticate(self.user)
+
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.quick = Tag.objects.create(user=self.user, name='Quick')
+        self.rice, self.beans, self.eggs, self.fish = (
+            Ingredient.objects.create(user=self.user, name=name) for name in ('Rice', 'Beans', 'Eggs', 'Fish')
+        )
+
+    def plan(self, **params):
+        res = self.client.get(PLAN_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_plan_maximizes_variety(self):
+        """Test that the plan picks recipes with different ingredients over more of the same"""
+        rice_beans = sample_recipe(self.user, [self.vegan], [self.rice, self.beans])
+        sample_recipe(self.user, [self.vegan], [self.rice, self.beans])
+        eggs_fish = sample_recipe(self.user, [self.quick], [self.eggs, self.fish])
+
+        data = self.plan(days=2)
+
+        self.assertEqual(sorted(recipe['id'] for recipe in data['recipes']), [rice_beans.id, eggs_fish.id])
+        self.assertEqual(data['variety'], {'tags': 2, 'ingredients': 4})
+        self.assertEqual(data['total_price'], 10)
+        self.assertEqual(data['total_time_minutes'], 20)
+        self.assertEqual(data['candidates'], 3)
+
+    def test_plan_within_budget(self):
+        """Test that the plan costs at most the budget, and still has a recipe for every day"""
+        sample_recipe(self.user, [self.vegan, self.quick], [self.rice, self.beans, self.eggs], price=20)
+        cheap = [sample_recipe(self.user, [], [ingredient], price=3) for ingredient in (self.rice, self.fish)]
+
+        data = self.plan(days=2, budget=10)
+
+        self.assertEqual(sorted(recipe['id'] for recipe in data['recipes']), [recipe.id for recipe in cheap])
+        self.assertLessEqual(data['total_price'], 10)
+
+    def test_plan_filters(self):
+        """Test that max_time and tags limit the recipes the plan can use"""
+        vegan = sample_recipe(self.user, [self.vegan], [self.rice], time_minutes=15)
+        sample_recipe(self.user, [self.vegan], [self.beans], time_minutes=90)
+        sample_recipe(self.user, [self.quick], [self.eggs], time_minutes=5)
+
+        data = self.plan(days=3, max_time=30, tags=self.vegan.id)
+
+        self.assertEqual([recipe['id'] for recipe in data['recipes']], [vegan.id])
+        self.assertEqual(data['candidates'], 1)
+
+    def test_image_urls_absolute(self):
+        """Test that the planned recipes have absolute image URLs like the recipe endpoints"""
+        recipe = sample_recipe(self.user, [self.vegan], [self.rice])
+        Recipe.objects.filter(pk=recipe.pk).update(image='uploads/recipe/rice.jpg')
+
+        data = self.plan(days=1)
+
+        self.assertEqual(data['recipes'][0]['image'], 'http://testserver/media/uploads/recipe/rice.jpg')
+
+    def test_plan_only_own_recipes(self):
+        """Test that the plan uses the recipes of the authenticated user only"""
+        other = get_user_model().objects.create_user('other@gmail.com', 'testpassword1234')
+        sample_recipe(other, ingredients=[Ingredient.objects.create(user=other, name='Salt')])
+
+        data = self.plan()
+
+        self.assertEqual(data['recipes'], [])
+        self.assertEqual(data['candidates'], 0)
+
+    def test_invalid_params(self):
+        """Test that invalid days, budget, max_time and tags return 400"""
+        for params in ({'days': 0}, {'days': 365}, {'budget': 'cheap'}, {'max_time': -1}, {'tags': 'vegan'}):
+            res = self.client.get(PLAN_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(next(iter(params)), res.data)
+
+    def test_login_required(self):
+        """Test that authentication is required to plan meals"""
+        res = APIClient().get(PLAN_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PlannerTests(TestCase):
+    """Test the heuristics of the planner"""
+
+    def test_local_search_improves_plan(self):
+        """Test that swaps replace a recipe that adds nothing new"""
+        user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        rice, beans, eggs = (Ingredient.objects.create(user=user, name=name) for name in ('Rice', 'Beans', 'Eggs'))
+        for ingredients in ([rice, beans], [rice, beans], [eggs]):
+            sample_recipe(user, ingredients=ingredients)
+
+        candidates = planner.Candidates.load(Recipe.objects.filter(user=user).order_by('id'))
+        search = planner.Planner(candidates, days=2, seconds=10)
+        rows = search.improve([0, 1])
+
+        self.assertIn(sorted(rows), ([0, 2], [1, 2]))
+        self.assertEqual(search.swaps, 1)
+        self.assertTrue(search.complete)
+
+    def test_time_budget(self):
+        """Test that without time left the planner still returns its first greedy plan"""
+        user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        for i in range(20):
+            sample_recipe(user, ingredients=[Ingredient.objects.create(user=user, name=f'Ingredient {i}')])
+
+        plan = planner.plan_meals(Recipe.objects.filter(user=user), days=7, seconds=0)
+
+        self.assertEqual(len(plan['recipe_ids']), 7)
+        self.assertEqual(plan['variety']['ingredients'], 7)
+        self.assertFalse(plan['complete'])
+        self.assertEqual(plan['swaps'], 0)
@@ -0,0 +1,136 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main_app.models import Recipe, Tag, Ingredient
+
+RECIPES_URL = reverse('recipe:recipe-list')
+FACETS_URL = reverse('recipe:recipe-facets')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'sample_recipe',
+        'time_minutes': 10,
+        'price': 50
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeFilterApiTests(TestCase):
+    """Test the range filters, ordering and facets of the recipe list"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.client.force_authenticate(self.user)
+
+        self.cheap = sample_recipe(self.user, title='Bread', price=5, time_minutes=60)
+        self.medium = sample_recipe(self.user, title='Pasta', price=20, time_minutes=15)
+        self.expensive = sample_recipe(self.user, title='Lobster', price=90, time_minutes=30)
+
+    def titles(self, res):
+        return [item['title'] for item in res.data]
+
+    def test_price_range(self):
+        """Test filtering by minimum and maximum price"""
+        res = self.client.get(RECIPES_URL, {'price_min': 10, 'price_max': 50})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.titles(res), ['Pasta'])
+
+    def test_time_max(self):
+        """Test filtering by maximum preparation time"""
+        res = self.client.get(RECIPES_URL, {'time_max': 30, 'ordering': 'time_minutes'})
+
+        self.assertEqual(self.titles(res), ['Pasta', 'Lobster'])
+
+    def test_filter_by_tags_and_ingredients(self):
+        """Test that ?tags= and ?ingredients= list the recipes with any of the ids"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        quick = Tag.objects.create(user=self.user, name='Quick')
+        flour = Ingredient.objects.create(user=self.user, name='Flour')
+        self.cheap.tags.add(vegan)
+        self.medium.tags.add(quick)
+        self.cheap.ingredients.add(flour)
+
+        res = self.client.get(RECIPES_URL, {'tags': f'{vegan.id},{quick.id}'})
+        self.assertEqual(self.titles(res), ['Bread', 'Pasta'])
+
+        res = self.client.get(RECIPES_URL, {'tags': vegan.id, 'ingredients': flour.id})
+        self.assertEqual(self.titles(res), ['Bread'])
+
+        res = self.client.get(RECIPES_URL, {'tags': 'vegan'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_id_arrays_follow_deletes_and_reverse_adds(self):
+        """Test that deleting a tag and adding recipes from the tag side update the listed ids"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        vegan.recipe_set.add(self.cheap, self.medium)
+
+        res = self.client.get(RECIPES_URL, {'tags': vegan.id})
+        self.assertEqual(self.titles(res), ['Bread', 'Pasta'])
+        self.assertEqual(res.data[0]['tags'], [vegan.id])
+
+        vegan.delete()
+
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual([item['tags'] for item in res.data], [[], [], []])
+
+    def test_ordering(self):
+        """Test the supported sort options"""
+        res = self.client.get(RECIPES_URL, {'ordering': 'price'})
+        self.assertEqual(self.titles(res), ['Bread', 'Pasta', 'Lobster'])
+
+        res = self.client.get(RECIPES_URL, {'ordering': 'title'})
+        self.assertEqual(self.titles(res), ['Bread', 'Lobster', 'Pasta'])
+
+        res = self.client.get(RECIPES_URL, {'ordering': '-id'})
+        self.assertEqual(self.titles(res), ['Lobster', 'Pasta', 'Bread'])
+
+    def test_invalid_parameters(self):
+        """Test that unknown orderings and non numeric ranges are rejected"""
+        res = self.client.get(RECIPES_URL, {'ordering': 'user'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.get(RECIPES_URL, {'price_min': 'cheap'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_facets_of_filtered_recipes(self):
+        """Test that facets count tags and ingredients of the filtered recipes in one query"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        quick = Tag.objects.create(user=self.user, name='Quick')
+        flour = Ingredient.objects.create(user=self.user, name='Flour')
+        self.cheap.tags.add(vegan)
+        self.medium.tags.add(vegan, quick)
+        self.expensive.tags.add(quick)
+        self.cheap.ingredients.add(flour)
+        self.medium.ingredients.add(flour)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(FACETS_URL, {'price_max': 50})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'], [
+            {'id': vegan.id, 'name': 'Vegan', 'count': 2},
+            {'id': quick.id, 'name': 'Quick', 'count': 1},
+        ])
+        self.assertEqual(res.data['ingredients'], [
+            {'id': flour.id, 'name': 'Flour', 'count': 2},
+        ])
+
+    def test_facets_limited_to_user(self):
+        """Test that recipes of other users are not counted"""
+        user2 = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        tag = Tag.objects.create(user=user2, name='Secret')
+        sample_recipe(user2).tags.add(tag)
+
+        res = self.client.get(FACETS_URL)
+
+        self.assertEqual(res.data, {'tags': [], 'ingredients': []})
@@ -0,0 +1,159 @@
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from PIL import Image
+
+from main_app.models import Recipe, UploadSession
+
+
+def uploads_url(recipe_id):
+    return reverse('recipe:recipe-start-upload', args=[recipe_id])
+
+
+def chunk_url(recipe_id, session_id):
+    return reverse('recipe:recipe-upload-chunk', args=[recipe_id, session_id])
+
+
+def finalize_url(recipe_id, session_id):
+    return reverse('recipe:recipe-finish-upload', args=[recipe_id, session_id])
+
+
+def sample_image():
+    """Return the bytes of a small PNG that does not compress away"""
+    image = Image.effect_noise((64, 64), 50).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class RecipeUploadApiTests(TestCase):
+    """Test the resumable recipe image uploads"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(user=self.user, title='Salad', time_minutes=5, price=3)
+        self.image = sample_image()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def start(self, size=None):
+        res = self.client.post(uploads_url(self.recipe.id), {'filename': 'photo.png', 'size': size or len(self.image)})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def put_chunk(self, session_id, start, end, data=None):
+        return self.client.put(
+            chunk_url(self.recipe.id, session_id),
+            data=self.image[start:end + 1] if data is None else data,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.image)}'
+        )
+
+    def test_upload_in_chunks(self):
+        """Test that the chunks add up to the recipe image"""
+        session_id = self.start()
+        middle = len(self.image) // 2
+
+        res = self.put_chunk(session_id, 0, middle - 1)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['received'], middle)
+        res = self.put_chunk(session_id, middle, len(self.image) - 1)
+        self.assertEqual(res.data['received'], len(self.image))
+
+        res = self.client.post(finalize_url(self.recipe.id, session_id))
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        with open(self.recipe.image.path, 'rb') as f:
+            self.assertEqual(f.read(), self.image)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_resume_after_conflict(self):
+        """Test that a chunk at the wrong offset is refused with the offset to resume from"""
+        session_id = self.start()
+        self.put_chunk(session_id, 0, 99)
+
+        res = self.put_chunk(session_id, 200, 299)
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['received'], 100)
+
+        res = self.client.get(chunk_url(self.recipe.id, session_id))
+        self.assertEqual(res.data['received'], 100)
+
+    def test_first_chunk_must_be_an_image(self):
+        """Test that a file which is not an image is rejected on its first chunk"""
+        session_id = self.start(size=100)
+        res = self.client.put(
+            chunk_url(self.recipe.id, session_id), data=b'x' * 100,
+            content_type='application/octet-stream', HTTP_CONTENT_RANGE='bytes 0-99/100'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UploadSession.objects.exists())
+        # the bytes were never written to disk
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'uploads')))
+
+    def test_finalize_incomplete_upload(self):
+        """Test that an upload can only be finalized once all bytes arrived"""
+        session_id = self.start()
+        self.put_chunk(session_id, 0, 99)
+
+        res = self.client.post(finalize_url(self.recipe.id, session_id))
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.recipe.image)
+
+    def test_invalid_start(self):
+        """Test that the size is bounded and the file name needs an extension"""
+        res = self.client.post(uploads_url(self.recipe.id), {'filename': 'photo.png', 'size': 10 ** 10})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(uploads_url(self.recipe.id), {'filename': 'photo./../x', 'size': 100})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sessions_limited_to_user(self):
+        """Test that the session of another user is not found"""
+        session_id = self.start()
+        other = get_user_model().objects.create_user('other@gmail.com', 'testpassword1234')
+        self.client.force_authenticate(other)
+
+        res = self.client.get(chunk_url(self.recipe.id, session_id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stale_sessions_expire(self):
+        """Test that old sessions are not found and are removed with their files"""
+        session_id = self.start()
+        self.put_chunk(session_id, 0, 99)
+        session = UploadSession.objects.get()
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(hours=25))
+
+        res = self.client.get(chunk_url(self.recipe.id, session_id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        call_command('expire_upload_sessions', stdout=StringIO())
+
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, session.image)))
@@ -11,6 +11,7 @@ from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
 import tempfile
 import os
+from types import SimpleNamespace
 
 from PIL import Image
 
@@ -240,6 +241,94 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(tags, 0)
         self.assertEqual(ingredients, 0)
 
+    # ------------------------------------------------ test relation validation
+    def test_create_recipe_with_foreign_ids(self):
+        """Test that unknown ids and ids of other users are reported together"""
+        user2 = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        own = sample_tag(user=self.user)
+        foreign = sample_tag(user=user2, name='Secret')
+
+        payload = {'title': 'Soup', 'tags': [own.id, foreign.id, 9999], 'time_minutes': 5, 'price': 5}
+        res = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['tags'], [f'Unknown tags: {[foreign.id, 9999]}'])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_relation_ids_validated_with_one_query(self):
+        """Test that all submitted ids of a relation are checked with a single query"""
+        ingredients = [sample_ingredient(user=self.user, name=f'ingredient {i}') for i in range(40)]
+        payload = {
+            'title': 'Stew', 'time_minutes': 60, 'price': 20, 'tags': [],
+            'ingredients': [ingredient.id for ingredient in ingredients],
+        }
+        serializer = RecipeSerializer(data=payload, context={'request': SimpleNamespace(user=self.user)})
+
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+        self.assertEqual(len(serializer.validated_data['ingredients']), 40)
+
+    def test_partial_update_with_foreign_ids(self):
+        """Test that a PATCH can not attach the tags of other users either"""
+        user2 = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        recipe = sample_recipe(user=self.user)
+        foreign = sample_tag(user=user2, name='Secret')
+
+        res = self.client.patch(detail_url(recipe.id), {'tags': [foreign.id]})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(recipe.tags.count(), 0)
+
+    # ------------------------------------------------ test sparse fieldsets
+    def test_list_recipes_with_fields(self):
+        """Test that ?fields= only returns the requested fields"""
+        recipe = sample_recipe(user=self.user, title='Kebab')
+        recipe.tags.add(sample_tag(user=self.user))
+
+        res = self.client.get(RECIPES_URL, {'fields': 'id,title,image'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(res.data[0].keys()), {'id', 'title', 'image'})
+        self.assertEqual(res.data[0]['title'], recipe.title)
+
+    def test_list_recipes_with_exclude(self):
+        """Test that ?exclude= drops the given fields"""
+        sample_recipe(user=self.user)
+
+        res = self.client.get(RECIPES_URL, {'exclude': 'tags,ingredients'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('tags', res.data[0])
+        self.assertNotIn('ingredients', res.data[0])
+        self.assertIn('title', res.data[0])
+
+    def test_sparse_fields_skip_relation_queries(self):
+        """Test that relations which were not asked for are not fetched"""
+        for i in range(3):
+            recipe = sample_recipe(user=self.user, title=f'recipe {i}')
+            recipe.tags.add(sample_tag(user=self.user, name=f'tag {i}'))
+            recipe.ingredients.add(sample_ingredient(user=self.user, name=f'ingredient {i}'))
+
+        # the tag and ingredient ids come from the recipe row, so the list is a single query
+        with self.assertNumQueries(1):
+            res = self.client.get(RECIPES_URL)
+        with self.assertNumQueries(1):
+            self.client.get(RECIPES_URL, {'fields': 'id,title'})
+
+        self.assertEqual(len(res.data[0]['tags']), 1)
+
+    def test_sparse_fields_ignored_on_update(self):
+        """Test that ?fields= does not restrict the fields of a write request"""
+        recipe = sample_recipe(user=self.user)
+
+        url = detail_url(recipe.id) + '?fields=id'
+        res = self.client.patch(url, {'title': 'Pasta'})
+
+        recipe.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(recipe.title, 'Pasta')
+        self.assertIn('title', res.data)
+
 
 # ***********************************************************************************
 class RecipeImageUploadTests(TestCase):
@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main_app.models import Recipe, Tag, Ingredient, UploadSession
+
+BULK_URL = reverse('recipe:recipe-bulk')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'sample_recipe',
+        'time_minutes': 10,
+        'price': 50
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PrivateRecipeBulkApiTests(TestCase):
+    """Test the bulk update and bulk delete recipe API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.client.force_authenticate(self.user)
+
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.dessert = Tag.objects.create(user=self.user, name='Dessert')
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+
+    def test_bulk_update_items(self):
+        """Test updating scalar fields and relation diffs of many recipes"""
+        recipe1 = sample_recipe(self.user, title='Cake')
+        recipe2 = sample_recipe(self.user, title='Soup')
+        recipe1.tags.add(self.vegan)
+
+        payload = {'items': [
+            {'id': recipe1.id, 'changes': {
+                'price': 70,
+                'tags': {'add': [self.dessert.id], 'remove': [self.vegan.id]},
+            }},
+            {'id': recipe2.id, 'changes': {
+                'title': 'Tomato soup',
+                'ingredients': {'add': [self.salt.id]},
+            }},
+        ]}
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['updated'], 2)
+        recipe1.refresh_from_db()
+        recipe2.refresh_from_db()
+        self.assertEqual(recipe1.price, 70)
+        self.assertEqual(recipe1.title, 'Cake')
+        self.assertEqual(list(recipe1.tags.all()), [self.dessert])
+        self.assertEqual(recipe2.title, 'Tomato soup')
+        self.assertEqual(list(recipe2.ingredients.all()), [self.salt])
+
+    def test_bulk_update_filter_and_patch(self):
+        """Test applying one patch to all recipes matching a filter"""
+        recipe1 = sample_recipe(self.user)
+        recipe2 = sample_recipe(self.user)
+        untouched = sample_recipe(self.user)
+        recipe1.tags.add(self.vegan)
+        recipe2.tags.add(self.vegan)
+
+        payload = {
+            'filter': {'tags': [self.vegan.id]},
+            'patch': {'price': 1, 'tags': {'add': [self.dessert.id]}},
+        }
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.data['updated'], 2)
+        for recipe in (recipe1, recipe2):
+            recipe.refresh_from_db()
+            self.assertEqual(recipe.price, 1)
+            self.assertEqual(recipe.tags.count(), 2)
+        untouched.refresh_from_db()
+        self.assertEqual(untouched.price, 50)
+
+    def test_bulk_update_is_atomic_and_limited_to_user(self):
+        """Test that a foreign recipe rejects the whole batch"""
+        user2 = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        own = sample_recipe(self.user)
+        foreign = sample_recipe(user2)
+
+        payload = {'items': [
+            {'id': own.id, 'changes': {'price': 1}},
+            {'id': foreign.id, 'changes': {'price': 1}},
+        ]}
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        own.refresh_from_db()
+        foreign.refresh_from_db()
+        self.assertEqual(own.price, 50)
+        self.assertEqual(foreign.price, 50)
+
+    def test_bulk_update_rejects_foreign_tags(self):
+        """Test that tags of other users can not be attached"""
+        user2 = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        foreign_tag = Tag.objects.create(user=user2, name='Secret')
+        recipe = sample_recipe(self.user)
+
+        payload = {'items': [
+            {'id': recipe.id, 'changes': {'tags': {'add': [foreign_tag.id]}}},
+        ]}
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(recipe.tags.count(), 0)
+
+    def test_bulk_update_query_count(self):
+        """Test that the number of queries does not grow with the number of recipes"""
+        recipes = [sample_recipe(self.user) for _ in range(20)]
+
+        payload = {'items': [
+            {'id': recipe.id, 'changes': {'price': 5, 'tags': {'add': [self.vegan.id]}}}
+            for recipe in recipes
+        ]}
+        # recipes check, tags check, current tag ids, bulk_update, bulk insert,
+        # plus the savepoint and release of the transaction
+        with self.assertNumQueries(7):
+            res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.data['updated'], 20)
+        self.assertEqual(Recipe.tags.through.objects.count(), 20)
+
+    def test_bulk_delete(self):
+        """Test deleting many recipes by id"""
+        recipe1 = sample_recipe(self.user)
+        recipe2 = sample_recipe(self.user)
+        kept = sample_recipe(self.user)
+        recipe1.tags.add(self.vegan)
+
+        res = self.client.delete(BULK_URL, {'ids': [recipe1.id, recipe2.id]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['deleted'], 2)
+        self.assertEqual(list(Recipe.objects.all()), [kept])
+        self.assertFalse(Recipe.tags.through.objects.exists())
+
+    def test_bulk_delete_with_upload_in_progress(self):
+        """Test that a recipe with an unfinished upload is deleted with the session and its file"""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        os.makedirs(os.path.join(media_root, 'uploads', 'recipe'))
+        path = os.path.join(media_root, 'uploads', 'recipe', 'partial.jpg')
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        recipe = sample_recipe(self.user)
+        UploadSession.objects.create(user=self.user, recipe=recipe, image='uploads/recipe/partial.jpg', size=100)
+
+        with override_settings(MEDIA_ROOT=media_root), self.captureOnCommitCallbacks(execute=True):
+            res = self.client.delete(BULK_URL, {'ids': [recipe.id]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_bulk_delete_by_filter_limited_to_user(self):
+        """Test that a filtered delete only removes the user's recipes"""
+        user2 = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        foreign = sample_recipe(user2)
+        sample_recipe(self.user)
+
+        res = self.client.delete(BULK_URL, {'filter': {'ids': [foreign.id]}}, format='json')
+
+        self.assertEqual(res.data['deleted'], 0)
+        self.assertTrue(Recipe.objects.filter(id=foreign.id).exists())
+
+    def test_bulk_update_duplicate_ids_rejected(self):
+        """Test that a recipe listed twice in items is rejected and left as it was"""
+        recipe = sample_recipe(self.user)
+        payload = {'items': [
+            {'id': recipe.id, 'changes': {'tags': {'add': [self.vegan.id]}}},
+            {'id': recipe.id, 'changes': {'tags': {'add': [self.dessert.id]}}},
+        ]}
+
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('items', res.data)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.tag_ids, [])
+        self.assertFalse(recipe.tags.exists())
+
+    def test_bulk_invalid_payload(self):
+        """Test that a payload with both items and filter is rejected"""
+        payload = {'items': [], 'filter': {'ids': [1]}, 'patch': {'price': 1}}
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,227 @@
+import numpy as np
+
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main_app.models import Recipe, Tag, Ingredient
+from main_app.signals import refresh_relation_ids
+
+from recipe import similarity
+from recipe.index_cache import UserIndexCache
+
+
+def similar_url(recipe_id):
+    """Return the similar recipes URL of a recipe"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def sample_recipe(user, tags=(), ingredients=(), **params):
+    """Create and return a sample recipe with the given tags and ingredients"""
+    defaults = {
+        'title': 'sample_recipe',
+        'time_minutes': 10,
+        'price': 50
+    }
+    defaults.update(params)
+
+    recipe = Recipe.objects.create(user=user, **defaults)
+    recipe.tags.add(*tags)
+    recipe.ingredients.add(*ingredients)
+    return recipe
+
+
+@override_settings(RECIPE_SIMILARITY_BACKGROUND=False)
+class SimilarRecipesApiTests(TestCase):
+    """Test the similar recipes API"""
+
+    def setUp(self):
+        # the indexes live in memory, outside the test transaction
+        similarity.indexes.clear()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.client.force_authenticate(self.user)
+
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.dessert = Tag.objects.create(user=self.user, name='Dessert')
+        self.sugar = Ingredient.objects.create(user=self.user, name='Sugar')
+        self.flour = Ingredient.objects.create(user=self.user, name='Flour')
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+
+    def test_similar_recipes_ranked(self):
+        """Test that recipes sharing more features rank first"""
+        cake = sample_recipe(self.user, [self.dessert], [self.sugar, self.flour], title='Cake')
+        cookie = sample_recipe(self.user, [self.dessert], [self.sugar, self.flour], title='Cookie')
+        candy = sample_recipe(self.user, [self.dessert], [self.sugar], title='Candy')
+        sample_recipe(self.user, [self.vegan], [self.salt], title='Chips')
+
+        res = self.client.get(similar_url(cake.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in res.data], [cookie.id, candy.id])
+        self.assertAlmostEqual(res.data[0]['similarity'], 1.0)
+        self.assertLess(res.data[1]['similarity'], res.data[0]['similarity'])
+
+    def test_similar_recipes_limited_to_user(self):
+        """Test that recipes of other users are never suggested"""
+        user2 = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        recipe = sample_recipe(self.user, [self.vegan])
+        sample_recipe(user2, [self.vegan])
+
+        res = self.client.get(similar_url(recipe.id))
+        self.assertEqual(res.data, [])
+
+        foreign = Recipe.objects.get(user=user2)
+        res = self.client.get(similar_url(foreign.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_similar_recipes_k(self):
+        """Test that ?k= limits the number of results"""
+        recipe = sample_recipe(self.user, [self.vegan])
+        for i in range(5):
+            sample_recipe(self.user, [self.vegan], title=f'recipe {i}')
+
+        res = self.client.get(similar_url(recipe.id), {'k': 2})
+
+        self.assertEqual(len(res.data), 2)
+
+    def test_index_updated_on_relation_change(self):
+        """Test that the loaded index follows tag and ingredient changes"""
+        cake = sample_recipe(self.user, [self.dessert], [self.sugar])
+        soup = sample_recipe(self.user, [self.vegan], [self.salt])
+
+        res = self.client.get(similar_url(cake.id))
+        self.assertEqual(res.data, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            soup.tags.add(self.dessert)
+
+        res = self.client.get(similar_url(cake.id))
+        self.assertEqual([item['id'] for item in res.data], [soup.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            soup.delete()
+
+        res = self.client.get(similar_url(cake.id))
+        self.assertEqual(res.data, [])
+
+
+    def test_index_rebuilt_after_change_in_other_process(self):
+        """Test that a change made and invalidated by another process, e.g. an import, is seen"""
+        cake = sample_recipe(self.user, [self.dessert], [self.sugar])
+        soup = sample_recipe(self.user, [self.vegan], [self.salt])
+        self.assertEqual(self.client.get(similar_url(cake.id)).data, [])
+
+        # the other process writes without the signals of this one, and invalidates its own cache
+        Recipe.tags.through.objects.bulk_create([Recipe.tags.through(recipe=soup, tag=self.dessert)])
+        refresh_relation_ids([soup.id])
+        UserIndexCache(similarity.build_index, lambda: 1024, name='similarity').invalidate(self.user.id)
+
+        res = self.client.get(similar_url(cake.id))
+        self.assertEqual([item['id'] for item in res.data], [soup.id])
+
+class SimilarityIndexTests(TestCase):
+    """Test the in-memory similarity matrix"""
+
+    def test_pending_changes_used_before_rebuild(self):
+        """Test that a changed recipe is queried with its new features right away"""
+        # recipes 1 and 2 share tag 10, recipe 3 has tag 11
+        tag_pairs = (np.array([1, 2, 3]), np.array([10, 10, 11]))
+        index = similarity.SimilarityIndex(
+            1, similarity.Matrix(tag_pairs, (similarity.EMPTY, similarity.EMPTY))
+        )
+        self.assertEqual([r for r, _ in index.similar(1)], [2])
+
+        index.pending[1] = ([11], [])
+        self.assertEqual([r for r, _ in index.similar(1)], [3])
+
+    def test_cache_evicts_least_recently_used(self):
+        """Test that the cache stays under its memory budget"""
+        class Index:
+            nbytes = 10
+
+        cache = UserIndexCache(lambda user_id: Index(), lambda: 25)
+        first = cache.get(1)
+        cache.get(2)
+        self.assertIs(cache.get(1), first)  # 1 is now the most recently used
+        cache.get(3)
+
+        self.assertIsNotNone(cache.peek(1))
+        self.assertIsNone(cache.peek(2))
+        self.assertIsNotNone(cache.peek(3))
+
+    def test_cache_drops_build_invalidated_meanwhile(self):
+        """Test that an index invalidated while it is being built is not stored"""
+        class Index:
+            nbytes = 10
+
+        builds = []
+
+        def build(user_id):
+            builds.append(user_id)
+            if len(builds) == 1:
+                cache.invalidate(user_id)  # the catalog changed while the index was read
+            return Index()
+
+        cache = UserIndexCache(build, lambda: 100)
+        self.assertIsNotNone(cache.get(1))
+        self.assertIsNone(cache.peek(1))
+
+        index = cache.get(1)
+        self.assertIs(cache.peek(1), index)
+        self.assertEqual(builds, [1, 1])
+
+    def test_cache_drops_build_changed_meanwhile(self):
+        """Test that an index that missed an in-place update during its build is not stored"""
+        class Index:
+            nbytes = 10
+
+        def build(user_id):
+            self.assertIsNone(cache.changed(user_id))  # nothing loaded to update yet
+            return Index()
+
+        cache = UserIndexCache(build, lambda: 100)
+        cache.get(1)
+        self.assertIsNone(cache.peek(1))
+
+    def test_cache_sees_changes_of_other_processes(self):
+        """Test that an index invalidated or changed in another process is rebuilt"""
+        class Index:
+            nbytes = 10
+
+        builds = []
+
+        def build(user_id):
+            builds.append(user_id)
+            return Index()
+
+        # two workers with a cache of the same name, sharing the generations
+        worker, command = (UserIndexCache(build, lambda: 100, name='shared-test') for _ in range(2))
+        first = worker.get(1)
+        self.assertIs(worker.get(1), first)
+
+        command.invalidate(1)
+        second = worker.get(1)
+        self.assertIsNot(second, first)
+
+        other = command.get(1)
+        self.assertIs(command.changed(1), other)  # updated in place, still current here
+        self.assertIs(command.get(1), other)
+        self.assertIsNot(worker.get(1), second)
+        self.assertEqual(len(builds), 4)
+
+    def test_cache_rebuilds_old_index(self):
+        """Test that an index older than RECIPE_INDEX_MAX_AGE_SECONDS is rebuilt"""
+        class Index:
+            nbytes = 10
+
+        cache = UserIndexCache(lambda user_id: Index(), lambda: 100, name='age-test')
+        first = cache.get(1)
+        self.assertIs(cache.get(1), first)
+
+        with override_settings(RECIPE_INDEX_MAX_AGE_SECONDS=0):
+            self.assertIsNot(cache.get(1), first)
@@ -0,0 +1,200 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core import signing
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main_app.models import Recipe, Tag, Ingredient, Tombstone
+from recipe.views import SyncView
+
+SYNC_URL = reverse('recipe:sync')
+BULK_URL = reverse('recipe:recipe-bulk')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'sample_recipe',
+        'time_minutes': 10,
+        'price': 50
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+@override_settings(RECIPE_SYNC_OVERLAP_SECONDS=0)
+class SyncApiTests(TestCase):
+    """Test the delta sync API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.client.force_authenticate(self.user)
+
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        self.recipe = sample_recipe(self.user, title='Salad')
+        self.other = sample_recipe(self.user, title='Soup')
+
+    def ids(self, items):
+        return sorted(item['id'] for item in items)
+
+    def pages(self, token=None):
+        """Return the pages of one sync"""
+        pages = [self.client.get(SYNC_URL, {'since': token} if token else {}).data]
+        while pages[-1]['has_more']:
+            pages.append(self.client.get(SYNC_URL, {'since': pages[-1]['token']}).data)
+        return pages
+
+    def test_full_sync(self):
+        """Test that a sync without token returns everything of the user"""
+        get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+
+        res = self.client.get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ids(res.data['recipes']), [self.recipe.id, self.other.id])
+        self.assertEqual(self.ids(res.data['tags']), [self.tag.id])
+        self.assertEqual(self.ids(res.data['ingredients']), [self.ingredient.id])
+        self.assertTrue(res.data['token'])
+        self.assertTrue(res.data['full'])
+        self.assertFalse(res.data['has_more'])
+
+    def test_image_urls_absolute(self):
+        """Test that the sync returns the same absolute image URLs as the recipe endpoints"""
+        Recipe.objects.filter(pk=self.recipe.pk).update(image='uploads/recipe/salad.jpg')
+
+        res = self.client.get(SYNC_URL)
+
+        images = {item['id']: item['image'] for item in res.data['recipes']}
+        self.assertEqual(images[self.recipe.id], 'http://testserver/media/uploads/recipe/salad.jpg')
+
+    def test_delta_sync(self):
+        """Test that only what changed since the token is returned"""
+        token = self.client.get(SYNC_URL).data['token']
+
+        self.recipe.title = 'Green salad'
+        self.recipe.save()
+        new_tag = Tag.objects.create(user=self.user, name='Quick')
+        ingredient_id = self.ingredient.id
+        self.ingredient.delete()
+
+        res = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(self.ids(res.data['recipes']), [self.recipe.id])
+        self.assertEqual(self.ids(res.data['tags']), [new_tag.id])
+        self.assertEqual(res.data['ingredients'], [])
+        self.assertEqual(res.data['deleted']['ingredients'], [ingredient_id])
+        self.assertFalse(res.data['full'])
+
+        res = self.client.get(SYNC_URL, {'since': res.data['token']})
+        self.assertEqual(res.data['recipes'], [])
+        self.assertEqual(res.data['deleted']['ingredients'], [])
+
+    def test_relation_changes_bump_recipe(self):
+        """Test that adding a tag, or deleting a tag in use, marks the recipe changed"""
+        token = self.client.get(SYNC_URL).data['token']
+        self.recipe.tags.add(self.tag)
+
+        res = self.client.get(SYNC_URL, {'since': token})
+        self.assertEqual(self.ids(res.data['recipes']), [self.recipe.id])
+
+        token = res.data['token']
+        tag_id = self.tag.id
+        self.tag.delete()
+
+        res = self.client.get(SYNC_URL, {'since': token})
+        self.assertEqual(self.ids(res.data['recipes']), [self.recipe.id])
+        self.assertEqual(res.data['recipes'][0]['tags'], [])
+        self.assertEqual(res.data['deleted']['tags'], [tag_id])
+
+    def test_bulk_writes_are_synced(self):
+        """Test that bulk updates bump updated_at and bulk deletes leave tombstones"""
+        token = self.client.get(SYNC_URL).data['token']
+
+        self.client.patch(BULK_URL, {'items': [
+            {'id': self.recipe.id, 'changes': {'tags': {'add': [self.tag.id]}}},
+        ]}, format='json')
+        self.client.delete(BULK_URL, {'ids': [self.other.id]}, format='json')
+
+        res = self.client.get(SYNC_URL, {'since': token})
+        self.assertEqual(self.ids(res.data['recipes']), [self.recipe.id])
+        self.assertEqual(res.data['deleted']['recipes'], [self.other.id])
+
+    def test_deletes_of_other_users_hidden(self):
+        """Test that tombstones of other users are not returned"""
+        token = self.client.get(SYNC_URL).data['token']
+        user2 = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        sample_recipe(user2).delete()
+
+        res = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(res.data['deleted']['recipes'], [])
+
+    def test_user_delete_clears_tombstones(self):
+        """Test that deleting a user removes the tombstones of their catalog"""
+        self.user.delete()
+
+        self.assertFalse(Tombstone.objects.exists())
+
+    def test_invalid_token(self):
+        """Test that a tampered token is rejected"""
+        res = self.client.get(SYNC_URL, {'since': 'not-a-token'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(RECIPE_SYNC_PAGE_SIZE=2)
+    def test_pages(self):
+        """Test that a sync is split into pages of at most the page size, continued by their tokens"""
+        pages = self.pages()
+        self.assertEqual(len(pages), 2)
+        token = pages[-1]['token']
+        stew = sample_recipe(self.user, title='Stew')
+        quick = Tag.objects.create(user=self.user, name='Quick')
+        recipe_id, ingredient_id = self.recipe.id, self.ingredient.id
+        self.recipe.delete()
+        self.ingredient.delete()
+
+        pages = self.pages(token)
+
+        self.assertEqual(len(pages), 2)
+        for page in pages:
+            deleted = sum(len(ids) for ids in page['deleted'].values())
+            self.assertLessEqual(len(page['recipes']) + len(page['tags']) + len(page['ingredients']) + deleted, 2)
+        self.assertEqual(self.ids(item for page in pages for item in page['recipes']), [stew.id])
+        self.assertEqual(self.ids(item for page in pages for item in page['tags']), [quick.id])
+        self.assertEqual([object_id for page in pages for object_id in page['deleted']['recipes']], [recipe_id])
+        self.assertEqual([object_id for page in pages for object_id in page['deleted']['ingredients']], [ingredient_id])
+
+        res = self.client.get(SYNC_URL, {'since': pages[-1]['token']})
+        self.assertEqual(res.data['recipes'] + res.data['tags'], [])
+        self.assertEqual(res.data['deleted']['recipes'], [])
+
+    def test_old_token_full_sync(self):
+        """Test that a token older than the tombstones are kept gets everything again"""
+        since = timezone.now() - timedelta(days=31)
+        token = signing.dumps(since.isoformat(), salt=SyncView.token_salt)
+
+        res = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertTrue(res.data['full'])
+        self.assertEqual(self.ids(res.data['recipes']), [self.recipe.id, self.other.id])
+
+    def test_prune_tombstones(self):
+        """Test that the tombstones older than the oldest sync token are deleted"""
+        recipe_id, other_id = self.recipe.id, self.other.id
+        self.recipe.delete()
+        self.other.delete()
+        Tombstone.objects.filter(object_id=recipe_id).update(deleted_at=timezone.now() - timedelta(days=31))
+
+        call_command('prune_tombstones', stdout=StringIO())
+
+        self.assertEqual(list(Tombstone.objects.values_list('object_id', flat=True)), [other_id])
@@ -0,0 +1,117 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main_app.models import Recipe, Tag, Ingredient
+
+from recipe import typeahead
+from recipe.index_cache import UserIndexCache, typeahead_indexes
+
+TAGS_URL = reverse('recipe:tag-list')
+INGREDIENTS_URL = reverse('recipe:ingredient-list')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'sample_recipe',
+        'time_minutes': 10,
+        'price': 50
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class TypeaheadApiTests(TestCase):
+    """Test the ?prefix= typeahead of tags and ingredients"""
+
+    def setUp(self):
+        # the indexes live in memory, outside the test transaction
+        typeahead_indexes.clear()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.client.force_authenticate(self.user)
+
+    def names(self, url, prefix, **params):
+        res = self.client.get(url, {'prefix': prefix, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in res.data]
+
+    def test_prefix_matches_case_insensitive(self):
+        """Test that only names starting with the prefix are returned, in any case"""
+        for name in ('Salt', 'salmon', 'Sugar', 'Basil'):
+            Ingredient.objects.create(user=self.user, name=name)
+
+        self.assertEqual(self.names(INGREDIENTS_URL, 'SAL'), ['salmon', 'Salt'])
+        self.assertEqual(self.names(INGREDIENTS_URL, 'x'), [])
+
+    def test_popular_names_first(self):
+        """Test that names used by more recipes rank first, then alphabetically"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        vegetarian = Tag.objects.create(user=self.user, name='Vegetarian')
+        Tag.objects.create(user=self.user, name='Veal')
+        for _ in range(2):
+            sample_recipe(self.user).tags.add(vegetarian)
+        sample_recipe(self.user).tags.add(vegan)
+
+        self.assertEqual(self.names(TAGS_URL, 've'), ['Vegetarian', 'Vegan', 'Veal'])
+        self.assertEqual(self.names(TAGS_URL, 've', limit=1), ['Vegetarian'])
+
+    def test_limited_to_user(self):
+        """Test that the names of other users are not suggested"""
+        user2 = get_user_model().objects.create_user('other@gmail.com', 'testpass123')
+        Tag.objects.create(user=user2, name='Secret')
+
+        self.assertEqual(self.names(TAGS_URL, 'se'), [])
+
+    def test_index_kept_current(self):
+        """Test that new, renamed, deleted and newly used names show up without a rebuild"""
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self.assertEqual(self.names(INGREDIENTS_URL, 's'), ['Salt'])
+        index = typeahead_indexes.peek(self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sugar = Ingredient.objects.create(user=self.user, name='Sugar')
+            sample_recipe(self.user).ingredients.add(sugar)
+        self.assertEqual(self.names(INGREDIENTS_URL, 's'), ['Sugar', 'Salt'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            salt.name = 'Pepper'
+            salt.save()
+        self.assertEqual(self.names(INGREDIENTS_URL, 's'), ['Sugar'])
+        self.assertEqual(self.names(INGREDIENTS_URL, 'pe'), ['Pepper'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sugar.delete()
+        self.assertEqual(self.names(INGREDIENTS_URL, 's'), [])
+        # the same index was updated in place
+        self.assertIs(typeahead_indexes.peek(self.user.pk), index)
+
+    def test_index_rebuilt_after_change_in_other_process(self):
+        """Test that a name added through another worker shows up here too"""
+        Ingredient.objects.create(user=self.user, name='Salt')
+        self.assertEqual(self.names(INGREDIENTS_URL, 's'), ['Salt'])
+
+        # the other worker updates its own index in place, this one only learns of it from the generation
+        Ingredient.objects.bulk_create([Ingredient(user=self.user, name='Sugar')])
+        UserIndexCache(typeahead.build_index, lambda: 1024, name='typeahead').changed(self.user.pk)
+
+        self.assertEqual(self.names(INGREDIENTS_URL, 's'), ['Salt', 'Sugar'])
+
+    def test_answered_from_memory(self):
+        """Test that a loaded index answers without queries"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        self.names(TAGS_URL, 'v')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(TAGS_URL, 'v'), ['Vegan'])
+
+    def test_invalid_limit(self):
+        """Test that a limit that is not a number is rejected"""
+        res = self.client.get(TAGS_URL, {'prefix': 'a', 'limit': 'x'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,111 @@
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from main_app.models import Recipe
+
+from recipe import view_counts
+from recipe.view_counts import view_counter
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'sample_recipe',
+        'time_minutes': 10,
+        'price': 50
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeViewCountTests(TestCase):
+    """Test the buffered view counts and the popularity ordering"""
+
+    def setUp(self):
+        # the buffer lives in memory, outside the test transaction
+        view_counter.clear()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('sample@gmail.com', 'testpassword1234')
+        self.client.force_authenticate(self.user)
+
+    def view_counts(self):
+        return dict(Recipe.objects.values_list('title', 'view_count'))
+
+    def test_views_buffered_until_flush(self):
+        """Test that retrieving a recipe counts the view in memory, and the flush writes it"""
+        recipe = sample_recipe(self.user, title='Soup')
+        for _ in range(3):
+            res = self.client.get(detail_url(recipe.id))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.view_counts(), {'Soup': 0})
+        self.assertEqual(view_counter.flush(), 3)
+        self.assertEqual(self.view_counts(), {'Soup': 3})
+        self.assertEqual(view_counter.flush(), 0)
+
+    def test_flush_batches(self):
+        """Test that one UPDATE adds the views of a batch of recipes"""
+        recipes = [sample_recipe(self.user, title=f'recipe {i}') for i in range(5)]
+        for i, recipe in enumerate(recipes):
+            for _ in range(i % 3):
+                view_counter.add(recipe)
+
+        with self.assertNumQueries(1):
+            view_counter.flush()
+        self.assertEqual(list(Recipe.objects.order_by('id').values_list('view_count', flat=True)), [0, 1, 2, 0, 1])
+
+        for recipe in recipes:
+            view_counter.add(recipe)
+        with self.settings(RECIPE_VIEW_COUNTS={'FLUSH_BATCH_SIZE': 2}), self.assertNumQueries(3):
+            view_counter.flush()
+
+    def test_failed_flush_keeps_views(self):
+        """Test that the views of a failed flush are written by the next one"""
+        recipe = sample_recipe(self.user, title='Soup')
+        view_counter.add(recipe)
+
+        with patch.object(view_counts, 'write', side_effect=RuntimeError), self.assertLogs(view_counts.logger):
+            self.assertEqual(view_counter.flush(), 0)
+        view_counter.add(recipe)
+
+        self.assertEqual(view_counter.flush(), 2)
+        self.assertEqual(self.view_counts(), {'Soup': 2})
+
+    @override_settings(RECIPE_VIEW_COUNTS={'MAX_PENDING': 2})
+    def test_flush_when_due(self):
+        """Test that a finished request flushes once enough views wait, but never inside a transaction"""
+        recipe = sample_recipe(self.user, title='Soup')
+        view_counter.add(recipe)
+        view_counter.add(recipe)
+        self.assertTrue(view_counter.due(view_counts.get_config()))
+
+        # the test case runs in a transaction
+        view_counts.flush_if_due()
+        self.assertEqual(view_counter.pending_views, 2)
+
+        with patch.object(view_counter, 'aliases', return_value=set()):
+            view_counts.flush_if_due()
+        self.assertEqual(self.view_counts(), {'Soup': 2})
+
+    def test_ordering_by_popularity(self):
+        """Test that ?ordering=-popularity lists the most viewed recipes first"""
+        for title, views in (('Soup', 3), ('Bread', 10), ('Salad', 0)):
+            sample_recipe(self.user, title=title, view_count=views)
+
+        res = self.client.get(RECIPES_URL, {'ordering': '-popularity'})
+
+        self.assertEqual([item['title'] for item in res.data], ['Bread', 'Soup', 'Salad'])
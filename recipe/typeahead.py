@@ -0,0 +1,129 @@
+"""
+Typeahead over the tag and ingredient names of a user (?prefix= on their list endpoints).
+
+every user gets a NameIndex per kind: the casefolded names with their ids in sorted
+order, so the names starting with a prefix are a range found with two bisects, and
+the number of recipes using each name, which ranks the matches. an index is loaded
+with one query for the names, in the order of the (user, lower(name)) index, and one
+for the counts, and the receivers in recipe/signals.py keep it current.
+"""
+import bisect
+import heapq
+import threading
+
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+from main_app.models import Tag, Ingredient, Recipe
+from main_app.sharding import use_shard_of
+from .index_cache import typeahead_indexes
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# estimated bytes of one name besides its characters: the list slot, the tuple and the dict items
+ENTRY_OVERHEAD = 200
+# sorts after every character a name can continue with
+LAST_CHARACTER = '\U0010ffff'
+
+# model -> (through model, its column pointing at the model)
+RELATIONS = {
+    Tag: (Recipe.tags.through, 'tag'),
+    Ingredient: (Recipe.ingredients.through, 'ingredient'),
+}
+
+
+def normalize(name):
+    return name.casefold()
+
+
+class NameIndex:
+    """The names of the tags or the ingredients of one user"""
+
+    def __init__(self, rows, popularity):
+        self.names = dict(rows)  # id -> name
+        # (normalized name, id), the rows come in lower(name) order, which is nearly sorted already
+        self.entries = sorted((normalize(name), pk) for pk, name in self.names.items())
+        self.popularity = popularity  # id -> number of recipes, names without recipes are missing
+        self.chars = sum(len(name) for name in self.names.values())
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, model, user_id):
+        through, column = RELATIONS[model]
+        rows = model.objects.filter(user_id=user_id).order_by(Lower('name')).values_list('id', 'name')
+        popularity = through.objects.filter(**{column + '__user_id': user_id}).values(column).annotate(
+            recipes=Count('id')
+        ).values_list(column, 'recipes')
+        return cls(list(rows), dict(popularity))
+
+    @property
+    def nbytes(self):
+        return len(self.entries) * ENTRY_OVERHEAD + self.chars * 2
+
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        """Return up to limit (id, name) pairs starting with prefix, the most used first"""
+        prefix = normalize(prefix)
+        with self._lock:
+            start = bisect.bisect_left(self.entries, (prefix,))
+            end = bisect.bisect_left(self.entries, (prefix + LAST_CHARACTER,), lo=start)
+            popularity, entries = self.popularity, self.entries
+            best = heapq.nsmallest(
+                limit, range(start, end), key=lambda i: (-popularity.get(entries[i][1], 0), entries[i])
+            )
+            return [(entries[i][1], self.names[entries[i][1]]) for i in best]
+
+    def save(self, pk, name):
+        """Add a new name, or move a renamed one"""
+        with self._lock:
+            self._remove(pk)
+            self.names[pk] = name
+            self.chars += len(name)
+            bisect.insort(self.entries, (normalize(name), pk))
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+            self.popularity.pop(pk, None)
+
+    def _remove(self, pk):
+        name = self.names.pop(pk, None)
+        if name is None:
+            return
+        self.chars -= len(name)
+        position = bisect.bisect_left(self.entries, (normalize(name), pk))
+        del self.entries[position]
+
+    def add_uses(self, pks, count):
+        """Count recipes that started (count > 0) or stopped (count < 0) using the names"""
+        with self._lock:
+            for pk in pks:
+                self.popularity[pk] = max(self.popularity.get(pk, 0) + count, 0)
+
+
+class TypeaheadIndex:
+    """The tag and ingredient names of one user"""
+
+    def __init__(self, kinds):
+        self.kinds = kinds  # model -> NameIndex
+
+    @classmethod
+    def build(cls, user_id):
+        return cls({model: NameIndex.build(model, user_id) for model in RELATIONS})
+
+    @property
+    def nbytes(self):
+        return sum(index.nbytes for index in self.kinds.values())
+
+    def __getitem__(self, model):
+        return self.kinds[model]
+
+
+def build_index(user_id):
+    """Build the index of the user, called by typeahead_indexes on a cache miss"""
+    with use_shard_of(user_id):
+        return TypeaheadIndex.build(user_id)
+
+
+def search(model, user_id, prefix, limit=DEFAULT_LIMIT):
+    """Return the tags or ingredients of the user starting with prefix as (id, name) pairs"""
+    return typeahead_indexes.get(user_id)[model].search(prefix, limit)
@@ -0,0 +1,158 @@
+"""
+Resumable recipe image uploads.
+
+a client creates an upload session with the size of the image, PUTs the bytes in
+chunks with a Content-Range header, and finalizes the session once all of them
+arrived. the chunks are streamed straight into the final file, so nothing is
+buffered in memory or in temporary files, and a dropped connection only loses
+the chunk in flight: GET on the session tells the client where to resume.
+"""
+import io
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from main_app import sharding
+from main_app.models import UploadSession
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+# the formats recipe images are accepted in, as named by Pillow
+IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+READ_SIZE = 64 * 1024
+
+
+class ChunkConflict(Exception):
+    """The chunk does not start where the session stands, carries the current offset"""
+
+    def __init__(self, offset):
+        super().__init__(offset)
+        self.offset = offset
+
+
+def active_sessions(using=None):
+    cutoff = timezone.now() - timedelta(hours=settings.RECIPE_UPLOAD_SESSION_HOURS)
+    return UploadSession.objects.db_manager(using).filter(updated_at__gte=cutoff)
+
+
+def file_path(session):
+    return os.path.join(settings.MEDIA_ROOT, session.image)
+
+
+def parse_content_range(header, size):
+    """Return (start, length) of a 'bytes start-end/total' header, checked against the session size"""
+    match = CONTENT_RANGE.match(header or '')
+    if not match:
+        raise ValidationError({'content_range': 'Expected a "bytes start-end/total" Content-Range header.'})
+    start, end, total = (int(group) for group in match.groups())
+    if total != size:
+        raise ValidationError({'content_range': f'The total must be the size of the upload, {size}.'})
+    if end < start or end >= total:
+        raise ValidationError({'content_range': 'The range is outside of the upload.'})
+    length = end - start + 1
+    if length > settings.RECIPE_UPLOAD_MAX_CHUNK_BYTES:
+        raise ValidationError({'content_range': 'The chunk is too large.'})
+    return start, length
+
+
+def check_image_header(head):
+    """Reject a file whose first chunk is not an image we accept, before more of it is stored"""
+    from PIL import Image, UnidentifiedImageError  # only loaded once an upload starts
+
+    try:
+        # Image.open only parses the header, the pixel data can still be missing
+        image_format = Image.open(io.BytesIO(head)).format
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        image_format = None
+    if image_format not in IMAGE_FORMATS:
+        raise ValidationError({'image': 'Upload a valid image. The file is not a supported image.'})
+
+
+def write_chunk(session, stream, start, length):
+    """Append one chunk from the request stream to the file of the session"""
+    if start != session.received:
+        raise ChunkConflict(session.received)
+
+    data = stream.read(min(READ_SIZE, length))
+    if start == 0:
+        try:
+            check_image_header(data)
+        except ValidationError:
+            discard(session)
+            raise
+
+    path = file_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    with open(path, 'r+b' if start else 'wb') as f:
+        f.seek(start)
+        try:
+            while data:
+                f.write(data)
+                written += len(data)
+                # an empty read means the client went away, we keep what arrived
+                data = stream.read(min(READ_SIZE, length - written)) if written < length else b''
+        finally:
+            # drop anything an earlier, broken attempt left after this chunk
+            f.truncate()
+            # only the request that still sees the offset it started from moves it on
+            updated = UploadSession.objects.filter(pk=session.pk, received=start).update(
+                received=start + written, updated_at=timezone.now()
+            )
+
+    if not updated:
+        session.refresh_from_db(fields=['received'])
+        raise ChunkConflict(session.received)
+    session.received = start + written
+    if written < length:
+        raise ValidationError({'content_range': f'Only {written} of {length} bytes arrived.'})
+
+
+def finalize(session):
+    """Check the complete file and make it the image of the recipe"""
+    if session.received != session.size:
+        raise ValidationError({'image': f'Only {session.received} of {session.size} bytes were uploaded.'})
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(file_path(session)) as image:
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        discard(session)
+        raise ValidationError({'image': 'Upload a valid image. The file is corrupted.'})
+
+    recipe = session.recipe
+    recipe.image.name = session.image
+    recipe.save(update_fields=['image', 'updated_at'])
+    session.delete()
+    return recipe
+
+
+def remove_partial_files(names):
+    """Remove the files of sessions that are gone, the ones never written to do not exist"""
+    for name in names:
+        try:
+            os.remove(os.path.join(settings.MEDIA_ROOT, name))
+        except FileNotFoundError:
+            pass
+
+
+def discard(session):
+    """Delete a session together with its partial file"""
+    remove_partial_files([session.image])
+    session.delete()
+
+
+def expire_sessions():
+    """Discard the sessions that were not written to in time, return how many"""
+    count = 0
+    # runs outside of a request, so no shard is active: every shard is expired in turn
+    for alias in sharding.catalog_databases():
+        stale = UploadSession.objects.using(alias).exclude(pk__in=active_sessions(alias).values('pk'))
+        for session in stale.iterator():
+            discard(session)
+            count += 1
+    return count
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .views import TagViewSet, IngredientViewSet, RecipeViewSet
+from .views import TagViewSet, IngredientViewSet, RecipeViewSet, SyncView, MealPlanView
 
 # Default router is a feature of DRF that will automatically generate urls for our ViewSet.
 # so when you have ViewSet you may have multiple urls associated with that One ViewSet.
@@ -13,5 +13,7 @@ router.register('recipes', RecipeViewSet)
 app_name = 'recipe'
 
 urlpatterns = [
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('plan/', MealPlanView.as_view(), name='plan'),
     path('', include(router.urls))
 ]
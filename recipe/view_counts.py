@@ -0,0 +1,143 @@
+"""
+View counts of the recipes, the popularity of ?ordering=-popularity.
+
+RecipeViewSet.retrieve only counts the view in memory. once MAX_PENDING views are
+waiting, or FLUSH_SECONDS passed since the last flush, the next request of the
+process that finishes (request_finished, after its response went out) adds them to
+Recipe.view_count, with one statement per database and FLUSH_BATCH_SIZE recipes,
+the recipes with the same number of new views sharing a WHEN:
+
+    UPDATE recipe SET view_count = view_count + CASE WHEN id IN (4, 9) THEN 1
+                                                      WHEN id IN (7) THEN 3 ELSE 0 END
+    WHERE id IN (4, 7, 9)
+
+the increments are relative, so the processes never overwrite each other's counts,
+and the update does not touch updated_at, views are not changes for the delta sync.
+
+views not flushed yet are lost when the process is killed: at most MAX_PENDING views
+per process, plus the ones counted while a flush is running. a normal exit flushes
+them (atexit), and the batches of a flush that fails are kept for the next one.
+the views are kept with the name of their database, and dropped when the alias points
+at another database by the time they are flushed, as it does after the test runner
+destroyed its test databases.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connections, models
+from django.db.models import Case, F, Value, When
+
+from main_app.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_SECONDS': 5,
+    'MAX_PENDING': 1000,
+    'FLUSH_BATCH_SIZE': 500,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'RECIPE_VIEW_COUNTS', {})}
+
+
+def database_name(alias):
+    return str(connections[alias].settings_dict['NAME'])
+
+
+def write(alias, counts):
+    """Add {recipe id: views} to the view counts in the database alias, with one UPDATE"""
+    by_views = defaultdict(list)
+    for pk, views in counts.items():
+        by_views[views].append(pk)
+    increment = Case(
+        *(When(pk__in=pks, then=Value(views)) for views, pks in by_views.items()),
+        default=Value(0), output_field=models.PositiveBigIntegerField()
+    )
+    Recipe.objects.using(alias).filter(pk__in=list(counts)).update(view_count=F('view_count') + increment)
+
+
+class ViewCounter:
+    """The views of the process that are not in the database yet"""
+
+    def __init__(self):
+        self.pending = Counter()  # (database alias, database name, recipe id) -> views
+        self.pending_views = 0
+        self.flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time
+
+    def add(self, recipe):
+        with self._lock:
+            alias = recipe._state.db
+            self.pending[(alias, database_name(alias), recipe.pk)] += 1
+            self.pending_views += 1
+
+    def due(self, config):
+        return self.pending_views and (
+            self.pending_views >= config['MAX_PENDING']
+            or time.monotonic() - self.flushed_at >= config['FLUSH_SECONDS']
+        )
+
+    def flush(self):
+        """Write the pending views, returns how many were written"""
+        # a thread finding another one flushing leaves the views to it, or the next flush
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                pending, self.pending = self.pending, Counter()
+                self.pending_views = 0
+                self.flushed_at = time.monotonic()
+            batch_size = get_config()['FLUSH_BATCH_SIZE']
+            batches = defaultdict(dict)  # (alias, database name, batch number) -> {recipe id: views}
+            for i, ((alias, name, pk), views) in enumerate(sorted(pending.items())):
+                batches[(alias, name, i // batch_size)][pk] = views
+
+            written = 0
+            for (alias, name, _), counts in batches.items():
+                if database_name(alias) != name:
+                    continue
+                try:
+                    write(alias, counts)
+                    written += sum(counts.values())
+                except Exception:
+                    logger.exception('Could not write the views of %s recipes', len(counts))
+                    self.restore(alias, name, counts)
+            return written
+        finally:
+            self._flush_lock.release()
+
+    def aliases(self):
+        with self._lock:
+            return {alias for alias, _, _ in self.pending}
+
+    def clear(self):
+        with self._lock:
+            self.pending.clear()
+            self.pending_views = 0
+
+    def restore(self, alias, name, counts):
+        with self._lock:
+            for pk, views in counts.items():
+                self.pending[(alias, name, pk)] += views
+                self.pending_views += views
+
+
+view_counter = ViewCounter()
+atexit.register(view_counter.flush)
+
+
+def flush_if_due(**kwargs):
+    """request_finished receiver, connected in recipe/apps.py"""
+    if not view_counter.due(get_config()):
+        return
+    # inside a transaction the views would be rolled back with it, e.g. in a TestCase
+    if any(connections[alias].in_atomic_block for alias in view_counter.aliases()):
+        return
+    view_counter.flush()
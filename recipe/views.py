@@ -1,14 +1,118 @@
 from rest_framework.decorators import action  # to add custom action to your viewset
 from rest_framework.response import Response  # for returning a custom response
 from rest_framework import viewsets, mixins, status
+from rest_framework.views import APIView
 from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
+from rest_framework.exceptions import NotFound, ValidationError
+from django.conf import settings
+from django.core import signing
+from django.db.models import Count, Q, Value
+from django.utils import timezone
+from datetime import datetime, timedelta
 
-from main_app.models import Tag, Ingredient, Recipe
+from main_app.models import Tag, Ingredient, Recipe, Tombstone, UploadSession, recipe_image_file_path
+from main_app import sharding
 from .serializers import *
+from . import bulk, typeahead, uploads
+from .view_counts import view_counter
+from core.throttling import UploadThrottle
 
+# query parameter -> lookup of the recipe range filters
+RECIPE_RANGE_FILTERS = {
+    'price_min': 'price__gte',
+    'price_max': 'price__lte',
+    'time_max': 'time_minutes__lte',
+}
+# query parameter -> id array of the recipe, ?tags=1,2 lists recipes with tag 1 or 2
+RECIPE_ID_FILTERS = {
+    'tags': 'tag_ids',
+    'ingredients': 'ingredient_ids',
+}
+# ?ordering= value -> field, every one has a (user, field) index on the recipe table
+RECIPE_ORDERINGS = {
+    'price': 'price',
+    'time_minutes': 'time_minutes',
+    'title': 'title',
+    'id': 'id',
+    'popularity': 'view_count',
+}
 
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
+
+class UserShardMixin:
+    """Route the catalog queries of the request to the shard of the authenticated user"""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)  # authenticates the user
+        self._shard_token = sharding.activate(request.user)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # the worker thread serves the next request with the same context, reset it here
+        sharding.deactivate(getattr(self, '_shard_token', None))
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class SparseFieldsetMixin:
+    """
+    Support ?fields=a,b and ?exclude=c on read requests.
+    the serializer drops the fields that were not asked for, and the queryset
+    only loads the matching columns and only prefetches the requested relations.
+    """
+
+    def get_requested_fields(self):
+        """Return the serializer field names asked for, or None for all of them"""
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = None
+            params = self.request.query_params
+            # on writes the serializer fields are also the input fields, so we never trim them
+            if self.request.method in SAFE_METHODS and ('fields' in params or 'exclude' in params):
+                names = self.get_serializer_class().Meta.fields
+                if params.get('fields'):
+                    wanted = set(params['fields'].split(','))
+                    names = [name for name in names if name in wanted]
+                if params.get('exclude'):
+                    unwanted = set(params['exclude'].split(','))
+                    names = [name for name in names if name not in unwanted]
+                self._requested_fields = tuple(names)
+
+        return self._requested_fields
+
+    def get_serializer(self, *args, **kwargs):
+        """Pass the requested fields on to the serializer"""
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def trim_queryset(self, queryset):
+        """Only load the columns and relations the response is going to use"""
+        # actions that respond with another model only look the object up
+        meta = self.get_serializer_class().Meta
+        if self.request.method not in SAFE_METHODS or meta.model is not queryset.model:
+            return queryset
+
+        names = self.get_requested_fields()
+        if names is None:
+            names = meta.fields
+
+        columns, relations = [], []
+        id_arrays = getattr(meta, 'id_arrays', {})
+        for name in names:
+            field = queryset.model._meta.get_field(name)
+            if name in id_arrays:
+                columns.append(id_arrays[name])
+            elif field.many_to_many:
+                relations.append(name)
+            elif field.concrete:
+                columns.append(name)
+
+        # the primary key is always loaded by only(), an empty list would mean "all fields"
+        return queryset.only('pk', *columns).prefetch_related(*relations)
+
+
+class BaseRecipeAttrViewSet(UserShardMixin,
+                            SparseFieldsetMixin,
+                            viewsets.GenericViewSet,
                             mixins.ListModelMixin,
                             mixins.CreateModelMixin):
     """Base viewset for user owned recipe attributes"""
@@ -17,7 +121,20 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
 
     def get_queryset(self):
         """Return objects for the current authenticated user only"""
-        return self.queryset.filter(user=self.request.user).order_by('-name')
+        queryset = self.queryset.filter(user=self.request.user).order_by('-name')
+        return self.trim_queryset(queryset)
+
+    def list(self, request, *args, **kwargs):
+        """?prefix= is answered from the in-memory typeahead index, the most used names first"""
+        if 'prefix' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        try:
+            limit = min(int(request.query_params.get('limit', typeahead.DEFAULT_LIMIT)), typeahead.MAX_LIMIT)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be a number.'})
+        matches = typeahead.search(self.queryset.model, request.user.pk, request.query_params['prefix'], limit)
+        return Response([{'id': pk, 'name': name} for pk, name in matches])
 
     def perform_create(self, serializer):
         """Create a new objects of model"""
@@ -36,7 +153,7 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     serializer_class = IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(UserShardMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """Manage recipes in the database"""
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
@@ -46,25 +163,69 @@ class RecipeViewSet(viewsets.ModelViewSet):
     # get_queryset is a default action of django view
     def get_queryset(self):
         """Retrieve the recipe for the authenticated user"""
-        return self.queryset.filter(user=self.request.user)
+        queryset = self.queryset.filter(user=self.request.user)
+        if self.request.method in SAFE_METHODS:
+            queryset = self.filter_recipes(queryset)
+        return self.trim_queryset(queryset)
+
+    def filter_recipes(self, queryset):
+        """Apply the range and id filters and the ordering given in the query parameters"""
+        params = self.request.query_params
+
+        for param, lookup in RECIPE_RANGE_FILTERS.items():
+            if params.get(param):
+                try:
+                    queryset = queryset.filter(**{lookup: int(params[param])})
+                except ValueError:
+                    raise ValidationError({param: 'Must be a number.'})
+
+        for param, column in RECIPE_ID_FILTERS.items():
+            if params.get(param):
+                try:
+                    ids = [int(value) for value in params[param].split(',')]
+                except ValueError:
+                    raise ValidationError({param: 'Must be a comma separated list of ids.'})
+                queryset = queryset.filter(**{column + '__overlaps': ids})
+
+        ordering = params.get('ordering', 'id')
+        if ordering.lstrip('-') not in RECIPE_ORDERINGS:
+            raise ValidationError({'ordering': f'Must be one of {", ".join(RECIPE_ORDERINGS)}.'})
+        descending = ordering.startswith('-')
+        field = ('-' if descending else '') + RECIPE_ORDERINGS[ordering.lstrip('-')]
+        if ordering.lstrip('-') == 'id':
+            return queryset.order_by(field)
+        # the id makes the order stable between pages of equal values
+        return queryset.order_by(field, '-id' if descending else 'id')
 
     # get_serializer_class is a default action of django view
     def get_serializer_class(self):
         """Return appropriate serializer class"""
         if self.action == 'retrieve':  # action is being used for our current request action
             return RecipeDetailSerializer
-        elif self.action == 'upload_image':
+        elif self.action in ('upload_image', 'finish_upload'):
             return RecipeImageSerializer
+        elif self.action in ('start_upload', 'upload_chunk'):
+            return UploadSessionSerializer
+        elif self.action == 'bulk':
+            if self.request.method == 'DELETE':
+                return RecipeBulkDeleteSerializer
+            return RecipeBulkUpdateSerializer
 
         return self.serializer_class
 
+    def retrieve(self, request, *args, **kwargs):
+        """Return a recipe, counting the view towards its popularity"""
+        recipe = self.get_object()
+        view_counter.add(recipe)  # only in memory, see recipe/view_counts.py
+        return Response(self.get_serializer(recipe).data)
+
     # perform_create is a default action of django view
     def perform_create(self, serializer):
         """Create a new recipe"""
         serializer.save(user=self.request.user)
 
     # to create our custom action in view
-    @action(methods=['POST'], detail=True, url_path='upload-image')  # the url name
+    @action(methods=['POST'], detail=True, url_path='upload-image', throttle_classes=(UploadThrottle,))  # the url name
     # this action only accept post method request,
     # and you're only going to be able to upload image for "a created recipe" because of detail=True
     def upload_image(self, request, pk=None):  # pk that is passed in with the url: site/recipe/3/upload-image/
@@ -87,3 +248,293 @@ class RecipeViewSet(viewsets.ModelViewSet):
             data=serializer.errors,  # it creates all the fields have error
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    # ------------------------------------------------ resumable image uploads
+    # POST uploads/ -> PUT uploads/<id>/ for every chunk -> POST uploads/<id>/finalize/
+    # the uploads count towards the uploads throttle of the user, not the writes
+    def get_upload_session(self, recipe, session_id):
+        try:
+            return uploads.active_sessions().get(pk=session_id, recipe=recipe, user=self.request.user)
+        except UploadSession.DoesNotExist:
+            raise NotFound('No such upload, or it expired.')
+
+    @action(methods=['POST'], detail=True, url_path='uploads', throttle_classes=(UploadThrottle,))
+    def start_upload(self, request, pk=None):
+        """Start a resumable upload of the recipe image"""
+        recipe = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        filename = serializer.validated_data.pop('filename')
+        serializer.save(user=request.user, recipe=recipe, image=recipe_image_file_path(recipe, filename))
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(
+        methods=['GET', 'PUT'], detail=True, url_path=r'uploads/(?P<session_id>[0-9a-f-]{36})',
+        throttle_classes=(UploadThrottle,)
+    )
+    def upload_chunk(self, request, pk=None, session_id=None):
+        """Report how far the upload got (GET), or write the next chunk of it (PUT)"""
+        recipe = self.get_object()
+        session = self.get_upload_session(recipe, session_id)
+
+        if request.method == 'PUT':
+            start, length = uploads.parse_content_range(request.headers.get('Content-Range'), session.size)
+            if int(request.META.get('CONTENT_LENGTH') or 0) != length:
+                raise ValidationError({'content_range': 'The Content-Length does not match the range.'})
+            try:
+                # the raw body is read in pieces, request.data would buffer all of it
+                uploads.write_chunk(session, request.stream, start, length)
+            except uploads.ChunkConflict as error:
+                return Response(
+                    {'detail': 'The chunk does not start at the current offset.', 'received': error.offset},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+        return Response(self.get_serializer(session).data, status=status.HTTP_200_OK)
+
+    @action(
+        methods=['POST'], detail=True, url_path=r'uploads/(?P<session_id>[0-9a-f-]{36})/finalize',
+        throttle_classes=(UploadThrottle,)
+    )
+    def finish_upload(self, request, pk=None, session_id=None):
+        """Make the completely uploaded file the image of the recipe"""
+        recipe = self.get_object()
+        session = self.get_upload_session(recipe, session_id)
+        recipe = uploads.finalize(session)
+        return Response(self.get_serializer(recipe).data, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """List the recipes of the user most similar to this one by tags and ingredients"""
+        recipe = self.get_object()
+        try:
+            k = min(max(int(request.query_params.get('k', 10)), 1), 100)
+        except ValueError:
+            return Response(data={'k': 'Must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        from . import similarity  # imports numpy, so only on first use
+        ranking = similarity.similar_recipes(request.user.id, recipe.id, k)
+        scores = dict(ranking)
+        recipes = self.get_queryset().in_bulk(scores.keys())
+
+        # in_bulk loses the ranking order, and recipes deleted since the index was built are skipped
+        ranked = [recipes[recipe_id] for recipe_id, _ in ranking if recipe_id in recipes]
+        data = self.get_serializer(ranked, many=True).data
+        for item, similar_recipe in zip(data, ranked):
+            item['similarity'] = round(scores[similar_recipe.id], 4)
+        return Response(data=data, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=False)
+    def facets(self, request):
+        """Count the tags and ingredients of the recipes matching the current filters"""
+        recipe_ids = self.get_queryset().values('pk')
+
+        facets = []
+        for name, kind in (('tags', 'tag'), ('ingredients', 'ingredient')):
+            field = Recipe._meta.get_field(name)
+            target = field.m2m_reverse_field_name()
+            facets.append(
+                field.remote_field.through.objects
+                .filter(**{field.m2m_field_name() + '__in': recipe_ids})
+                .values(target + '_id', target + '__name')
+                .annotate(kind=Value(kind), count=Count('pk'))
+            )
+        # a single grouped aggregate per through table, sent to the database as one query
+        rows = facets[0].union(facets[1], all=True).order_by('kind', '-count', 'tag__name')
+
+        data = {'tags': [], 'ingredients': []}
+        for row in rows:
+            kind = 'tags' if row['kind'] == 'tag' else 'ingredients'
+            data[kind].append({'id': row['tag_id'], 'name': row['tag__name'], 'count': row['count']})
+        return Response(data=data, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=False)
+    def cookable(self, request):
+        """List the recipes that can be cooked with the given ingredients, then the near misses"""
+        try:
+            on_hand = [int(i) for i in request.query_params.get('ingredients', '').split(',') if i]
+            max_missing = min(max(int(request.query_params.get('max_missing', 2)), 0), 10)
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 200)
+        except ValueError:
+            return Response(
+                data={'detail': 'ingredients, max_missing and limit must be numbers.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        from . import cookable  # imports numpy, so only on first use
+        results = cookable.cookable_recipes(request.user.id, on_hand, max_missing, limit)
+        recipes = self.get_queryset().in_bulk([recipe_id for recipe_id, _ in results])
+
+        ranked = [(recipes[recipe_id], missing) for recipe_id, missing in results if recipe_id in recipes]
+        data = self.get_serializer([recipe for recipe, _ in ranked], many=True).data
+        for item, (_, missing) in zip(data, ranked):
+            item['missing'] = missing
+        return Response(data=data, status=status.HTTP_200_OK)
+
+    @action(methods=['PATCH', 'DELETE'], detail=False, url_path='bulk')
+    def bulk(self, request):
+        """Update or delete many recipes of the user in one transaction"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        if request.method == 'DELETE':
+            deleted = bulk.bulk_delete_recipes(
+                request.user,
+                recipe_ids=data.get('ids'),
+                recipe_filter=data.get('filter')
+            )
+            return Response(data={'deleted': deleted}, status=status.HTTP_200_OK)
+
+        if 'items' in data:
+            updated = bulk.bulk_update_recipes(
+                request.user,
+                [(item['id'], item['changes']) for item in data['items']]
+            )
+        else:
+            updated = bulk.bulk_patch_recipes(request.user, data['filter'], data['patch'])
+        return Response(data={'updated': updated}, status=status.HTTP_200_OK)
+
+
+class SyncView(UserShardMixin, APIView):
+    """
+    Return the recipes, tags and ingredients changed since the given sync token,
+    the ids of the ones deleted since then, and the token for the next sync.
+    without a token, or with a token older than RECIPE_SYNC_MAX_AGE_DAYS (the tombstones
+    of its deletes may be pruned by then), everything of the user is returned and
+    'full' is true: the client replaces what it has with the pages of this sync.
+
+    a sync returns at most RECIPE_SYNC_PAGE_SIZE objects and deleted ids per page.
+    while 'has_more' is true the token is the one of the next page, which continues
+    from the same snapshot, the last page returns the token of the next sync.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    token_salt = 'recipe.sync'
+    kinds = (
+        ('recipes', Recipe, RecipeSerializer),
+        ('tags', Tag, TagSerializer),
+        ('ingredients', Ingredient, IngredientSerializer),
+    )
+
+    def read_token(self, token):
+        """
+        Return (since, until, after) of the sync the token continues. the token of a
+        next sync is the time it starts from, the token of a next page is the state of its sync
+        """
+        state = signing.loads(token, salt=self.token_salt)
+        if isinstance(state, str):
+            return datetime.fromisoformat(state), None, {}
+        since = state['since'] and datetime.fromisoformat(state['since'])
+        return since, datetime.fromisoformat(state['until']), state['after']
+
+    def get(self, request):
+        since, until, after = None, None, {}
+        if request.query_params.get('since'):
+            try:
+                since, until, after = self.read_token(request.query_params['since'])
+            except (signing.BadSignature, KeyError, TypeError, ValueError):
+                return Response(data={'since': 'Invalid sync token.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        if since is not None and since < now - timedelta(days=getattr(settings, 'RECIPE_SYNC_MAX_AGE_DAYS', 30)):
+            # the deletes since then may be pruned, start over with everything
+            since, until, after = None, None, {}
+        if until is None:
+            # the first page fixes the snapshot the other pages of the sync continue
+            until = now
+        limit = getattr(settings, 'RECIPE_SYNC_PAGE_SIZE', 1000)
+
+        data, more = {}, False
+        for key, model, serializer_class in self.kinds:
+            # served by the (user, updated_at) index of every table
+            queryset = model.objects.filter(user=request.user, updated_at__lt=until)
+            if since is not None:
+                queryset = queryset.filter(updated_at__gte=since)
+            if key in after:
+                updated_at, pk = datetime.fromisoformat(after[key][0]), after[key][1]
+                queryset = queryset.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=pk))
+            # one more than fits, to know whether there is a next page
+            objs = list(queryset.order_by('updated_at', 'id')[:limit + 1])
+            more = more or len(objs) > limit
+            objs = objs[:limit]
+            if objs:
+                after[key] = [objs[-1].updated_at.isoformat(), objs[-1].id]
+            data[key] = serializer_class(objs, many=True, context={'request': request}).data
+            limit -= len(objs)
+
+        deleted = {'recipes': [], 'tags': [], 'ingredients': []}
+        if since is not None:
+            tombstones = list(Tombstone.objects.filter(
+                user_id=request.user.id, deleted_at__gte=since, deleted_at__lt=until, id__gt=after.get('deleted', 0)
+            ).order_by('id').values_list('id', 'model', 'object_id')[:limit + 1])
+            more = more or len(tombstones) > limit
+            tombstones = tombstones[:limit]
+            keys = {Tombstone.RECIPE: 'recipes', Tombstone.TAG: 'tags', Tombstone.INGREDIENT: 'ingredients'}
+            for _, model, object_id in tombstones:
+                deleted[keys[model]].append(object_id)
+            if tombstones:
+                after['deleted'] = tombstones[-1][0]
+        data['deleted'] = deleted
+
+        if more:
+            token = {'since': since and since.isoformat(), 'until': until.isoformat(), 'after': after}
+        else:
+            # a write that is still in flight now may commit with a slightly older updated_at,
+            # so the next sync starts a bit earlier. clients upsert, so repeats are harmless.
+            token = (until - timedelta(seconds=getattr(settings, 'RECIPE_SYNC_OVERLAP_SECONDS', 5))).isoformat()
+        data['token'] = signing.dumps(token, salt=self.token_salt)
+        data['has_more'] = more
+        data['full'] = since is None
+        return Response(data=data, status=status.HTTP_200_OK)
+
+
+class MealPlanView(UserShardMixin, APIView):
+    """
+    Plan ?days= of the user's recipes with as many different tags and ingredients as
+    possible, costing at most ?budget= together, each one done in ?max_time= minutes,
+    and optionally only recipes with one of the ?tags=.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        params = request.query_params
+        max_days = getattr(settings, 'RECIPE_PLAN_MAX_DAYS', 31)
+        limits = {'days': 7, 'budget': None, 'max_time': None}
+        for param in limits:
+            if params.get(param):
+                try:
+                    limits[param] = int(params[param])
+                except ValueError:
+                    raise ValidationError({param: 'Must be a number.'})
+                if limits[param] < 0:
+                    raise ValidationError({param: 'Must not be negative.'})
+        if not 1 <= limits['days'] <= max_days:
+            raise ValidationError({'days': f'Must be between 1 and {max_days}.'})
+
+        queryset = Recipe.objects.filter(user=request.user)
+        if limits['max_time'] is not None:
+            queryset = queryset.filter(time_minutes__lte=limits['max_time'])
+        if params.get('tags'):
+            try:
+                tags = [int(value) for value in params['tags'].split(',')]
+            except ValueError:
+                raise ValidationError({'tags': 'Must be a comma separated list of ids.'})
+            queryset = queryset.filter(tag_ids__overlaps=tags)
+
+        # the planner keeps searching until its time is up, but never past half of
+        # what is left of the request deadline, the other half is for the response
+        seconds = getattr(settings, 'RECIPE_PLAN_TIME_BUDGET_MS', 200) / 1000
+        deadline = getattr(request, 'deadline', None)
+        if deadline is not None:
+            seconds = min(seconds, max(deadline.remaining() / 2, 0))
+
+        from . import planner  # imports numpy, so only on first use
+        plan = planner.plan_meals(queryset, limits['days'], limits['budget'], seconds)
+
+        recipe_ids = plan.pop('recipe_ids')
+        recipes = Recipe.objects.filter(user=request.user).in_bulk(recipe_ids)
+        serializer = RecipeSerializer([recipes[pk] for pk in recipe_ids], many=True, context={'request': request})
+        data = {'recipes': serializer.data, **plan}
+        return Response(data=data, status=status.HTTP_200_OK)
@@ -5,16 +5,22 @@ from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 from rest_framework import generics, authentication, permissions
 
+from core.throttling import LoginThrottle, LoginAccountThrottle, SignupThrottle
+
 
 class CreateUserView(generics.CreateAPIView):
     """Create a new user in system"""
     serializer_class = UserSerializer
+    # hashing the password is expensive, see core/throttling.py
+    throttle_classes = (SignupThrottle,)
 
 
 class CreateTokenView(ObtainAuthToken):
     """Create a new auth token for user"""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    # every attempt checks a password hash
+    throttle_classes = (LoginThrottle, LoginAccountThrottle)
 
 
 class ManageUserView(generics.RetrieveUpdateAPIView):